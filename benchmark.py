@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018-2023 Johan Cockx, Matic Kukovec and Kristof Mulier.
+"""
+# SUMMARY:
+# End-to-end startup benchmark for the Child App. It measures the time from spawning the child -
+# just like the buttons 'SPAWN CHILD (PYTHON)' and 'SPAWN CHILD (EXECUTABLE)' in the Parent App do
+# - until the child's MainWindow got painted for the first time. The child signals its first paint
+# through the readiness handshake (see 'functions.notify_ready()').
+#
+# The benchmark runs headless: it starts a virtual X server (Xvfb) if there is no display, and can
+# put Qt on the 'offscreen' platform. It measures every combination of:
+#   - live script vs frozen child
+#   - each installed terminal emulator from 'functions.linux_terminal_emulators'
+#   - cold vs warm page cache
+# and writes the results as JSON, with percentiles.
+#
+#     $ python benchmark.py [--runs N] [--mode live frozen] [--terminal xterm ...]
+#                           [--cache warm cold] [--drop-all-caches] [--qpa offscreen]
+#                           [--output results.json]
+#
+# With '--fast-start-report', it compares the startup of the live child with and without the
+# fast-start profile instead (see 'functions.get_fast_start_report()'). No terminal is involved.
+from __future__ import annotations
+from typing import *
+import sys, os, platform, argparse, json, time, math, shutil, subprocess, contextlib, statistics
+import importlib.util
+import functions
+q = "'"
+
+def get_terminal_spawner_folderpath() -> str:
+    '''
+    Get the path to the 'terminal_spawner' folder.
+    '''
+    return os.path.dirname(os.path.realpath(__file__)).replace('\\', '/')
+
+def get_child_target(mode:str) -> str:
+    '''
+    Return the path to the Child App for the given mode: 'live' or 'frozen'.
+    '''
+    if mode == 'live':
+        return f'{get_terminal_spawner_folderpath()}/child_app.py'
+    executable_name = 'child_app.exe' if platform.system().lower() == 'windows' else 'child_app'
+    # Prefer the shared tree from 'build.py --shared'
+    for folder_name in ('frozen_apps', 'frozen_child_app'):
+        executable_path = f'{get_terminal_spawner_folderpath()}/{folder_name}/{executable_name}'
+        if os.path.isfile(executable_path):
+            break
+        continue
+    return executable_path
+
+def get_child_files(mode:str, terminal:Optional[str]) -> List[str]:
+    '''
+    Return the files and folders that need to be loaded to start the Child App in the given mode.
+    These get evicted from the page cache for cold runs.
+    '''
+    paths:List[str] = []
+    if mode == 'live':
+        paths.append(get_child_target(mode))
+        paths.append(f'{get_terminal_spawner_folderpath()}/functions.py')
+        paths.append(os.path.realpath(sys.executable))
+        paths.append(os.path.dirname(os.__file__))
+        spec = importlib.util.find_spec('PyQt6')
+        if spec is not None and spec.submodule_search_locations:
+            paths.extend(spec.submodule_search_locations)
+    else:
+        paths.append(os.path.dirname(get_child_target(mode)))
+    if terminal is not None and shutil.which(terminal):
+        paths.append(str(shutil.which(terminal)))
+    return paths
+
+def summarize(samples:List[float]) -> Dict[str, Optional[float]]:
+    '''
+    Return statistics about the given samples (in seconds): count, min, mean, stdev, max and the
+    50th, 90th, 95th and 99th percentiles (linear interpolation between closest ranks).
+    '''
+    s = sorted(samples)
+    def percentile(p:float) -> Optional[float]:
+        if len(s) == 0:
+            return None
+        k = (len(s) - 1) * p / 100
+        lower, upper = math.floor(k), math.ceil(k)
+        return s[lower] + (s[upper] - s[lower]) * (k - lower)
+    return {
+        'count' : len(s),
+        'min'   : s[0] if s else None,
+        'mean'  : statistics.fmean(s) if s else None,
+        'stdev' : statistics.stdev(s) if len(s) > 1 else None,
+        'p50'   : percentile(50),
+        'p90'   : percentile(90),
+        'p95'   : percentile(95),
+        'p99'   : percentile(99),
+        'max'   : s[-1] if s else None,
+    }
+
+def measure_spawn_to_first_paint(target:str,
+                                 terminal:Optional[str],
+                                 timeout:float,
+                                 ) -> Optional[float]:
+    '''
+    Spawn the Child App once and return the seconds until its first paint, or None if it didn't get
+    there within the timeout.
+    '''
+    handle = functions.spawn_new_terminal(
+        target,
+        ['--exit-after-paint'],
+        handshake = True,
+        terminal  = terminal,
+    )
+    latency:Optional[float] = None
+    if handle.wait_ready(timeout):
+        latency = handle.ready_latency
+    # The child quits by itself after its first paint. Don't leave anything behind if it didn't.
+    try:
+        handle.wait(timeout)
+    except subprocess.TimeoutExpired:
+        handle.process.kill()
+        handle.wait()
+    return latency
+
+def start_virtual_display() -> Optional[subprocess.Popen]:
+    '''
+    Start Xvfb on a free display number and point $DISPLAY to it. Return None if Xvfb is not
+    installed.
+    '''
+    xvfb_path = shutil.which('Xvfb')
+    if xvfb_path is None:
+        return None
+    read_fd, write_fd = os.pipe()
+    process = subprocess.Popen(
+        [xvfb_path, '-displayfd', str(write_fd), '-nolisten', 'tcp', '-screen', '0', '1920x1080x24'],
+        pass_fds = (write_fd,),
+        stdout   = subprocess.DEVNULL,
+        stderr   = subprocess.DEVNULL,
+    )
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        display = f.readline().strip()
+    if display == '':
+        process.kill()
+        process.wait()
+        return None
+    os.environ['DISPLAY'] = f':{display}'
+    return process
+
+def run_benchmark(modes:List[str],
+                  terminals:List[Optional[str]],
+                  caches:List[str],
+                  runs:int,
+                  timeout:float,
+                  drop_all_caches:bool = False,
+                  ) -> Dict[str, Any]:
+    '''
+    Run all combinations and return the results as a json-serializable dictionary. For cold runs,
+    the child's files are evicted from the page cache. With 'drop_all_caches', the whole page cache
+    is dropped instead (requires root).
+    '''
+    results:List[Dict[str, Any]] = []
+    cache_methods:Set[str] = set()
+    for mode in modes:
+        target = get_child_target(mode)
+        if not os.path.exists(target):
+            print(f'WARNING: {q}{target}{q} not found, skipping mode {q}{mode}{q}', file=sys.stderr)
+            continue
+        for terminal in terminals:
+            for cache in caches:
+                print(f'Benchmarking {mode} child in {terminal or "default terminal"}, {cache} cache ...', file=sys.stderr)
+                # Warm-up run, not measured
+                if cache == 'warm':
+                    measure_spawn_to_first_paint(target, terminal, timeout)
+                samples:List[float] = []
+                failures = 0
+                for _ in range(runs):
+                    if cache == 'cold':
+                        cache_methods.add(functions.evict_page_cache(
+                            get_child_files(mode, terminal), drop_all_caches
+                        ))
+                    latency = measure_spawn_to_first_paint(target, terminal, timeout)
+                    if latency is None:
+                        failures += 1
+                    else:
+                        samples.append(latency)
+                    continue
+                results.append({
+                    'mode'     : mode,
+                    'terminal' : terminal,
+                    'cache'    : cache,
+                    'failures' : failures,
+                    'samples'  : samples,
+                    'summary'  : summarize(samples),
+                })
+                continue
+            continue
+        continue
+    return {
+        'meta' : {
+            'timestamp'     : time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'platform'      : platform.platform(),
+            'python'        : sys.version,
+            'qpa_platform'  : os.environ.get('QT_QPA_PLATFORM'),
+            'display'       : os.environ.get('DISPLAY'),
+            'runs'          : runs,
+            'cache_methods' : sorted(cache_methods),
+        },
+        'results' : results,
+    }
+
+if __name__ == '__main__':
+    #$ Parse arguments
+    parser = argparse.ArgumentParser(description='Child App startup benchmark.')
+    parser.add_argument('--runs', type=int, default=10, help='Measured runs per combination')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Seconds to wait for each child')
+    parser.add_argument(
+        '--mode',
+        nargs   = '+',
+        choices = ['live', 'frozen'],
+        default = ['live', 'frozen'],
+        help    = 'Run the child as live python script and/or as frozen executable',
+    )
+    parser.add_argument(
+        '--terminal',
+        nargs   = '+',
+        default = None,
+        help    = 'Terminal emulators to measure. Default: all installed ones.',
+    )
+    parser.add_argument(
+        '--cache',
+        nargs   = '+',
+        choices = ['warm', 'cold'],
+        default = ['warm', 'cold'],
+        help    = 'Measure with a warm and/or cold page cache',
+    )
+    parser.add_argument(
+        '--drop-all-caches',
+        action = 'store_true',
+        help   = "Drop the whole page cache for cold runs, not only the child's files (requires root)",
+    )
+    parser.add_argument(
+        '--qpa',
+        type    = str,
+        default = None,
+        help    = f'Qt platform for the child, eg. {q}offscreen{q}',
+    )
+    parser.add_argument('--output', type=str, default=None, help='Write the JSON here instead of to stdout')
+    parser.add_argument(
+        '--fast-start-report',
+        action = 'store_true',
+        help   = 'Measure the startup gain of the fast-start profile for the live child',
+    )
+    args = parser.parse_args()
+
+    #$ Headless setup
+    xvfb:Optional[subprocess.Popen] = None
+    if platform.system().lower() == 'linux' and not os.environ.get('DISPLAY'):
+        xvfb = start_virtual_display()
+        if xvfb is None:
+            print('WARNING: No display and no Xvfb. Terminal emulators will likely fail.', file=sys.stderr)
+    if args.qpa is not None:
+        os.environ['QT_QPA_PLATFORM'] = args.qpa
+
+    #$ Run
+    terminals:List[Optional[str]] = [None]
+    if platform.system().lower() == 'linux':
+        terminals = list(args.terminal or functions.get_installed_terminal_emulators())
+    try:
+        # Keep stdout clean for the JSON output
+        with contextlib.redirect_stdout(sys.stderr):
+            if args.fast_start_report:
+                report = functions.get_fast_start_report(
+                    get_child_target('live'), ['--exit-after-paint'], args.runs, args.timeout
+                )
+            else:
+                report = run_benchmark(
+                    args.mode, terminals, args.cache, args.runs, args.timeout, args.drop_all_caches
+                )
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+            xvfb.wait()
+
+    #$ Output
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    sys.exit(0)
@@ -5,16 +5,32 @@ Copyright 2018-2023 Johan Cockx, Matic Kukovec and Kristof Mulier.
 # SUMMARY:
 # This script should be invoked to build the main application in 'main.py' with cx_freeze.
 from __future__ import annotations
-import sys, os, platform, shutil, inspect, argparse
+from typing import *
+import sys, os, platform, shutil, inspect, argparse, ast, importlib.util, json, hashlib, marshal
+import struct, zipfile
+import concurrent.futures
 q = "'"
 no_console: bool = False
 
+# Build profiles:
+#   - 'full':    Force the same set of additional modules into every freeze (PyQt6.Qsci,
+#                PyQt6.QtTest, PyQt6.QtWebEngineWidgets, ...), whether the app uses them or not.
+#   - 'minimal': Only include what the app actually imports. All other PyQt6 modules are excluded,
+#                which keeps huge libraries like QtWebEngine out of the frozen folder.
+build_profiles = ('minimal', 'full', )
+
 def build(main_script_path:str,
           executable_name:str,
           output_freeze_folder:str,
-          ) -> None:
+          profile:str = 'full',
+          cache_folder:Optional[str] = None,
+          report:bool = True,
+          incremental:bool = False,
+          extra_executables:Optional[List[Tuple[str, str]]] = None,
+          ) -> Optional[Dict[str, Any]]:
     '''
-    Build the main python script with cx_freeze into an executable.
+    Build the main python script with cx_freeze into an executable. Return a report on the result,
+    see 'get_build_report()'.
 
     :param main_script_path:     The path to the main python script.
 
@@ -22,12 +38,30 @@ def build(main_script_path:str,
                                  or '<application>.exe'.
 
     :param output_freeze_folder: The folder where the build output will be placed.
+
+    :param profile:              One of 'build_profiles'.
+
+    :param cache_folder:         Content-addressed build cache, shared by all builds. If a build
+                                 with the same inputs (see 'get_build_manifest()') was stored in
+                                 there, its output gets restored from the cache without freezing.
+                                 Otherwise, the output is stored in there after the freeze.
+                                 Identical files (shared libraries, module archives, ...) are
+                                 hardlinked to a single copy. None to disable.
+
+    :param report:               Measure the output and return a report. Otherwise, return None.
+
+    :param incremental:          Compare the inputs with the manifest of the previous build. Skip
+                                 the build if nothing changed. If only project sources changed,
+                                 update their bytecode in the output folder in place. Otherwise, do
+                                 a full build.
+
+    :param extra_executables:    More '(main_script_path, executable_name)' pairs to freeze into
+                                 the same output folder. All executables then share a single copy
+                                 of the Python runtime and libraries in 'lib/'.
     '''
     import cx_Freeze
-
-    #& Delete previous build
-    if os.path.isdir(output_freeze_folder):
-        shutil.rmtree(output_freeze_folder)
+    assert profile in build_profiles
+    scripts = [(main_script_path, executable_name), *(extra_executables or [])]
 
     #& Additional modules
     modules = [
@@ -54,6 +88,12 @@ def build(main_script_path:str,
                 'pwd',
             ]
         )
+    excludes = ['tkinter']
+    if profile == 'minimal':
+        imported_modules = set().union(*[find_imports(s) for s, _ in scripts])
+        unused_qt_modules = [m for m in get_pyqt6_modules() if m not in imported_modules]
+        modules = [m for m in modules if m in imported_modules and m not in unused_qt_modules]
+        excludes.extend(unused_qt_modules)
 
     #& Executables
     base = None
@@ -63,25 +103,55 @@ def build(main_script_path:str,
         else:
             print('ERROR: --no-console is only supported on Windows. Exiting ...')
             sys.exit(1)
+
+    #& Incremental build
+    manifest = get_build_manifest(scripts, profile, modules, excludes, base)
+    if incremental and update_incrementally(output_freeze_folder, manifest):
+        if cache_folder is not None:
+            store_in_cache(output_freeze_folder, cache_folder, manifest)
+        if not report:
+            return None
+        return get_build_report(output_freeze_folder, executable_name, profile)
+
+    #& Build cache
+    if cache_folder is not None and restore_from_cache(
+        output_freeze_folder, cache_folder, manifest
+    ):
+        print(f'{output_freeze_folder} restored from {cache_folder}')
+        write_build_manifest(output_freeze_folder, manifest)
+        if not report:
+            return None
+        return get_build_report(output_freeze_folder, executable_name, profile)
+
+    #& Delete previous build
+    if os.path.isdir(output_freeze_folder):
+        shutil.rmtree(output_freeze_folder)
+
+    #& Executables
     executables = [
         cx_Freeze.Executable(
-            main_script_path,
+            script_path,
             init_script = None,
             base        = base,
-            icon        = f'{os.path.dirname(main_script_path)}/icon.ico'.replace('\\', '/'),
-            target_name = executable_name,
-        ),
+            icon        = f'{os.path.dirname(script_path)}/icon.ico'.replace('\\', '/'),
+            target_name = target_name,
+        )
+        for script_path, target_name in scripts
     ]
 
     #& Search paths
     search_paths = [p.replace('\\', '/') for p in sys.path]
-    search_paths.append(os.path.dirname(main_script_path).replace('\\', '/'))
+    for script_path, _ in scripts:
+        folderpath = os.path.dirname(script_path).replace('\\', '/')
+        if folderpath not in search_paths:
+            search_paths.append(folderpath)
+        continue
 
     #& Invoke Freezer()
     freezer = cx_Freeze.Freezer(
         executables   = executables, # noqa
         includes      = modules,
-        excludes      = ['tkinter'],
+        excludes      = excludes,
         replace_paths = [],
         compress      = True,
         optimize      = 2,
@@ -93,8 +163,507 @@ def build(main_script_path:str,
         include_msvcr = True,
     )
     freezer.freeze()
+
+    #& Store the output in the build cache
+    if cache_folder is not None:
+        store_in_cache(output_freeze_folder, cache_folder, manifest)
+    write_build_manifest(output_freeze_folder, manifest)
+    if not report:
+        return None
+    return get_build_report(output_freeze_folder, executable_name, profile)
+
+def build_all(jobs:List[Dict[str, Any]],
+              max_workers:Optional[int] = None,
+              cache_folder:Optional[str] = None,
+              incremental:bool = False,
+              ) -> List[Dict[str, Any]]:
+    '''
+    Run the given builds in parallel, in a process pool. Each job is a dictionary with the keyword
+    arguments for 'build()'. Return the build reports, in the same order as the jobs. The reports
+    are made after all builds finished, such that the cold-start measurements don't compete with
+    running builds.
+
+    :param max_workers:  Number of builds running at the same time. Default: the number of cores.
+
+    :param cache_folder: See 'build()'.
+
+    :param incremental:  See 'build()'.
+    '''
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers = max_workers,
+        initializer = set_no_console,
+        initargs    = (no_console,),
+    ) as executor:
+        futures = [
+            executor.submit(
+                build, **job, cache_folder=cache_folder, report=False, incremental=incremental
+            )
+            for job in jobs
+        ]
+        for future in futures:
+            # Raise the exception of a failed build, if any
+            future.result()
+            continue
+    return [
+        get_build_report(
+            job['output_freeze_folder'],
+            job['executable_name'],
+            job.get('profile', 'full'),
+        )
+        for job in jobs
+    ]
+
+# Name of the manifest file that records the inputs of a build, inside its output folder
+build_manifest_filename:str = 'build_manifest.json'
+
+def get_build_manifest(scripts:List[Tuple[str, str]],
+                       profile:str,
+                       modules:List[str],
+                       excludes:List[str],
+                       base:Optional[str],
+                       ) -> Dict[str, Any]:
+    '''
+    Return a description of all inputs of a build. Two builds with the same manifest produce the
+    same output. The 'sources' are the project's own python files. All other entries - interpreter,
+    cx_Freeze, module lists, imports and options - require a full build if they change.
+
+    :param scripts: The '(main_script_path, executable_name)' pairs frozen in the build.
+    '''
+    import cx_Freeze
+    icon_paths = sorted(
+        {f'{os.path.dirname(s)}/icon.ico'.replace('\\', '/') for s, _ in scripts}
+    )
+    return {
+        'sources' : {
+            filepath.replace('\\', '/'): hash_file(filepath)
+            for script_path, _ in scripts
+            for filepath in find_local_sources(script_path)
+        },
+        'other' : {
+            'interpreter'    : os.path.realpath(sys.executable),
+            'python_version' : sys.version,
+            'cx_freeze'      : cx_Freeze.__version__,
+            'executables'    : [[s, name] for s, name in scripts],
+            'profile'        : profile,
+            'modules'        : sorted(modules),
+            'excludes'       : sorted(excludes),
+            'imports'        : sorted(set().union(*[find_imports(s) for s, _ in scripts])),
+            'base'           : base,
+            'icons'          : {
+                icon_path: hash_file(icon_path) if os.path.isfile(icon_path) else None
+                for icon_path in icon_paths
+            },
+            'compress'       : True,
+            'optimize'       : 2,
+        },
+    }
+
+def write_build_manifest(output_freeze_folder:str, manifest:Dict[str, Any]) -> None:
+    '''
+    Store the manifest in the output folder. Write it to a new file: the old one can be a hardlink
+    into the build cache, which must not be modified.
+    '''
+    filepath = f'{output_freeze_folder}/{build_manifest_filename}'
+    with open(f'{filepath}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f'{filepath}.tmp', filepath)
+    return
+
+def update_incrementally(output_freeze_folder:str, manifest:Dict[str, Any]) -> bool:
+    '''
+    Bring the previous build up to date with the given manifest, without refreezing. Return False if
+    that's not possible and a full build is needed.
+    '''
+    #& Compare with the previous build
+    try:
+        with open(f'{output_freeze_folder}/{build_manifest_filename}', 'r', encoding='utf-8') as f:
+            previous_manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if previous_manifest.get('other') != manifest['other']:
+        return False
+    if previous_manifest.get('sources', {}).keys() != manifest['sources'].keys():
+        return False
+    changed_sources = [
+        filepath for filepath, digest in manifest['sources'].items()
+        if previous_manifest['sources'][filepath] != digest
+    ]
+    if len(changed_sources) == 0:
+        print(f'{output_freeze_folder} is up to date')
+        return True
+
+    #& Recompile the changed sources into the output
+    main_script_paths = [s for s, _ in manifest['other']['executables']]
+    for source_path in changed_sources:
+        if source_path in main_script_paths:
+            # cx_Freeze stores the main script under a name with '__main__' in it
+            module_name = None
+        else:
+            module_name = os.path.splitext(os.path.basename(source_path))[0]
+        if not replace_frozen_module(output_freeze_folder, module_name, source_path):
+            print(f'Cannot update {q}{source_path}{q} in place, doing a full build')
+            return False
+        print(f'Updated {q}{source_path}{q} in {output_freeze_folder}')
+        continue
+    write_build_manifest(output_freeze_folder, manifest)
+    return True
+
+def replace_frozen_module(output_freeze_folder:str,
+                          module_name:Optional[str],
+                          source_path:str,
+                          ) -> bool:
+    '''
+    Replace the bytecode of a module in the frozen output (in a zip archive, or as a loose .pyc
+    file) by a fresh compilation of its source. For the main script, pass None as module name.
+    Return False if the module can't be found.
+    '''
+    def matches(name:str, data:bytes) -> bool:
+        basename = name.replace('\\', '/').split('/')[-1]
+        if module_name is not None:
+            return basename == f'{module_name}.pyc'
+        return (
+            basename.endswith('.pyc')
+            and '__main__' in basename
+            and code_filename(data) == source_path
+        )
+
+    for dirpath, _, filenames in os.walk(output_freeze_folder):
+        for filename in filenames:
+            filepath = os.path.join(dirpath, filename)
+            #$ Loose .pyc file
+            if filename.endswith('.pyc'):
+                with open(filepath, 'rb') as f:
+                    data = f.read()
+                if matches(filename, data):
+                    with open(f'{filepath}.tmp', 'wb') as f:
+                        f.write(compile_pyc(source_path, code_filename(data) or source_path))
+                    os.replace(f'{filepath}.tmp', filepath)
+                    return True
+                continue
+            #$ Zip archive
+            if not filename.endswith('.zip'):
+                continue
+            with zipfile.ZipFile(filepath) as archive:
+                entries = [
+                    info for info in archive.infolist()
+                    if info.filename.endswith('.pyc') and matches(info.filename, archive.read(info))
+                ] if module_name is None else [
+                    info for info in archive.infolist() if matches(info.filename, b'')
+                ]
+                if len(entries) == 0:
+                    continue
+                entry = entries[0]
+                co_filename = code_filename(archive.read(entry)) or source_path
+                new_data = compile_pyc(source_path, co_filename)
+                # Zip archives can't be modified in place. Rewrite it to a new file.
+                with zipfile.ZipFile(f'{filepath}.tmp', 'w') as new_archive:
+                    for info in archive.infolist():
+                        data = new_data if info.filename == entry.filename else archive.read(info)
+                        new_archive.writestr(info, data, compress_type=info.compress_type)
+                        continue
+            os.replace(f'{filepath}.tmp', filepath)
+            return True
+        continue
+    return False
+
+def code_filename(pyc_data:bytes) -> Optional[str]:
+    '''
+    Return the source filename recorded in the given .pyc data, or None if it can't be read.
+    '''
+    try:
+        return marshal.loads(pyc_data[16:]).co_filename
+    except Exception:
+        return None
+
+def compile_pyc(source_path:str, co_filename:str) -> bytes:
+    '''
+    Compile the given source into .pyc data, with the same optimization level as the freeze.
+    '''
+    with open(source_path, 'rb') as f:
+        source = f.read()
+    code = compile(source, co_filename, 'exec', optimize=2, dont_inherit=True)
+    stat = os.stat(source_path)
+    header = importlib.util.MAGIC_NUMBER + struct.pack(
+        '<III', 0, int(stat.st_mtime) & 0xFFFFFFFF, stat.st_size & 0xFFFFFFFF
+    )
+    return header + marshal.dumps(code)
+
+def set_no_console(value:bool) -> None:
+    '''
+    Set the global 'no_console' variable. Used to pass it on to the worker processes.
+    '''
+    global no_console
+    no_console = value
     return
 
+def get_cache_key(manifest:Dict[str, Any]) -> str:
+    '''
+    Return the key of a build in the build cache: the SHA-256 of its manifest.
+    '''
+    data = json.dumps(manifest, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+def restore_from_cache(output_freeze_folder:str,
+                       cache_folder:str,
+                       manifest:Dict[str, Any],
+                       ) -> bool:
+    '''
+    Recreate the output of a previous build with the same manifest from the cache, without
+    freezing. Return False if the cache doesn't have it (or no longer has all of its files). The
+    files are hardlinked to the cached copies, or copied if the cache is on another filesystem.
+    Symlinks are recreated as symlinks.
+    '''
+    #& Look up the output tree
+    filepath = f'{cache_folder}/trees/{get_cache_key(manifest)}.json'
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            tree = json.load(f)
+        files:Dict[str, str] = tree['files']
+        symlinks:Dict[str, str] = tree['symlinks']
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+    object_paths = {
+        relpath: f'{cache_folder}/objects/{object_name[:2]}/{object_name}'
+        for relpath, object_name in files.items()
+    }
+    if not all(os.path.isfile(object_path) for object_path in object_paths.values()):
+        return False
+
+    #& Rebuild the output next to the old one, then swap them
+    temp_folder = f'{output_freeze_folder}.{os.getpid()}.tmp'
+    if os.path.isdir(temp_folder):
+        shutil.rmtree(temp_folder)
+    try:
+        for relpath, object_path in object_paths.items():
+            filepath = f'{temp_folder}/{relpath}'
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            try:
+                os.link(object_path, filepath)
+            except OSError:
+                shutil.copy2(object_path, filepath)
+            continue
+        for relpath, target in symlinks.items():
+            linkpath = f'{temp_folder}/{relpath}'
+            os.makedirs(os.path.dirname(linkpath), exist_ok=True)
+            os.symlink(target, linkpath)
+            continue
+    except OSError:
+        shutil.rmtree(temp_folder, ignore_errors=True)
+        return False
+    if os.path.isdir(output_freeze_folder):
+        shutil.rmtree(output_freeze_folder)
+    os.replace(temp_folder, output_freeze_folder)
+    return True
+
+def store_in_cache(output_freeze_folder:str,
+                   cache_folder:str,
+                   manifest:Dict[str, Any],
+                   ) -> None:
+    '''
+    Put the output of a build in the cache, under the key of its manifest, such that the next build
+    with the same inputs can restore it with 'restore_from_cache()'.
+    '''
+    files:Dict[str, str] = {}
+    symlinks:Dict[str, str] = {}
+    link_to_cache(output_freeze_folder, cache_folder, files, symlinks)
+    # The manifest gets written by the build itself
+    files.pop(build_manifest_filename, None)
+    tree = {'files': files, 'symlinks': symlinks}
+    trees_folder = f'{cache_folder}/trees'
+    filepath = f'{trees_folder}/{get_cache_key(manifest)}.json'
+    os.makedirs(trees_folder, exist_ok=True)
+    with open(f'{filepath}.{os.getpid()}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(tree, f, indent=2, sort_keys=True)
+    os.replace(f'{filepath}.{os.getpid()}.tmp', filepath)
+    return
+
+def link_to_cache(output_freeze_folder:str,
+                  cache_folder:str,
+                  tree:Optional[Dict[str, str]] = None,
+                  symlinks:Optional[Dict[str, str]] = None,
+                  ) -> Tuple[int, int]:
+    '''
+    Replace every file in the output folder by a hardlink into the content-addressed cache. Files
+    already in the cache (eg. the Qt libraries from the other app, or from a previous build) then
+    take no extra space, and share their page cache pages at runtime. Return the number of files
+    that were already in the cache, and the number of files added to it.
+
+    Hardlinks require the output and cache to be on the same filesystem. Files that can't be
+    linked are still copied into the cache, but left alone in the output. Symlinks (to files or
+    folders) are left alone as well: they're not followed.
+
+    :param tree:     Filled in with the name of the cached object of each file: {relpath: name}.
+
+    :param symlinks: Filled in with the target of each symlink: {relpath: target}.
+    '''
+    objects_folder = f'{cache_folder}/objects'
+    reused = 0
+    added = 0
+    for dirpath, dirnames, filenames in os.walk(output_freeze_folder):
+        #$ Symlinks
+        # A symlinked folder shows up in 'dirnames', but 'os.walk()' doesn't descend into it
+        for name in [*dirnames, *filenames]:
+            linkpath = os.path.join(dirpath, name)
+            if symlinks is not None and os.path.islink(linkpath):
+                relpath = os.path.relpath(linkpath, output_freeze_folder).replace('\\', '/')
+                symlinks[relpath] = os.readlink(linkpath)
+            continue
+
+        #$ Files
+        for filename in filenames:
+            filepath = os.path.join(dirpath, filename)
+            if os.path.islink(filepath):
+                continue
+            # The file mode is part of the key: it belongs to the inode, so all links share it
+            digest = hash_file(filepath)
+            mode = os.stat(filepath).st_mode & 0o7777
+            object_name = f'{digest}-{mode:o}'
+            object_path = f'{objects_folder}/{digest[:2]}/{object_name}'
+            temp_path = f'{object_path}.{os.getpid()}.tmp'
+            if tree is not None:
+                relpath = os.path.relpath(filepath, output_freeze_folder).replace('\\', '/')
+                tree[relpath] = object_name
+            try:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                if os.path.isfile(object_path):
+                    if os.path.samefile(object_path, filepath):
+                        reused += 1
+                        continue
+                    # Replace the file by a link to the cached copy
+                    os.link(object_path, temp_path)
+                    os.replace(temp_path, filepath)
+                    reused += 1
+                else:
+                    # Put the file in the cache. Going through a temporary name keeps this safe when
+                    # other builds in the pool add the same file at the same time.
+                    try:
+                        os.link(filepath, temp_path)
+                    except OSError:
+                        shutil.copy2(filepath, temp_path)
+                    os.replace(temp_path, object_path)
+                    added += 1
+            except OSError:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+            continue
+        continue
+    return reused, added
+
+def hash_file(filepath:str) -> str:
+    '''
+    Return the SHA-256 of the given file, as a hex string.
+    '''
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def find_imports(main_script_path:str) -> Set[str]:
+    '''
+    Return the names of all modules imported by the given script, and - recursively - by the local
+    modules (next to the script) that it imports. For 'from a import b', both 'a' and 'a.b' are
+    listed, because 'b' can be a submodule.
+    '''
+    return scan_imports(main_script_path)[0]
+
+def find_local_sources(main_script_path:str) -> List[str]:
+    '''
+    Return the paths to the given script and all local modules (next to the script) that it
+    imports, directly or indirectly.
+    '''
+    return sorted(scan_imports(main_script_path)[1])
+
+def scan_imports(main_script_path:str) -> Tuple[Set[str], Set[str]]:
+    '''
+    Return the modules imported by the given script and its local modules (see 'find_imports()'),
+    and the paths to the script and those local modules.
+    '''
+    folderpath = os.path.dirname(main_script_path).replace('\\', '/')
+    imported_modules:Set[str] = set()
+    visited_files:Set[str] = set()
+    todo = [main_script_path]
+    while len(todo) > 0:
+        filepath = todo.pop()
+        if filepath in visited_files:
+            continue
+        visited_files.add(filepath)
+        with open(filepath, 'r', encoding='utf-8') as f:
+            tree = ast.parse(f.read(), filepath)
+        for node in ast.walk(tree):
+            names:List[str] = []
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+                names.extend(f'{node.module}.{alias.name}' for alias in node.names if alias.name != '*')
+            for name in names:
+                imported_modules.add(name)
+                local_filepath = f'{folderpath}/{name.split(".")[0]}.py'
+                if os.path.isfile(local_filepath):
+                    todo.append(local_filepath)
+                continue
+            continue
+        continue
+    return imported_modules, visited_files
+
+def get_pyqt6_modules() -> List[str]:
+    '''
+    Return the names of all PyQt6 extension modules installed, eg. 'PyQt6.QtWebEngineWidgets'.
+    '''
+    spec = importlib.util.find_spec('PyQt6')
+    if spec is None or not spec.submodule_search_locations:
+        return []
+    names:Set[str] = set()
+    for folderpath in spec.submodule_search_locations:
+        for filename in os.listdir(folderpath):
+            if filename.endswith(('.so', '.pyd')) and filename.startswith('Q'):
+                names.add(f'PyQt6.{filename.split(".")[0]}')
+            continue
+        continue
+    return sorted(names)
+
+def get_build_report(output_freeze_folder:str, executable_name:str, profile:str) -> Dict[str, Any]:
+    '''
+    Measure the build output: its total size, the number of files and the cold-start time of the
+    executable. The latter is the time until its window got painted for the first time, with the
+    output folder evicted from the page cache. It runs on the offscreen Qt platform.
+    '''
+    import functions
+    size = 0
+    file_count = 0
+    for dirpath, _, filenames in os.walk(output_freeze_folder):
+        for filename in filenames:
+            size += os.path.getsize(os.path.join(dirpath, filename))
+            file_count += 1
+        continue
+    cache_method = functions.evict_page_cache([output_freeze_folder])
+    cold_start_time = functions.measure_startup(
+        [f'{output_freeze_folder}/{executable_name}', '--exit-after-paint'],
+        env = {**os.environ, 'QT_QPA_PLATFORM': 'offscreen'},
+    )
+    report = {
+        'executable'      : f'{output_freeze_folder}/{executable_name}',
+        'profile'         : profile,
+        'size'            : size,
+        'file_count'      : file_count,
+        'cold_start_time' : cold_start_time,
+        'cache_method'    : cache_method,
+    }
+    print(
+        f'\n'
+        f'BUILD REPORT: {report["executable"]}\n'
+        f'    profile:         {profile}\n'
+        f'    size:            {size / (1024 * 1024):.1f} MiB\n'
+        f'    files:           {file_count}\n'
+        f'    cold start:      '
+        f'{"failed" if cold_start_time is None else f"{cold_start_time:.3f} s"} '
+        f'(page cache evicted with {q}{cache_method}{q})\n'
+    )
+    return report
+
 if __name__ == '__main__':
     #$ Path to parent folder 'terminal_spawner'
     _terminal_spawner_folderpath = os.path.dirname(
@@ -115,21 +684,87 @@ if __name__ == '__main__':
             f'Only supported on Windows.'
         )
     )
+    parser.add_argument(
+        '--profile',
+        choices = build_profiles,
+        default = 'full',
+        help    = str(
+            f'{q}minimal{q}: only freeze the modules the apps actually import. '
+            f'{q}full{q}: also force in all the extra modules (default).'
+        )
+    )
+    parser.add_argument(
+        '--jobs',
+        type    = int,
+        default = None,
+        help    = 'Number of builds to run in parallel. Default: the number of cores.'
+    )
+    parser.add_argument(
+        '--shared',
+        action = 'store_true',
+        help   = str(
+            f'Freeze both apps into {q}frozen_apps/{q}, with a single shared copy of the Python '
+            f'runtime and the libraries.'
+        )
+    )
+    parser.add_argument(
+        '--incremental',
+        action = 'store_true',
+        help   = f'Only rebuild what changed since the previous build, in place.'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action = 'store_true',
+        help   = str(
+            f'Don{q}t restore unchanged builds from {q}build_cache/{q}, and don{q}t store the '
+            f'output in there.'
+        )
+    )
     args = parser.parse_args()
     no_console = args.no_console
 
-    #$ Build Parent App
-    build(
-        main_script_path     = f'{_terminal_spawner_folderpath}/parent_app.py',
-        executable_name      = 'parent_app.exe' if platform.system().lower() == 'windows' else 'parent_app',
-        output_freeze_folder = f'{_terminal_spawner_folderpath}/frozen_parent_app'.replace('\\', '/'),
-    )
+    #$ Build Parent App and Child App into one shared tree
+    exe_suffix = '.exe' if platform.system().lower() == 'windows' else ''
+    cache_folder = None if args.no_cache else f'{_terminal_spawner_folderpath}/build_cache'
+    if args.shared:
+        shared_folderpath = f'{_terminal_spawner_folderpath}/frozen_apps'.replace('\\', '/')
+        build(
+            main_script_path     = f'{_terminal_spawner_folderpath}/parent_app.py',
+            executable_name      = f'parent_app{exe_suffix}',
+            output_freeze_folder = shared_folderpath,
+            profile              = args.profile,
+            cache_folder         = cache_folder,
+            report               = False,
+            incremental          = args.incremental,
+            extra_executables    = [
+                (f'{_terminal_spawner_folderpath}/child_app.py', f'child_app{exe_suffix}'),
+            ],
+        )
+        for _executable_name in (f'parent_app{exe_suffix}', f'child_app{exe_suffix}'):
+            get_build_report(shared_folderpath, _executable_name, args.profile)
+            continue
+        input('Press any key to exit ...')
+        sys.exit(0)
 
-    #$ Build Child App
-    build(
-        main_script_path     = f'{_terminal_spawner_folderpath}/child_app.py',
-        executable_name      = 'child_app.exe' if platform.system().lower() == 'windows' else 'child_app',
-        output_freeze_folder = f'{_terminal_spawner_folderpath}/frozen_child_app'.replace('\\', '/'),
+    #$ Build Parent App and Child App in parallel
+    build_all(
+        [
+            dict(
+                main_script_path     = f'{_terminal_spawner_folderpath}/parent_app.py',
+                executable_name      = f'parent_app{exe_suffix}',
+                output_freeze_folder = f'{_terminal_spawner_folderpath}/frozen_parent_app'.replace('\\', '/'),
+                profile              = args.profile,
+            ),
+            dict(
+                main_script_path     = f'{_terminal_spawner_folderpath}/child_app.py',
+                executable_name      = f'child_app{exe_suffix}',
+                output_freeze_folder = f'{_terminal_spawner_folderpath}/frozen_child_app'.replace('\\', '/'),
+                profile              = args.profile,
+            ),
+        ],
+        max_workers  = args.jobs,
+        cache_folder = cache_folder,
+        incremental  = args.incremental,
     )
 
     input('Press any key to exit ...')
@@ -3,16 +3,16 @@
 Copyright 2018-2023 Johan Cockx, Matic Kukovec and Kristof Mulier.
 """
 # SUMMARY:
-# This is a simply PyQt6 application that creates a window with a button.
+# This is a simply PyQt6 application that creates a window with a button. With '--headless', it
+# skips Qt entirely: it prints its info as JSON and exits. PyQt6 is only imported in GUI mode.
 from __future__ import annotations
 from typing import *
-import sys, os, inspect, argparse
-from PyQt6.QtWidgets import *
-from PyQt6.QtCore import *
-from PyQt6.QtGui import *
+import sys, os, inspect, argparse, json, child_helpers
 q = "'"
 foo_value: bool = False
 bar_value: Optional[str] = None
+exit_after_paint: bool = False
+headless: bool = False
 args_valid: bool = True
 
 def get_script_filepath() -> str:
@@ -73,8 +73,46 @@ def get_info() -> Dict[str, str]:
 
         # Bar argument
         'Bar argument: '.ljust(30): str(bar_value),
+
+        # Payload from the parent
+        'Payload: '.ljust(30): get_payload_description(),
+    }
+
+def get_raw_info() -> Dict[str, Any]:
+    '''
+    Return the same info as 'get_info()', but json-serializable instead of formatted for display.
+    '''
+    return {
+        'script_filepath' : get_script_filepath(),
+        'argv'            : list(sys.argv),
+        'orig_argv'       : list(sys.orig_argv),
+        'path'            : list(sys.path),
+        'frozen'          : is_frozen(),
+        'foo'             : foo_value,
+        'bar'             : bar_value,
+        'payload_size'    : get_payload_size(),
+        'args_valid'      : args_valid,
     }
 
+def get_payload_size() -> Optional[int]:
+    '''
+    Return the size of the payload passed by the parent, or None if there is none. The payload is
+    mapped from shared memory, not copied.
+    '''
+    payload = child_helpers.open_payload()
+    if payload is None:
+        return None
+    return payload.nbytes
+
+def get_payload_description() -> str:
+    '''
+    Return the payload size for display.
+    '''
+    size = get_payload_size()
+    if size is None:
+        return 'None'
+    return f'{size} bytes (shared memory, read-only)'
+
 def print_info() -> None:
     '''
     Function to be called when the button is clicked.
@@ -84,107 +122,44 @@ def print_info() -> None:
         print(f'{k} {v}')
     return
 
-# Main application class
-class MainWindow(QMainWindow):
-    def __init__(self) -> None:
-        super().__init__()
-
-        # Set the main window size
-        self.setMinimumSize(QSize(1000, 300))
-        if not args_valid:
-            self.setStyleSheet('background-color: #fccccc;')
-        else:
-            if is_frozen():
-                self.setStyleSheet('background-color: #729fcf;')
-            else:
-                self.setStyleSheet('background-color: #d3d7cf;')
-
-        # Set the window title
-        self.setWindowTitle('CHILD APP')
-
-        # Set the font to monospace, size 12
-        monospace_font = QFont('Monospace')
-        monospace_font.setStyleHint(QFont.StyleHint.Monospace)
-        monospace_font.setPointSize(12)
-
-        # Create central widget and layout
-        centralWidget = QWidget(self)
-        self.setCentralWidget(centralWidget)
-        layout = QVBoxLayout(centralWidget)
-
-        #& Labels
-        # Create labels and text fields, placing them next to each other
-        if not args_valid:
-            label = QLabel('Invalid arguments!', self)
-            label.setFont(monospace_font)
-            layout.addWidget(label)
-            return
-        for label_text, text_content in get_info().items():
-            # Create a horizontal layout for each label-text field pair
-            horizontal_layout = QHBoxLayout()
-
-            #$ LABEL
-            txt = str(label_text)
-            label = QLabel(txt, self)
-            label.setFont(monospace_font)
-
-            #$ TEXT FIELD
-            txt = str(text_content)
-            if '\n' in txt:
-                text_field = QPlainTextEdit(txt, self)
-                n = txt.count('\n') + 1
-                text_field.setMaximumHeight(
-                    min(
-                        300,
-                        text_field.fontMetrics().lineSpacing() * n + 20,
-                    )
-                )
-            else:
-                text_field = QLineEdit(txt, self)
-            text_field.setFont(monospace_font)
-            text_field.setReadOnly(True)
-            text_field.setStyleSheet('background-color: #ffffff;')
-
-            # Add the label and text field to the horizontal layout
-            horizontal_layout.addWidget(label)
-            horizontal_layout.addWidget(text_field)
-
-            # Add the horizontal layout to the main vertical layout
-            layout.addLayout(horizontal_layout)
-            continue
-
-        #& Buttons
-        #$ PRINT INFO
-        self.info_btn: QPushButton = QPushButton(' PRINT INFO TO CONSOLE', self)
-        self.info_btn.setMinimumHeight(70)
-        self.info_btn.setMaximumWidth(400)
-        self.info_btn.setFont(monospace_font)
-        self.info_btn.setStyleSheet('text-align:left; background-color: #eeeeec;')
-        self.info_btn.clicked.connect(print_info)
-
-        # Add stretch to push everything to the top, then add the button
-        layout.addStretch(5)
-        layout.addSpacing(60)
-        layout.addWidget(self.info_btn)
-
-        # Adjust size to content
-        self.adjustSize()
-        return
-
 def main() -> int:
     '''
     Main entry point.
     '''
+    if headless:
+        return main_headless()
+    # Import PyQt6 only now, such that the headless mode doesn't pay for it
+    from PyQt6.QtWidgets import QApplication
+    from child_window import MainWindow
     # Create the application instance
     app: QApplication = QApplication(sys.argv)
     # Create the main window instance
-    window: MainWindow = MainWindow()
+    window: MainWindow = MainWindow(
+        info             = get_info(),
+        args_valid       = args_valid,
+        frozen           = is_frozen(),
+        exit_after_paint = exit_after_paint,
+        print_info       = print_info,
+    )
     window.show()
     # Start the application's event loop and exit
     return app.exec()
 
-if __name__ == '__main__':
-    #$ Parse arguments
+def main_headless() -> int:
+    '''
+    Entry point for the headless mode: print the info as JSON and exit. The returncode is 0, or 2 if
+    the arguments were invalid.
+    '''
+    print(json.dumps(get_raw_info()), flush=True)
+    child_helpers.notify_ready()
+    return 0 if args_valid else 2
+
+def parse_arguments(argv:List[str]) -> None:
+    '''
+    Parse the given command line arguments (without the script or executable itself) into the
+    global variables 'foo_value', 'bar_value', 'exit_after_paint', 'headless' and 'args_valid'.
+    '''
+    global foo_value, bar_value, exit_after_paint, headless, args_valid
     parser = argparse.ArgumentParser(description='Child application.')
     parser.add_argument(
         '--foo',
@@ -196,12 +171,31 @@ if __name__ == '__main__':
         type = str,
         help = 'A string argument'
     )
+    parser.add_argument(
+        '--headless',
+        action = 'store_true',
+        help   = 'Don\'t show a window. Print the info as JSON and exit.'
+    )
+    parser.add_argument(
+        '--exit-after-paint',
+        action = 'store_true',
+        help   = 'Quit as soon as the window got painted. Used by the startup benchmarks.'
+    )
     try:
-        args = parser.parse_args()
+        args = parser.parse_args(argv)
         foo_value = args.foo
         bar_value = args.bar
+        exit_after_paint = args.exit_after_paint
+        headless = args.headless
     except:
         args_valid = False
+        # Still honor '--headless', such that the invalid arguments get reported as JSON
+        headless = '--headless' in argv
+    return
+
+if __name__ == '__main__':
+    #$ Parse arguments
+    parse_arguments(sys.argv[1:])
 
     #$ Run GUI and quit after
     sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018-2023 Johan Cockx, Matic Kukovec and Kristof Mulier.
+"""
+# SUMMARY:
+# The child's side of a spawn: the readiness handshake and the payload. A child only needs these two
+# functions, so they live here instead of in 'functions.py' - which takes tens of milliseconds to
+# import. This module only imports what's already loaded at interpreter startup, and even skips
+# 'typing'. The 'socket' and 'mmap' modules are imported once they're actually needed.
+# 'functions.py' re-exports everything in here.
+from __future__ import annotations
+import os
+
+# See the READINESS HANDSHAKE section in 'functions.py'
+ready_env_var = 'TERMINAL_SPAWNER_READY'
+# See the PAYLOAD section in 'functions.py'
+payload_env_var = 'TERMINAL_SPAWNER_PAYLOAD'
+__payload_mmap = None
+
+def notify_ready() -> bool:
+    '''
+    To be called by a child process once it is ready (eg. its window is shown). Tell the parent
+    that it can stop waiting in 'wait_ready()'. Return False if the parent didn't ask for a
+    handshake (or can't be reached), True otherwise. The environment variable is consumed, such
+    that grandchildren don't signal on behalf of this process.
+    '''
+    value = os.environ.pop(ready_env_var, None)
+    if not value:
+        return False
+    import socket
+    token, _, address = value.partition('@')
+    scheme, _, location = address.partition(':')
+    try:
+        if scheme == 'unix':
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            s.settimeout(2.0)
+            s.connect(location)
+        elif scheme == 'tcp':
+            host, _, port = location.rpartition(':')
+            s = socket.create_connection((host, int(port)), timeout=2.0)
+        else:
+            return False
+        with s:
+            s.sendall(f'ready {token}\n'.encode('ascii'))
+    except OSError:
+        return False
+    return True
+
+def open_payload() -> Optional[memoryview]:
+    '''
+    To be called by a child process. Return the payload from the parent as a read-only memoryview
+    on shared memory - no copies are made. Return None if the parent didn't pass a payload (or it
+    can't be opened anymore). The payload is mapped on the first call, later calls return the same
+    memory.
+    '''
+    global __payload_mmap
+    value = os.environ.get(payload_env_var)
+    if not value:
+        return None
+    size_text, _, location = value.partition('@')
+    try:
+        size = int(size_text)
+    except ValueError:
+        return None
+    if size == 0:
+        return memoryview(b'')
+    if __payload_mmap is None:
+        import mmap
+        try:
+            if location.startswith('tag:'):
+                __payload_mmap = mmap.mmap(-1, size, tagname=location[4:], access=mmap.ACCESS_READ)
+            else:
+                fd = os.open(location, os.O_RDONLY)
+                try:
+                    __payload_mmap = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+                finally:
+                    # The mapping stays valid without the file descriptor
+                    os.close(fd)
+        except (OSError, ValueError):
+            return None
+    return memoryview(__payload_mmap)[:size]
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018-2023 Johan Cockx, Matic Kukovec and Kristof Mulier.
+"""
+# SUMMARY:
+# The window of the Child App. This lives in its own file, such that 'child_app.py' only imports
+# PyQt6 when it runs in GUI mode.
+from __future__ import annotations
+from typing import *
+import child_helpers
+from PyQt6.QtWidgets import *
+from PyQt6.QtCore import *
+from PyQt6.QtGui import *
+q = "'"
+
+# Main application class
+class MainWindow(QMainWindow):
+    def __init__(self,
+                 info:Dict[str, str],
+                 args_valid:bool,
+                 frozen:bool,
+                 exit_after_paint:bool,
+                 print_info:Callable[[], None],
+                 ) -> None:
+        '''
+        :param info:             Info about the way the Child App runs, see 'child_app.get_info()'.
+        :param args_valid:       Whether the command line arguments could be parsed.
+        :param frozen:           Whether the Child App runs frozen.
+        :param exit_after_paint: Quit as soon as the window got painted.
+        :param print_info:       Invoked when the 'PRINT INFO TO CONSOLE' button is clicked.
+        '''
+        super().__init__()
+        self.__painted: bool = False
+        self.__exit_after_paint: bool = exit_after_paint
+
+        # Set the main window size
+        self.setMinimumSize(QSize(1000, 300))
+        if not args_valid:
+            self.setStyleSheet('background-color: #fccccc;')
+        else:
+            if frozen:
+                self.setStyleSheet('background-color: #729fcf;')
+            else:
+                self.setStyleSheet('background-color: #d3d7cf;')
+
+        # Set the window title
+        self.setWindowTitle('CHILD APP')
+
+        # Set the font to monospace, size 12
+        monospace_font = QFont('Monospace')
+        monospace_font.setStyleHint(QFont.StyleHint.Monospace)
+        monospace_font.setPointSize(12)
+
+        # Create central widget and layout
+        centralWidget = QWidget(self)
+        self.setCentralWidget(centralWidget)
+        layout = QVBoxLayout(centralWidget)
+
+        #& Labels
+        # Create labels and text fields, placing them next to each other
+        if not args_valid:
+            label = QLabel('Invalid arguments!', self)
+            label.setFont(monospace_font)
+            layout.addWidget(label)
+            return
+        for label_text, text_content in info.items():
+            # Create a horizontal layout for each label-text field pair
+            horizontal_layout = QHBoxLayout()
+
+            #$ LABEL
+            txt = str(label_text)
+            label = QLabel(txt, self)
+            label.setFont(monospace_font)
+
+            #$ TEXT FIELD
+            txt = str(text_content)
+            if '\n' in txt:
+                text_field = QPlainTextEdit(txt, self)
+                n = txt.count('\n') + 1
+                text_field.setMaximumHeight(
+                    min(
+                        300,
+                        text_field.fontMetrics().lineSpacing() * n + 20,
+                    )
+                )
+            else:
+                text_field = QLineEdit(txt, self)
+            text_field.setFont(monospace_font)
+            text_field.setReadOnly(True)
+            text_field.setStyleSheet('background-color: #ffffff;')
+
+            # Add the label and text field to the horizontal layout
+            horizontal_layout.addWidget(label)
+            horizontal_layout.addWidget(text_field)
+
+            # Add the horizontal layout to the main vertical layout
+            layout.addLayout(horizontal_layout)
+            continue
+
+        #& Buttons
+        #$ PRINT INFO
+        self.info_btn: QPushButton = QPushButton(' PRINT INFO TO CONSOLE', self)
+        self.info_btn.setMinimumHeight(70)
+        self.info_btn.setMaximumWidth(400)
+        self.info_btn.setFont(monospace_font)
+        self.info_btn.setStyleSheet('text-align:left; background-color: #eeeeec;')
+        self.info_btn.clicked.connect(print_info)
+
+        # Add stretch to push everything to the top, then add the button
+        layout.addStretch(5)
+        layout.addSpacing(60)
+        layout.addWidget(self.info_btn)
+
+        # Adjust size to content
+        self.adjustSize()
+        return
+
+    def paintEvent(self, event:QPaintEvent) -> None:
+        '''
+        On the first paint, tell the parent we're up. This does nothing if the parent didn't ask for
+        a readiness handshake.
+        '''
+        super().paintEvent(event)
+        if not self.__painted:
+            self.__painted = True
+            QTimer.singleShot(0, self.__on_first_paint)
+        return
+
+    def __on_first_paint(self) -> None:
+        child_helpers.notify_ready()
+        if self.__exit_after_paint:
+            QApplication.quit()
+        return
@@ -6,7 +6,10 @@ Copyright 2018-2023 Johan Cockx, Matic Kukovec and Kristof Mulier.
 # Functions to be used by any script in the project.
 from __future__ import annotations
 from typing import *
-import sys, os, subprocess, platform, time, shlex, shutil
+import sys, os, subprocess, platform, time, shlex, shutil, json, threading, socket, select
+import tempfile, secrets, signal, traceback, collections, mmap, contextlib, itertools, heapq, abc
+# The 'asyncio' and 'concurrent.futures' modules are imported where they're needed. They're slow
+# to import, and children that only need 'notify_ready()' shouldn't pay for them.
 q = "'"
 
 
@@ -18,189 +21,4017 @@ linux_shells = ('sh', 'bash', 'dash', 'zsh', 'ksh', 'fish', 'xonsh', 'nushell',
 linux_terminal_emulators = ('gnome-terminal', 'x-terminal-emulator', 'xterm', 'konsole',
                             'xfce4-terminal', 'qterminal', 'lxterminal', 'alacritty', 'rxvt',
                             'terminator', 'termit', )
+# Where the child runs: in a terminal emulator, in a pseudo-terminal owned by the parent, or in a
+# window of a tmux session
+spawn_backends = ('terminal', 'pty', 'tmux', )
+backend_env_var = 'TERMINAL_SPAWNER_BACKEND'
+# How the 'terminal' backend launches the emulator on Linux, see 'SPAWN ENGINES'
+spawn_engines = ('popen', 'posix_spawn', 'forkserver', )
+engine_env_var = 'TERMINAL_SPAWNER_ENGINE'
+# The keyword arguments of 'spawn_new_terminal()' that go into its LaunchPlan
+launch_plan_kwargs = ('backend', 'terminal', 'zygote', 'tab', 'fast_start', )
 
-def spawn_new_terminal(script_or_exe_path:str, argv:List[str], **kwargs) -> Callable:
+class TerminalProfile(NamedTuple):
+    '''
+    How to launch a program in a terminal emulator. The quirks of the supported emulators are in
+    'terminal_profiles'.
+
+    :name:         Name of the emulator, as in 'linux_terminal_emulators'.
+    :command_flag: The argument in front of the program: '-e', or '--' for emulators that
+                   deprecated '-e'.
+    :wait_flag:    The argument that keeps the emulator from returning before the program
+                   completed, for emulators that need one.
+    :join_command: The emulator wants the program and its arguments joined into one (shell quoted)
+                   argument, rather than as separate arguments.
+    :tab_flag:     The argument to open a tab in an existing window instead of a new window, for
+                   emulators that support tabs.
+    '''
+    name:str
+    command_flag:str = '-e'
+    wait_flag:Optional[str] = None
+    join_command:bool = False
+    tab_flag:Optional[str] = None
+
+    def get_arguments(self,
+                      terminal_path:str,
+                      program:str,
+                      argv:List[str],
+                      tab:bool = False,
+                      ) -> List[str]:
+        '''
+        Return the full command to launch the given program with its arguments in this emulator.
+        '''
+        arguments = [terminal_path]
+        if self.wait_flag is not None:
+            arguments.append(self.wait_flag)
+        if tab:
+            if self.tab_flag is None:
+                raise RuntimeError(f'Terminal emulator {q}{self.name}{q} has no tabs')
+            arguments.append(self.tab_flag)
+        arguments.append(self.command_flag)
+        if self.join_command:
+            arguments.append(shlex.join([program, *argv]))
+        else:
+            arguments += [program, *argv]
+        return arguments
+
+# Emulators that aren't in here (eg. passed with 'terminal=...') get the default TerminalProfile
+terminal_profiles:Dict[str, TerminalProfile] = {
+    # The 'gnome-terminal' returns right away, unless it gets '--wait'. It deprecated '-e'.
+    'gnome-terminal'      : TerminalProfile('gnome-terminal', '--', '--wait', tab_flag='--tab'),
+    'x-terminal-emulator' : TerminalProfile('x-terminal-emulator'),
+    'xterm'               : TerminalProfile('xterm'),
+    'konsole'             : TerminalProfile('konsole', tab_flag='--new-tab'),
+    # The 'xfce4-terminal' and 'terminator' don't work with the program and its arguments as
+    # separate arguments.
+    'xfce4-terminal'      : TerminalProfile('xfce4-terminal', join_command=True, tab_flag='--tab'),
+    'qterminal'           : TerminalProfile('qterminal'),
+    'lxterminal'          : TerminalProfile('lxterminal'),
+    'alacritty'           : TerminalProfile('alacritty'),
+    'rxvt'                : TerminalProfile('rxvt'),
+    'terminator'          : TerminalProfile('terminator', join_command=True, tab_flag='--new-tab'),
+    'termit'              : TerminalProfile('termit'),
+}
+
+def get_terminal_profile(terminal:str) -> TerminalProfile:
+    '''
+    Return the TerminalProfile for the given emulator name.
+    '''
+    return terminal_profiles.get(terminal) or TerminalProfile(terminal)
+
+class LaunchPlan(NamedTuple):
+    '''
+    A target resolved once, to be launched any number of times with different arguments: what kind
+    of file it is, the program that runs it, and the backend and terminal emulator to launch it
+    with. Create it with 'create_launch_plan()', and pass it to 'spawn_new_terminal()' instead of
+    the path.
+
+    :target:        The script or executable.
+    :kind:          What kind of file the target is, see 'classify_target()'. None if a zygote
+                    runs it.
+    :backend:       One of 'spawn_backends'.
+    :program:       The program to launch: the target itself, or the interpreter (or zygote client)
+                    that runs it.
+    :arguments:     The arguments for the program that come before the ones for the target.
+    :profile:       The TerminalProfile of the emulator ('terminal' backend on Linux only).
+    :terminal_path: The path to the emulator ('terminal' backend on Linux only).
+    :tab:           Open the child in a tab of an existing window.
+    :fast_start:    A python script gets launched with the fast-start profile.
+    '''
+    target:str
+    kind:Optional[str]
+    backend:str
+    program:str
+    arguments:Tuple[str, ...]
+    profile:Optional[TerminalProfile] = None
+    terminal_path:Optional[str] = None
+    tab:bool = False
+    fast_start:bool = False
+
+def create_launch_plan(script_or_exe_path:str,
+                       backend:Optional[str] = None,
+                       terminal:Optional[str] = None,
+                       zygote:Optional[Any] = None,
+                       tab:bool = False,
+                       fast_start:bool = False,
+                       trace:Optional[SpawnTrace] = None,
+                       ) -> LaunchPlan:
+    '''
+    Resolve the target, backend and terminal emulator into a LaunchPlan. The arguments are the
+    same as for 'spawn_new_terminal()'.
+    '''
+    if trace is None:
+        trace = __null_trace
+    backend = __get_backend(backend)
+    program, arguments, kind = __resolve_program(script_or_exe_path, [], zygote, trace)
+    fast_start = fast_start and kind == 'python'
+    if fast_start:
+        with trace.span('precompile', target=script_or_exe_path):
+            program, arguments = __get_fast_start_command(script_or_exe_path)
+    profile:Optional[TerminalProfile] = None
+    terminal_path:Optional[str] = None
+    if backend == 'terminal' and platform.system().lower() != 'windows':
+        with trace.span('emulator_lookup', requested=terminal) as span:
+            terminal_name, terminal_path = __get_terminal_emulator_name_and_executable(terminal)
+            span['terminal'] = terminal_name
+        profile = get_terminal_profile(terminal_name)
+        if tab and profile.tab_flag is None:
+            raise RuntimeError(f'Terminal emulator {q}{terminal_name}{q} has no tabs')
+    elif tab:
+        raise RuntimeError(f'Tabs are only available with the {q}terminal{q} backend on Linux')
+    return LaunchPlan(
+        target        = script_or_exe_path,
+        kind          = kind,
+        backend       = backend,
+        program       = program,
+        arguments     = tuple(arguments),
+        profile       = profile,
+        terminal_path = terminal_path,
+        tab           = tab,
+        fast_start    = fast_start,
+    )
+
+def spawn_new_terminal(script_or_exe_path:Union[str, LaunchPlan],
+                       argv:List[str],
+                       **kwargs,
+                       ) -> SpawnHandle:
     '''
     Spawn a new terminal and launch the given script (python or shell script) or executable in that
     terminal. This function returns a callable 'wait_function()' that the parent process (which
     invoked this function) can use to wait for the child process (which runs in the newly spawned
     terminal) to complete. That 'wait_function()' returns the 'returncode', which is 0 if all was
-    good.
+    good. The 'wait_function()' is a SpawnHandle, which also offers 'wait_ready(timeout)'.
 
     :param script_or_exe_path:  The script (python or shell script) or executable to be launched in
                                 the newly spawned terminal. For example:
                                   - 'C:/users/krist/child.py'  or '/home/krist/child.py'
                                   - 'C:/users/krist/child.bat' or '/home/krist/child.sh'
                                   - 'C:/users/krist/child.exe' or '/home/krist/child'
+                                Or a LaunchPlan from 'create_launch_plan()', to launch the same
+                                target many times without resolving it again.
 
     :param argv:                The arguments to be passed to the script or executable. Do not
                                 include the (path to the) script file or executable in here. Just
                                 the arguments.
+
+    :param handshake:           [Optional keyword argument] Set up the readiness handshake. The
+                                child can then call 'notify_ready()' once it is up and running, and
+                                the parent can block on that with 'wait_ready(timeout)'.
+
+    :param terminal:            [Optional keyword argument] Name of the terminal emulator to use
+                                (Linux only), instead of the first one found from
+                                'linux_terminal_emulators'.
+
+    :param zygote:              [Optional keyword argument] A started 'zygote.ZygotePool'. The
+                                terminal then runs a tiny client that lets a warm worker of the pool
+                                run the Child App, instead of a fresh interpreter. The workers can
+                                only run the Child App: other targets are launched normally.
+
+    :param capture:             [Optional keyword argument] Tee the child's output (stdout and
+                                stderr, merged) to the parent. Pass True, or an OutputStream to
+                                choose the buffer size. The stream is available as 'handle.output'.
+
+    :param payload:             [Optional keyword argument] Data for the child, as bytes or as a
+                                Payload. The child maps it read-only with 'open_payload()', without
+                                copying. Pass the same Payload to many spawns to share one buffer
+                                between all of them. Bytes get a Payload of their own, released
+                                once the child exited.
+
+    :param verbose:             [Optional keyword argument] Print the trace of this spawn, see
+                                'get_spawn_trace()'.
+
+    :param backend:             [Optional keyword argument] One of 'spawn_backends':
+                                  - 'terminal': Launch a terminal emulator (the default).
+                                  - 'pty':      Run the child in a pseudo-terminal owned by the
+                                                parent (Linux and macOS). No emulator is started,
+                                                so this also works headless. The output is always
+                                                captured, and 'handle.attach()' connects it to
+                                                the parent's own terminal.
+                                  - 'tmux':     Open the child in a new window of a long-lived tmux
+                                                session, see 'get_tmux_session()'. No emulator is
+                                                started either.
+                                The environment variable $TERMINAL_SPAWNER_BACKEND sets the default.
+
+    :param tab:                 [Optional keyword argument] Open the child in a new tab of an
+                                existing window, for terminal emulators that support it (see
+                                'terminal_profiles').
+
+    :param fast_start:          [Optional keyword argument] Launch a python script with the
+                                fast-start profile: precompiled bytecode and interpreter flags
+                                tuned for startup. See 'get_fast_start_report()' for the gain.
+
+    :param engine:              [Optional keyword argument] One of 'spawn_engines', for the
+                                'terminal' backend on Linux (ignored otherwise):
+                                  - 'popen':       'subprocess.Popen()'.
+                                  - 'posix_spawn': 'os.posix_spawn()', straight from this process.
+                                  - 'forkserver':  Let the forkserver launch it, see
+                                                   'start_forkserver()'.
+                                The environment variable $TERMINAL_SPAWNER_ENGINE sets the default.
+                                Without it, that's 'popen'.
+
+    The 'backend', 'terminal', 'zygote', 'tab' and 'fast_start' keyword arguments are part of a
+    LaunchPlan, so they can't be combined with one.
+    '''
+    trace = get_spawn_trace(kwargs.pop('verbose', False))
+    engine:Optional[str] = kwargs.pop('engine', None)
+    if isinstance(script_or_exe_path, LaunchPlan):
+        plan = script_or_exe_path
+        plan_kwargs = [name for name in launch_plan_kwargs if name in kwargs]
+        if plan_kwargs:
+            raise TypeError(f'Pass {", ".join(plan_kwargs)} to create_launch_plan() instead')
+    else:
+        plan = create_launch_plan(
+            script_or_exe_path,
+            trace = trace,
+            **{name: kwargs.pop(name) for name in launch_plan_kwargs if name in kwargs},
+        )
+    backend = plan.backend
+    program, arguments = plan.program, [*plan.arguments, *argv]
+    output = __create_output_stream(kwargs.pop('capture', None))
+    if backend == 'pty':
+        # The pseudo-terminal is the terminal, so its output is captured without a wrapper
+        kwargs['output'] = output if output is not None else OutputStream()
+    elif output is not None:
+        program, arguments = __get_capture_command(output, program, arguments)
+        kwargs['output'] = output
+    kwargs['trace'] = trace
+    payload, owned = __create_payload(kwargs.pop('payload', None))
+    if payload is not None:
+        kwargs['env'] = payload.get_env(kwargs.get('env'))
+    try:
+        if backend == 'pty':
+            handle = __spawn_pty(program, arguments, **kwargs)
+        elif backend == 'tmux':
+            handle = __spawn_tmux(program, arguments, **kwargs)
+        elif platform.system().lower() == 'windows':
+            handle = __spawn_terminal_windows(program, arguments, **kwargs)
+        else:
+            handle = __spawn_terminal_linux(program, arguments, plan, engine=engine, **kwargs)
+    except BaseException:
+        if owned:
+            payload.close()
+        raise
+    if owned:
+        handle.add_done_callback(lambda h: payload.close())
+    return handle
+
+def __get_backend(backend:Optional[str]) -> str:
+    '''
+    Return the backend to spawn with: the given one, else the one from $TERMINAL_SPAWNER_BACKEND,
+    else 'terminal'.
+    '''
+    if backend is None:
+        backend = os.environ.get(backend_env_var) or 'terminal'
+    if backend not in spawn_backends:
+        raise ValueError(
+            f'Unknown backend {q}{backend}{q}, choose one of: {", ".join(spawn_backends)}'
+        )
+    return backend
+
+def __resolve_program(script_or_exe_path:str,
+                      argv:List[str],
+                      zygote:Optional[Any] = None,
+                      trace:Optional[SpawnTrace] = None,
+                      ) -> Tuple[str, List[str], Optional[str]]:
+    '''
+    Figure out what kind of file 'script_or_exe_path' is, and return the program to be launched in
+    the terminal, along with its arguments and the kind of file. For a python script, that's the
+    python interpreter with the script as its first argument.
+
+    If a zygote (see 'zygote.ZygotePool') is given and the target is the Child App, the zygote is
+    asked for the program instead. The kind is None then. Other targets are launched normally.
+    '''
+    if zygote is not None and zygote.serves(script_or_exe_path):
+        return (*zygote.get_command(script_or_exe_path, argv), None)
+    if trace is None:
+        trace = __null_trace
+    with trace.span('classify', target=script_or_exe_path) as span:
+        kind = classify_target(script_or_exe_path).kind
+        span['kind'] = kind
+    #$ python script
+    if kind == 'python':
+        return get_python_executable(), [script_or_exe_path, *argv], kind
+    #$ shell script or executable
+    # Shell scripts (and other scripts with a shebang) are launched directly, just like executables.
+    return script_or_exe_path, argv, kind
+
+class TargetInfo(NamedTuple):
+    '''
+    Result of 'classify_target()'.
+
+    :kind:        One of:
+                    - 'python':     Python script (by its '.py' extension)
+                    - 'shell':      Shell script (by its extension, or a shebang naming a shell)
+                    - 'script':     Script with a shebang for another interpreter
+                    - 'executable': Binary executable (ELF or PE), or anything unrecognized
+
+    :interpreter: The interpreter named in the shebang, if any. For '#!/usr/bin/env python3', this
+                  is 'python3'.
+    '''
+    kind: str
+    interpreter: Optional[str] = None
+
+# Number of bytes read from a file to classify it
+classify_header_size:int = 512
+__classify_cache:Dict[Tuple[str, int, int], TargetInfo] = {}
+__classify_cache_max_size:int = 4096
+
+def classify_target(script_or_exe_path:str) -> TargetInfo:
     '''
-    if 'verbose' in kwargs:
-        del kwargs['verbose']
-    #& WINDOWS
+    Determine what kind of file the given script or executable is. The extension decides if there
+    is a known one. Otherwise, only the first few hundred bytes are read to look for ELF/PE magic or
+    a shebang. Results are cached, keyed on the path, modification time and size of the file.
+    '''
+    #& By extension
     if platform.system().lower() == 'windows':
-        #$ shell script
         if script_or_exe_path.endswith(('.cmd', '.bat')):
-            return __spawn_terminal_windows(script_or_exe_path, argv, **kwargs)
-        #$ python script
-        if script_or_exe_path.endswith('.py'):
-            return __spawn_terminal_windows(__get_python_executable(), [script_or_exe_path, *argv], **kwargs)
-        #$ executable
-        if script_or_exe_path.endswith('.exe'):
-            return __spawn_terminal_windows(script_or_exe_path, argv, **kwargs)
-        # Reaching this point, the file has no known extension. The file is probably an executable.
-        return __spawn_terminal_windows(script_or_exe_path, argv, **kwargs)
-
-    #& LINUX
-    assert platform.system().lower() == 'linux'
-    #$ shell script
-    if script_or_exe_path.endswith('.sh'):
-        return __spawn_terminal_linux(script_or_exe_path, argv, **kwargs)
-    #$ python script
+            return TargetInfo('shell')
+    elif script_or_exe_path.endswith('.sh'):
+        return TargetInfo('shell')
     if script_or_exe_path.endswith('.py'):
-        return __spawn_terminal_linux(__get_python_executable(), [script_or_exe_path, *argv], **kwargs)
-    #$ executable
+        return TargetInfo('python')
     if script_or_exe_path.endswith('.exe'):
         # Normally, executables on Linux don't end in '.exe'. But you never know.
-        return __spawn_terminal_linux(script_or_exe_path, argv, **kwargs)
-    # Try to find shebang
+        return TargetInfo('executable')
+
+    #& By content
     try:
-        with open(script_or_exe_path, 'r', encoding='utf-8', newline='\n') as f:
-            content = f.read()
-        # Look for a shebang with a for-loop, to ignore empty lines at the start of the file. If
-        # a non-empty line is found, and it is not a shebang, then stop looping.
-        for line in content.splitlines():
-            if line.strip() == '':
-                continue
-            #$ shell script
-            if line.startswith(tuple(f'#!/bin/{s}' for s in linux_shells)):
-                return __spawn_terminal_linux(script_or_exe_path, argv, **kwargs)
-            if line.startswith(tuple(f'#!/usr/bin/{s}' for s in linux_shells)):
-                return __spawn_terminal_linux(script_or_exe_path, argv, **kwargs)
-            break
-        # No shebang found
-    except:
-        # The file is probably not a script, but an executable
-        pass
+        stat = os.stat(script_or_exe_path)
+    except OSError:
+        # The file is probably not there. Let the launch itself report that.
+        return TargetInfo('executable')
+    key = (script_or_exe_path, stat.st_mtime_ns, stat.st_size)
+    result = __classify_cache.get(key)
+    if result is None:
+        try:
+            with open(script_or_exe_path, 'rb') as f:
+                header = f.read(classify_header_size)
+        except OSError:
+            header = b''
+        result = __classify_header(header)
+        if len(__classify_cache) >= __classify_cache_max_size:
+            __classify_cache.clear()
+        __classify_cache[key] = result
+    return result
+
+def __classify_header(header:bytes) -> TargetInfo:
+    '''
+    Classify a file based on its first bytes.
+    '''
     #$ executable
-    # Reaching this point, the file has no known extension, nor could a shebang be found. The
-    # file is probably an executable.
-    return __spawn_terminal_linux(script_or_exe_path, argv, **kwargs)
+    if header.startswith((b'\x7fELF', b'MZ')):
+        return TargetInfo('executable')
+    # Look for a shebang, ignoring empty lines at the start of the file. If a non-empty line is
+    # found, and it is not a shebang, then stop looking.
+    first_line = header.lstrip(b' \t\r\n').split(b'\n', 1)[0]
+    if not first_line.startswith(b'#!'):
+        # No shebang found. The file is probably an executable.
+        return TargetInfo('executable')
+    words = first_line[2:].decode('utf-8', errors='replace').split()
+    if len(words) == 0:
+        return TargetInfo('executable')
+    interpreter = words[0]
+    if os.path.basename(interpreter) == 'env':
+        # '#!/usr/bin/env [-S] [VAR=value ...] <interpreter>'
+        words = [w for w in words[1:] if not w.startswith('-') and '=' not in w]
+        if len(words) == 0:
+            return TargetInfo('executable')
+        interpreter = words[0]
+    #$ shell script
+    if os.path.basename(interpreter) in linux_shells:
+        return TargetInfo('shell', interpreter)
+    #$ other script
+    return TargetInfo('script', interpreter)
 
-def __get_python_executable() -> str:
+def get_python_executable() -> str:
     '''
-    Return the path to the python interpreter executable.
+    Return the path to the python interpreter that python scripts get launched with. When frozen,
+    that's the one found on the PATH.
     '''
     interpreter_path:Optional[str] = None
     if getattr(sys, 'frozen', False):
-        # Frozen, running as compiled code
-        if platform.system().lower() == 'linux':
-            # On Linux, first give 'python3' a try
-            interpreter_path = shutil.which('python3')
-        if interpreter_path is None:
-            interpreter_path = shutil.which('python')
+        # Frozen, running as compiled code. Searching the PATH is costly, so the result goes through
+        # the discovery cache.
+        interpreter_path = __discover('python_executable', __find_python_executable)
     else:
         # Running from interpreter
         interpreter_path = sys.executable
     assert interpreter_path is not None
     return interpreter_path.replace('\\', '/')
 
-def __get_terminal_emulator_name_and_executable() -> Tuple[str, str]:
+def __find_python_executable() -> Optional[str]:
+    '''
+    Search the PATH for a python interpreter. Only needed when running frozen.
+    '''
+    interpreter_path:Optional[str] = None
+    if platform.system().lower() == 'linux':
+        # On Linux, first give 'python3' a try
+        interpreter_path = shutil.which('python3')
+    if interpreter_path is None:
+        interpreter_path = shutil.which('python')
+    return interpreter_path
+
+def __get_terminal_emulator_name_and_executable(terminal:Optional[str] = None) -> Tuple[str, str]:
     '''
     Return the name and path to the default terminal emulator on this system. For example:
     ('gnome-terminal', '/usr/bin/gnome-terminal')
+
+    If a terminal emulator name is given, return that one instead of the default.
     '''
     assert platform.system().lower() == 'linux'
+    if terminal is not None:
+        terminal_path = __discover(f'terminal_emulator:{terminal}', lambda: shutil.which(terminal))
+        if terminal_path is None:
+            raise RuntimeError(f'Terminal emulator {q}{terminal}{q} not found!')
+        return terminal, str(terminal_path)
+    result = __discover('terminal_emulator', __find_terminal_emulator)
+    if result is None:
+        raise RuntimeError('No terminal emulator found!')
+    return str(result[0]), str(result[1])
+
+def get_installed_terminal_emulators() -> List[str]:
+    '''
+    Return the names of all terminal emulators from 'linux_terminal_emulators' that are installed on
+    this system, in order of preference.
+    '''
+    return [
+        t for t in linux_terminal_emulators
+        if __discover(f'terminal_emulator:{t}', lambda: shutil.which(t)) is not None
+    ]
+
+def __find_terminal_emulator() -> Optional[List[str]]:
+    '''
+    Walk the PATH to find the first terminal emulator from 'linux_terminal_emulators'.
+    '''
     for terminal in linux_terminal_emulators:
-        if shutil.which(terminal):
-            return str(terminal), str(shutil.which(terminal))
+        terminal_path = shutil.which(terminal)
+        if terminal_path:
+            return [str(terminal), str(terminal_path)]
         continue
-    raise RuntimeError('No terminal emulator found!')
+    return None
 
-def __spawn_terminal_windows(program:str, argv:List[str], **kwargs) -> Callable:
+def __spawn_terminal_windows(program:str, argv:List[str], **kwargs) -> SpawnHandle:
     '''
 
     '''
     #& RUN
+    handshake:bool = kwargs.pop('handshake', False)
+    output:Optional[OutputStream] = kwargs.pop('output', None)
+    trace:SpawnTrace = kwargs.pop('trace')
+    ready_listener = ReadinessListener() if handshake else None
+    if ready_listener is not None:
+        kwargs['env'] = ready_listener.get_env(kwargs.get('env'))
     arguments = [program, *argv]
-    print(
-        f'subprocess.Popen(\n'
-        f'    {arguments},'
-        f'    creationflags = subprocess.CREATE_NEW_CONSOLE,\n'
-        f'    {kwargs},\n'
-        f')'
-    )
-    time.sleep(1)
-    p = subprocess.Popen(
-        arguments,
-        creationflags = subprocess.CREATE_NEW_CONSOLE,
-        **kwargs,
-    )
+    trace.event('command', level='debug', arguments=arguments, options=sorted(kwargs))
+    with trace.span('popen'):
+        spawn_time = time.monotonic()
+        p = subprocess.Popen(
+            arguments,
+            creationflags = subprocess.CREATE_NEW_CONSOLE,
+            **kwargs,
+        )
     #& RETURN WAIT FUNCTION
-    def wait_function() -> int:
-        return p.wait()
-    return wait_function
+    return SpawnHandle(p, spawn_time, ready_listener, output, trace)
 
-def __spawn_terminal_linux(program:str, argv:List[str], **kwargs) -> Callable:
+def __spawn_terminal_linux(program:str, argv:List[str], plan:LaunchPlan, **kwargs) -> SpawnHandle:
     '''
 
     '''
     #& RUN
-    terminal_name, terminal_path = __get_terminal_emulator_name_and_executable()
-    # The 'gnome-terminal' requires a '--wait' argument to let it not return until its child process
-    # has completed. Also, this terminal needs the '--' argument instead of '-e', which is depre-
-    # cated.
-    if terminal_name == 'gnome-terminal':
-        arguments = [terminal_path, '--wait', '--', program, *argv]
-        print(
-            f'subprocess.Popen(\n'
-            f'    {arguments},\n'
-            f'    env={os.environ},'
-            f'    {kwargs},\n'
-            f')'
-        )
-        time.sleep(1)
-        p = subprocess.Popen(
-            arguments,
-            env=os.environ,
-            **kwargs,
+    handshake:bool = kwargs.pop('handshake', False)
+    output:Optional[OutputStream] = kwargs.pop('output', None)
+    trace:SpawnTrace = kwargs.pop('trace')
+    ready_listener = ReadinessListener() if handshake else None
+    env = kwargs.pop('env', None)
+    if ready_listener is not None:
+        env = ready_listener.get_env(env)
+    engine = __get_engine(kwargs.pop('engine', None), kwargs)
+    assert plan.profile is not None and plan.terminal_path is not None
+    arguments = plan.profile.get_arguments(plan.terminal_path, program, argv, plan.tab)
+    trace.event(
+        'command', level='debug', arguments=arguments, options=sorted(kwargs), engine=engine,
+    )
+    with trace.span('popen', engine=engine):
+        spawn_time = time.monotonic()
+        p = __launch(engine, arguments, env, kwargs)
+    #& RETURN WAIT FUNCTION
+    return SpawnHandle(p, spawn_time, ready_listener, output, trace)
+
+#^                                            TRACING                                             ^#
+#% ============================================================================================== %#
+#% Each spawn can be traced: timed spans for its phases ('classify', 'emulator_lookup', 'popen')  %#
+#% and events ('command', 'first_ready', 'exit'). Spans are events with a 'duration'. Events go   %#
+#% to the sinks registered with 'add_trace_sink()': a LoggerSink, a JsonLinesSink, a MemorySink,  %#
+#% or any callable that takes an event dictionary. Each sink has a level:                         %#
+#%     - 'info':  the spans, 'first_ready' and 'exit'                                             %#
+#%     - 'debug': also the full command of each spawn                                             %#
+#% Without sinks, spawns get a shared no-op trace, which costs next to nothing.                   %#
+#%                                                                                                %#
+#% Set the 'TERMINAL_SPAWNER_TRACE' environment variable to the path of a file to have all spawns %#
+#% traced into it as JSON lines, without changing any code.                                       %#
+#%                                                                                                %#
+trace_levels:Dict[str, int] = {
+    'info'  : 1,
+    'debug' : 2,
+}
+trace_env_var = 'TERMINAL_SPAWNER_TRACE'
+TraceSink = Callable[[Dict[str, Any]], None]
+__trace_sinks:List[Tuple[TraceSink, int]] = []
+__trace_lock = threading.Lock()
+__trace_env_checked:bool = False
+__spawn_ids = itertools.count(1)
+
+def add_trace_sink(sink:TraceSink, level:str = 'info') -> None:
+    '''
+    Send the trace events of all spawns from now on, up to the given level, to the given sink.
+    '''
+    global __trace_sinks
+    with __trace_lock:
+        # Never modified in place: spawns in flight keep the list they started with
+        __trace_sinks = [*__trace_sinks, (sink, trace_levels[level])]
+    return
+
+def remove_trace_sink(sink:TraceSink) -> None:
+    '''
+    Stop sending trace events to the given sink.
+    '''
+    global __trace_sinks
+    with __trace_lock:
+        __trace_sinks = [(s, level) for s, level in __trace_sinks if s is not sink]
+    return
+
+def get_spawn_trace(verbose:bool = False) -> SpawnTrace:
+    '''
+    Return a new trace for a spawn, delivering to the registered sinks. With 'verbose', the events
+    are also printed. If there's nothing to deliver to, return the shared no-op trace.
+    '''
+    global __trace_env_checked
+    if not __trace_env_checked:
+        __trace_env_checked = True
+        trace_filepath = os.environ.get(trace_env_var)
+        if trace_filepath:
+            add_trace_sink(JsonLinesSink(trace_filepath))
+    sinks = __trace_sinks
+    if verbose:
+        sinks = [*sinks, (PrintSink(), trace_levels['debug'])]
+    if len(sinks) == 0:
+        return __null_trace
+    return SpawnTrace(next(__spawn_ids), sinks)
+
+def format_trace_event(event:Dict[str, Any]) -> str:
+    '''
+    Return the given trace event as a single line of text, eg.
+        [spawn 3] popen 2.315 ms
+    '''
+    text = f'[spawn {event["spawn_id"]}] {event["name"]}'
+    if event.get('duration') is not None:
+        text += f' {event["duration"] * 1000:.3f} ms'
+    for key, value in event.items():
+        if key in ('time', 'spawn_id', 'name', 'level', 'duration'):
+            continue
+        text += f' {key}={value!r}'
+        continue
+    return text
+
+class SpawnTrace:
+    '''
+    Trace of a single spawn, with its own 'spawn_id'. Use 'span()' to time a phase and 'event()'
+    for everything else:
+
+        with trace.span('classify', target=path) as span:
+            ...
+            span['kind'] = kind
+    '''
+    # Attributes written to the no-op span are ignored
+    _null_span = contextlib.nullcontext(cast(Dict[str, Any], {}))
+
+    def __init__(self, spawn_id:int, sinks:List[Tuple[TraceSink, int]]) -> None:
+        '''
+        :param spawn_id: Number of the spawn, unique within this process. 0 for the no-op trace.
+        :param sinks:    The sinks with their level.
+        '''
+        self.spawn_id = spawn_id
+        self.__sinks = sinks
+        self.level:int = max((level for _, level in sinks), default=0)
+        return
+
+    def enabled(self, level:str = 'info') -> bool:
+        '''
+        Return True if events of the given level get delivered anywhere.
+        '''
+        return self.level >= trace_levels[level]
+
+    def span(self, name:str, level:str = 'info', **attributes) -> ContextManager[Dict[str, Any]]:
+        '''
+        Return a context manager that times the code in its body. On exit, an event is sent with
+        the 'duration' in seconds and the given attributes. Attributes can still be added to the
+        dictionary it yields.
+        '''
+        if self.level < trace_levels[level]:
+            return self._null_span
+        return self.__span(name, level, attributes)
+
+    def event(self, name:str, level:str = 'info', **attributes) -> None:
+        '''
+        Send an event with the given attributes to the sinks.
+        '''
+        level_number = trace_levels[level]
+        if self.level < level_number:
+            return
+        event = {
+            'time'     : attributes.pop('time', None) or time.time(),
+            'spawn_id' : self.spawn_id,
+            'name'     : name,
+            'level'    : level,
+            **attributes,
+        }
+        for sink, sink_level in self.__sinks:
+            if sink_level < level_number:
+                continue
+            try:
+                sink(event)
+            except Exception:
+                traceback.print_exc()
+            continue
+        return
+
+    @contextlib.contextmanager
+    def __span(self, name:str, level:str, attributes:Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        start_time = time.time()
+        start = time.perf_counter()
+        try:
+            yield attributes
+        finally:
+            duration = time.perf_counter() - start
+            self.event(name, level, time=start_time, duration=duration, **attributes)
+        return
+
+__null_trace = SpawnTrace(0, [])
+
+class PrintSink:
+    '''
+    Trace sink that prints each event as a line of text. Used for 'verbose=True'.
+    '''
+    def __init__(self, file:Optional[TextIO] = None) -> None:
+        self.file = file
+        return
+
+    def __call__(self, event:Dict[str, Any]) -> None:
+        print(format_trace_event(event), file=self.file or sys.stdout)
+        return
+
+class LoggerSink:
+    '''
+    Trace sink that logs each event as a line of text: 'info' events at INFO level, 'debug' events
+    at DEBUG level.
+    '''
+    def __init__(self, logger:Optional[logging.Logger] = None) -> None:
+        '''
+        :param logger: The logger to use. Default: the 'terminal_spawner' logger.
+        '''
+        import logging
+        self.logger = logger if logger is not None else logging.getLogger('terminal_spawner')
+        self.__debug_level:int = logging.DEBUG
+        self.__info_level:int = logging.INFO
+        return
+
+    def __call__(self, event:Dict[str, Any]) -> None:
+        level = self.__debug_level if event['level'] == 'debug' else self.__info_level
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, format_trace_event(event))
+        return
+
+class JsonLinesSink:
+    '''
+    Trace sink that appends each event as a line of JSON to a file. Several processes can share the
+    same file.
+    '''
+    def __init__(self, filepath:str) -> None:
+        self.filepath = filepath
+        self.__lock = threading.Lock()
+        self.__file = open(filepath, 'a', encoding='utf-8')
+        return
+
+    def __call__(self, event:Dict[str, Any]) -> None:
+        line = json.dumps(event, default=str) + '\n'
+        with self.__lock:
+            if self.__file.closed:
+                return
+            # One write per line, such that lines from different processes don't interleave
+            self.__file.write(line)
+            self.__file.flush()
+        return
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__file.close()
+        return
+
+class MemorySink:
+    '''
+    Trace sink that keeps the last 'max_events' events in memory.
+    '''
+    def __init__(self, max_events:int = 10000) -> None:
+        self.__events:Deque[Dict[str, Any]] = collections.deque(maxlen=max_events)
+        self.__lock = threading.Lock()
+        return
+
+    def __call__(self, event:Dict[str, Any]) -> None:
+        with self.__lock:
+            self.__events.append(event)
+        return
+
+    @property
+    def events(self) -> List[Dict[str, Any]]:
+        '''
+        A copy of the events, oldest first.
+        '''
+        with self.__lock:
+            return list(self.__events)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__events.clear()
+        return
+
+    def get_breakdown(self) -> Dict[int, Dict[str, float]]:
+        '''
+        Return the latency breakdown per spawn: '{spawn_id: {span name: duration}}'. Includes the
+        'first_ready' latency and the lifetime ('exit') of each child, if known.
+        '''
+        breakdown:Dict[int, Dict[str, float]] = {}
+        for event in self.events:
+            if event.get('duration') is None:
+                continue
+            breakdown.setdefault(event['spawn_id'], {})[event['name']] = event['duration']
+            continue
+        return breakdown
+
+
+#^                                      READINESS HANDSHAKE                                       ^#
+#% ============================================================================================== %#
+#% A parent can ask for a readiness handshake when spawning a child. The parent then listens on a %#
+#% Unix socket (or a loopback TCP socket if Unix sockets aren't available) and passes its address %#
+#% to the child through the 'TERMINAL_SPAWNER_READY' environment variable. The child signals it's %#
+#% up and running by calling 'notify_ready()'. Programs that can't import this module simply      %#
+#% connect to the address and send the line 'ready <token>'. The variable has the format:         %#
+#%     <token>@unix:<socket path>     or     <token>@tcp:<host>:<port>                            %#
+#%                                                                                                %#
+# The child's side is in 'child_helpers.py', which children can import cheaply
+from child_helpers import ready_env_var, notify_ready
+
+class ReadinessListener:
+    '''
+    Listening end of the readiness handshake, owned by the parent.
+    '''
+    def __init__(self) -> None:
+        self.token:str = secrets.token_hex(8)
+        self.__socket, self.address, self.__folderpath = create_listening_socket('ready')
+        self.ready:bool = False
+        return
+
+    def get_env(self, env:Optional[Mapping[str, str]] = None) -> Dict[str, str]:
+        '''
+        Return a copy of the given environment (default: 'os.environ') with the readiness variable
+        added to it.
+        '''
+        result = dict(os.environ if env is None else env)
+        result[ready_env_var] = f'{self.token}@{self.address}'
+        return result
+
+    def wait(self, timeout:Optional[float], is_alive:Callable[[], bool]) -> bool:
+        '''
+        Block until the child signals it is ready. Return False if the timeout expires or if the
+        child died before becoming ready.
+        '''
+        if self.ready:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # Wake up regularly to check if the child is still alive
+            slice_time = 0.1
+            if deadline is not None:
+                slice_time = max(0.0, min(slice_time, deadline - time.monotonic()))
+            readable, _, _ = select.select([self.__socket], [], [], slice_time)
+            if readable and self.__accept():
+                return True
+            if not is_alive():
+                # Give a child that signalled right before exiting one last chance
+                return self.__accept()
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            continue
+
+    async def wait_async(self, timeout:Optional[float], is_alive:Callable[[], bool]) -> bool:
+        '''
+        Same as 'wait()', for asyncio.
+        '''
+        import asyncio
+        if self.ready:
+            return True
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            slice_time = 0.1
+            if deadline is not None:
+                slice_time = max(0.0, min(slice_time, deadline - loop.time()))
+            try:
+                connection, _ = await asyncio.wait_for(loop.sock_accept(self.__socket), slice_time)
+            except asyncio.TimeoutError:
+                connection = None
+            if connection is not None:
+                with connection:
+                    try:
+                        message = await asyncio.wait_for(loop.sock_recv(connection, 64), 1.0)
+                    except (OSError, asyncio.TimeoutError):
+                        message = b''
+                self.__check_message(message)
+                if self.ready:
+                    return True
+                continue
+            if not is_alive():
+                return self.__accept()
+            if deadline is not None and loop.time() >= deadline:
+                return False
+            continue
+
+    def close(self) -> None:
+        '''
+        Close the socket and clean up.
+        '''
+        self.__socket.close()
+        if self.__folderpath is not None:
+            shutil.rmtree(self.__folderpath, ignore_errors=True)
+            self.__folderpath = None
+        return
+
+    def __accept(self) -> bool:
+        '''
+        Accept pending connections and check if one of them carries the 'ready' message.
+        '''
+        while not self.ready:
+            try:
+                connection, _ = self.__socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return False
+            with connection:
+                connection.settimeout(1.0)
+                try:
+                    message = connection.recv(64)
+                except OSError:
+                    continue
+            self.__check_message(message)
+            continue
+        return True
+
+    def __check_message(self, message:bytes) -> None:
+        if message.strip() == f'ready {self.token}'.encode('ascii'):
+            self.ready = True
+        return
+
+def create_listening_socket(name:str) -> Tuple[socket.socket, str, Optional[str]]:
+    '''
+    Create a non-blocking listening socket for a child to connect to: a Unix socket in a new
+    temporary folder, or a loopback TCP socket if Unix sockets aren't available. Return the socket,
+    its address ('unix:<socket path>' or 'tcp:<host>:<port>') and the temporary folder (None for
+    TCP). The caller removes the folder when done.
+    '''
+    folderpath:Optional[str] = None
+    if hasattr(socket, 'AF_UNIX'):
+        folderpath = tempfile.mkdtemp(prefix='terminal_spawner_').replace('\\', '/')
+        socket_path = f'{folderpath}/{name}.sock'
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.bind(socket_path)
+        address = f'unix:{socket_path}'
+    else:
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.bind(('127.0.0.1', 0))
+        address = f'tcp:127.0.0.1:{s.getsockname()[1]}'
+    s.listen(4)
+    s.setblocking(False)
+    return s, address, folderpath
+
+class SpawnHandle:
+    '''
+    Handle to a child process spawned in a new terminal. The handle replaces the former
+    'wait_function()': call it to wait for the child and get its 'returncode'.
+    '''
+    def __init__(self,
+                 process:Union[subprocess.Popen, PtyChild],
+                 spawn_time:float,
+                 ready_listener:Optional[ReadinessListener] = None,
+                 output:Optional[OutputStream] = None,
+                 trace:Optional[SpawnTrace] = None,
+                 ) -> None:
+        '''
+        :param process:        The process that was launched. On Linux, this is the terminal
+                               emulator. With the 'pty' backend, it's the PtyChild. Other backends
+                               and engines give a stand-in with the same interface.
+
+        :param spawn_time:     Value of 'time.monotonic()' right before the process was launched.
+
+        :param ready_listener: The parent's end of the readiness handshake, if any.
+
+        :param output:         The captured output of the child, if any.
+
+        :param trace:          The trace of the spawn, if any. The handle adds the 'first_ready'
+                               and 'exit' events to it.
+        '''
+        self.process = process
+        self.output = output
+        self.trace = trace if trace is not None else get_spawn_trace()
+        self.spawn_id:int = self.trace.spawn_id
+        self.pid:int = process.pid
+        self.spawn_time = spawn_time
+        self.ready_time:Optional[float] = None
+        self.__handshake:bool = ready_listener is not None
+        self.__ready_listener = ready_listener
+        self.returncode:Optional[int] = None
+        self.__result:Optional[ExitResult] = None
+        self.__lock = threading.Lock()
+        self.__done = threading.Event()
+        self.__done_callbacks:List[Callable[[SpawnHandle], None]] = []
+        # A PtyChild feeds the output stream itself
+        if output is not None and not isinstance(process, PtyChild):
+            output._start(lambda: self.returncode is None)
+        # The supervisor reaps the child and reports its returncode
+        get_supervisor().watch(self.pid, self.__on_exit, process)
+        return
+
+    def __call__(self) -> int:
+        return self.wait()
+
+    def wait(self, timeout:Optional[float] = None) -> int:
+        '''
+        Wait for the child process to complete and return its 'returncode'. Raise
+        'subprocess.TimeoutExpired' if the timeout expires first.
+        '''
+        if not self.__done.wait(timeout):
+            raise subprocess.TimeoutExpired(self.process.args, timeout)
+        self.__close_ready_listener()
+        assert self.returncode is not None
+        return self.returncode
+
+    def result(self, timeout:Optional[float] = None) -> ExitResult:
+        '''
+        Wait for the child process to complete, like 'wait()'. Return its ExitResult: the
+        'returncode' along with the resources it used.
+        '''
+        self.wait(timeout)
+        assert self.__result is not None
+        return self.__result
+
+    def poll(self) -> Optional[int]:
+        '''
+        Return the 'returncode' if the child process completed, None otherwise.
+        '''
+        return self.returncode
+
+    def wait_ready(self, timeout:Optional[float] = None) -> bool:
+        '''
+        Wait for the child to call 'notify_ready()'. Return True if it did, False if the timeout
+        expired or the child exited first. Only available if the child was spawned with
+        'handshake=True'.
+        '''
+        if self.ready_time is not None:
+            return True
+        if not self.__handshake:
+            raise RuntimeError('Child was not spawned with handshake=True')
+        if self.__ready_listener is None:
+            # The child already exited without becoming ready
+            return False
+        if not self.__ready_listener.wait(timeout, lambda: self.returncode is None):
+            return False
+        self.ready_time = time.monotonic()
+        self.trace.event('first_ready', duration=self.ready_latency)
+        self.__close_ready_listener()
+        return True
+
+    def add_done_callback(self, callback:Callable[[SpawnHandle], None]) -> None:
+        '''
+        Invoke 'callback(handle)' once the child process completed. If it already did, the callback
+        is invoked right away. Callbacks usually run in the supervisor thread, so they should return
+        quickly.
+        '''
+        with self.__lock:
+            if self.returncode is None:
+                self.__done_callbacks.append(callback)
+                return
+        callback(self)
+        return
+
+    def attach(self, detach_key:bytes = b'\x1d') -> Optional[int]:
+        '''
+        Connect the parent's own terminal to the child, see 'PtyChild.attach()'. Only available if
+        the child was spawned with backend='pty'.
+        '''
+        if not isinstance(self.process, PtyChild):
+            raise RuntimeError(f'Child was not spawned with backend={q}pty{q}')
+        return self.process.attach(detach_key)
+
+    @property
+    def ready_latency(self) -> Optional[float]:
+        '''
+        Seconds between the spawn and the moment the child was seen to be ready, or None if it
+        isn't (known to be) ready yet.
+        '''
+        if self.ready_time is None:
+            return None
+        return self.ready_time - self.spawn_time
+
+    def __on_exit(self, result:ExitResult) -> None:
+        '''
+        Invoked by the supervisor once the child is reaped.
+        '''
+        result = result._replace(wall_time=time.monotonic() - self.spawn_time)
+        with self.__lock:
+            self.__result = result
+            self.returncode = result.returncode
+            callbacks, self.__done_callbacks = self.__done_callbacks, []
+        self.trace.event('exit', duration=result.wall_time, **result._asdict())
+        self.__done.set()
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                traceback.print_exc()
+            continue
+        return
+
+    def __close_ready_listener(self) -> None:
+        if self.__ready_listener is not None:
+            self.__ready_listener.close()
+            self.__ready_listener = None
+        return
+
+
+#^                                         OUTPUT CAPTURE                                         ^#
+#% ============================================================================================== %#
+#% With 'capture=True', the terminal doesn't run the child directly, but a small wrapper that     %#
+#% runs the child in a pseudo-terminal. The wrapper copies everything the child writes to the     %#
+#% terminal, and tees it to the parent over a socket. Without pty support (Windows), the wrapper  %#
+#% reads the child's output through a pipe instead. Stdout and stderr arrive merged, just like    %#
+#% they appear in the terminal.                                                                   %#
+#%                                                                                                %#
+#% The parent drains the socket in a background thread into a bounded ring buffer. A chatty child %#
+#% never blocks on a full pipe, and a slow consumer loses the oldest output instead of growing    %#
+#% the parent's memory without limit.                                                             %#
+#%                                                                                                %#
+# The wrapper only needs the standard library, so it runs from source with any python interpreter -
+# also if the parent is frozen. Arguments: '<token>@<address>', then the program and its arguments.
+__capture_wrapper_source = '''
+import sys, os, socket
+token, _, address = sys.argv[1].partition('@')
+scheme, _, location = address.partition(':')
+argv = sys.argv[2:]
+try:
+    if scheme == 'unix':
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(location)
+    else:
+        host, _, port = location.rpartition(':')
+        s = socket.create_connection((host, int(port)))
+    s.sendall(('capture ' + token + '\\n').encode('ascii'))
+except OSError:
+    s = None
+def tee(data):
+    global s
+    if s is not None:
+        try:
+            s.sendall(data)
+        except OSError:
+            s = None
+    return data
+try:
+    import pty
+except ImportError:
+    pty = None
+if pty is not None and os.isatty(1):
+    status = pty.spawn(argv, lambda fd: tee(os.read(fd, 65536)))
+    code = os.waitstatus_to_exitcode(status)
+else:
+    import subprocess
+    p = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    for data in iter(lambda: p.stdout.read1(65536), b''):
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+        tee(data)
+    code = p.wait()
+sys.exit(128 - code if code < 0 else code)
+'''
+
+def __create_output_stream(capture:Union[None, bool, OutputStream]) -> Optional[OutputStream]:
+    '''
+    Turn the 'capture' keyword argument of the spawn functions into an OutputStream, or None.
+    '''
+    if capture is None or capture is False:
+        return None
+    if capture is True:
+        return OutputStream()
+    return capture
+
+def __get_capture_command(output:OutputStream,
+                          program:str,
+                          argv:List[str],
+                          ) -> Tuple[str, List[str]]:
+    '''
+    Return the command that runs the given program with its arguments, with its output teed to the
+    given stream.
+    '''
+    return get_python_executable(), [
+        '-c',
+        __capture_wrapper_source,
+        f'{output.token}@{output._listen()}',
+        program,
+        *argv,
+    ]
+
+class OutputStream:
+    '''
+    Output captured from a child, see 'spawn_new_terminal(..., capture=True)'. Consume it in any of
+    these ways:
+        - 'read()' returns what arrived so far, without blocking (or blocks up to a timeout).
+        - Iterate over the stream to get the chunks as they arrive, until the child is done.
+        - 'add_callback(callback)' to get each chunk pushed to you, from the reader thread.
+
+    The buffer holds at most 'max_size' bytes. If nobody reads it in time, the oldest bytes get
+    dropped and counted in 'dropped'. Callbacks see every chunk, dropped or not.
+
+    The output is the raw bytes as the terminal gets them. Through a pseudo-terminal, that means
+    '\\r\\n' line endings and any escape sequences the child writes.
+
+    The stream gets its output either from the capture wrapper, over a socket, or straight from the
+    pseudo-terminal of a child spawned with the 'pty' backend.
+    '''
+    def __init__(self, max_size:int = 1 << 20) -> None:
+        '''
+        :param max_size: Maximal number of bytes kept in the buffer.
+        '''
+        self.max_size = max_size
+        self.token:str = secrets.token_hex(8)
+        self.dropped:int = 0
+        self.eof:bool = False
+        # The socket for the capture wrapper, created on demand
+        self.address:Optional[str] = None
+        self.__socket:Optional[socket.socket] = None
+        self.__folderpath:Optional[str] = None
+        self.__chunks:Deque[bytes] = collections.deque()
+        self.__size:int = 0
+        self.__condition = threading.Condition()
+        self.__callbacks:List[Callable[[bytes], None]] = []
+        # Keeps the callbacks in order, also while a new one gets the buffered output replayed
+        self.__delivery_lock = threading.Lock()
+        self.__thread:Optional[threading.Thread] = None
+        self.__closed:bool = False
+        return
+
+    def read(self, timeout:Optional[float] = 0.0) -> bytes:
+        '''
+        Return all buffered output and empty the buffer. If there is none, wait up to 'timeout'
+        seconds (None: until output arrives or the stream ends). Return b'' if nothing arrived.
+        '''
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__size > 0 or self.eof, timeout)
+            data = b''.join(self.__chunks)
+            self.__chunks.clear()
+            self.__size = 0
+        return data
+
+    def __iter__(self) -> Iterator[bytes]:
+        '''
+        Yield the output as it arrives, until the child is done.
+        '''
+        while True:
+            data = self.read(None)
+            if data == b'':
+                return
+            yield data
+            continue
+
+    def add_callback(self, callback:Callable[[bytes], None], replay:bool = False) -> None:
+        '''
+        Invoke 'callback(chunk)' for each chunk of output that arrives from now on. Callbacks run in
+        the reader thread, so they should return quickly.
+
+        :param replay: First invoke the callback with the output that is still buffered, without
+                       consuming it. No chunk gets lost or repeated in between.
+        '''
+        with self.__delivery_lock:
+            with self.__condition:
+                self.__callbacks.append(callback)
+                buffered = b''.join(self.__chunks) if replay else b''
+            if buffered:
+                callback(buffered)
+        return
+
+    def remove_callback(self, callback:Callable[[bytes], None]) -> None:
+        '''
+        Stop invoking a callback added with 'add_callback()'.
+        '''
+        with self.__condition:
+            if callback in self.__callbacks:
+                self.__callbacks.remove(callback)
+        return
+
+    def wait(self, timeout:Optional[float] = None) -> bool:
+        '''
+        Wait until the child is done writing. Return False if the timeout expired first.
+        '''
+        with self.__condition:
+            return self.__condition.wait_for(lambda: self.eof, timeout)
+
+    def close(self) -> None:
+        '''
+        Stop capturing and clean up.
+        '''
+        self.__closed = True
+        if self.__thread is not None and self.__thread is not threading.current_thread():
+            self.__thread.join()
+        self.__cleanup()
+        return
+
+    def _listen(self) -> str:
+        '''
+        Create the socket for the capture wrapper to connect to, if not done yet. Return its
+        address.
+        '''
+        if self.__socket is None:
+            self.__socket, self.address, self.__folderpath = create_listening_socket('capture')
+        assert self.address is not None
+        return self.address
+
+    def _start(self, is_alive:Callable[[], bool]) -> None:
+        '''
+        Start the reader thread for the capture wrapper. Invoked by the handle once the child was
+        spawned.
+
+        :param is_alive: Returns False once the spawned process exited. If the wrapper didn't
+                         connect by then, it never will.
+        '''
+        assert self.__thread is None
+        self.__thread = threading.Thread(
+            target = self.__run,
+            args   = (is_alive,),
+            name   = 'terminal_spawner.capture',
+            daemon = True,
         )
-    # The 'xfce4-terminal' and 'terminator' terminal emulators don't work if you pass the program
-    # and arguments as separate list elements. So you need to join them with shlex.
-    elif terminal_name in ('xfce4-terminal', 'terminator'):
-        arguments = [terminal_path, '-e', shlex.join([program, *argv])]
-        print(
-            f'subprocess.Popen(\n'
-            f'    {arguments},\n'
-            f'    env={os.environ},'
-            f'    {kwargs},\n'
-            f')'
-        )
-        time.sleep(1)
-        p = subprocess.Popen(
-            arguments,
-            env=os.environ,
-            **kwargs,
+        self.__thread.start()
+        return
+
+    def _start_reading(self, fd:int, on_eof:Callable[[], None]) -> None:
+        '''
+        Start the reader thread for a file descriptor, eg. the parent's end of a pseudo-terminal.
+
+        :param fd:     The file descriptor to read from. It stays open.
+
+        :param on_eof: Invoked from the reader thread once the stream ended.
+        '''
+        assert self.__thread is None
+        self.__thread = threading.Thread(
+            target = self.__run_fd,
+            args   = (fd, on_eof),
+            name   = 'terminal_spawner.capture',
+            daemon = True,
         )
-    # For all other terminal emulators, the approach is the same.
-    else:
-        arguments = [terminal_path, '-e', program, *argv]
-        print(
-            f'subprocess.Popen(\n'
-            f'    {arguments},\n'
-            f'    env={os.environ},'
-            f'    {kwargs},\n'
-            f')'
-        )
-        time.sleep(1)
-        p = subprocess.Popen(
+        self.__thread.start()
+        return
+
+    def __run(self, is_alive:Callable[[], bool]) -> None:
+        try:
+            connection = self.__accept(is_alive)
+            if connection is None:
+                return
+            with connection:
+                self.__pump(connection, connection.recv)
+        finally:
+            self.__finish()
+        return
+
+    def __run_fd(self, fd:int, on_eof:Callable[[], None]) -> None:
+        try:
+            self.__pump(fd, lambda size: os.read(fd, size))
+        finally:
+            self.__finish()
+            on_eof()
+        return
+
+    def __pump(self, source:Any, read:Callable[[int], bytes]) -> None:
+        '''
+        Read from the source into the buffer until it ends or the stream gets closed.
+        '''
+        while not self.__closed:
+            readable, _, _ = select.select([source], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                data = read(65536)
+            except OSError:
+                # Linux reports EIO on a pseudo-terminal once the child side is closed
+                break
+            if data == b'':
+                break
+            self.__append(data)
+            continue
+        return
+
+    def __finish(self) -> None:
+        with self.__condition:
+            self.eof = True
+            self.__condition.notify_all()
+        self.__cleanup()
+        return
+
+    def __accept(self, is_alive:Callable[[], bool]) -> Optional[socket.socket]:
+        '''
+        Wait for the wrapper to connect, and check its token. Return the connection, or None if
+        the wrapper never connected.
+        '''
+        assert self.__socket is not None
+        while not self.__closed:
+            readable, _, _ = select.select([self.__socket], [], [], 0.1)
+            if not readable:
+                if not is_alive():
+                    # Give a wrapper that connected right before exiting one last chance
+                    readable, _, _ = select.select([self.__socket], [], [], 0)
+                    if not readable:
+                        return None
+                continue
+            try:
+                connection, _ = self.__socket.accept()
+            except (BlockingIOError, InterruptedError):
+                continue
+            connection.setblocking(True)
+            connection.settimeout(1.0)
+            try:
+                header = b''
+                while not header.endswith(b'\n') and len(header) < 64:
+                    data = connection.recv(64 - len(header))
+                    if data == b'':
+                        break
+                    header += data
+                    continue
+            except OSError:
+                header = b''
+            # The header can arrive together with the first output
+            first_line, _, rest = header.partition(b'\n')
+            if first_line != f'capture {self.token}'.encode('ascii'):
+                connection.close()
+                continue
+            connection.settimeout(None)
+            if rest:
+                self.__append(rest)
+            return connection
+        return None
+
+    def __append(self, data:bytes) -> None:
+        with self.__condition:
+            self.__chunks.append(data)
+            self.__size += len(data)
+            # Drop the oldest output beyond the limit
+            while self.__size > self.max_size:
+                excess = self.__size - self.max_size
+                oldest = self.__chunks[0]
+                if len(oldest) <= excess:
+                    self.__chunks.popleft()
+                    self.__size -= len(oldest)
+                    self.dropped += len(oldest)
+                else:
+                    self.__chunks[0] = oldest[excess:]
+                    self.__size -= excess
+                    self.dropped += excess
+                continue
+            callbacks = list(self.__callbacks)
+            self.__condition.notify_all()
+        with self.__delivery_lock:
+            for callback in callbacks:
+                try:
+                    callback(data)
+                except Exception:
+                    traceback.print_exc()
+                continue
+        return
+
+    def __cleanup(self) -> None:
+        if self.__socket is not None:
+            self.__socket.close()
+        if self.__folderpath is not None:
+            shutil.rmtree(self.__folderpath, ignore_errors=True)
+            self.__folderpath = None
+        return
+
+
+#^                                          PTY BACKEND                                           ^#
+#% ============================================================================================== %#
+#% With backend='pty', no terminal emulator is started. The child runs in a pseudo-terminal owned %#
+#% by the parent, through the 'ptyprocess' package. It still sees a terminal on its stdin, stdout %#
+#% and stderr, with job control and a window size. The parent reads the pty into an OutputStream  %#
+#% ('handle.output'), and can hand the child its own terminal with 'handle.attach()'.             %#
+#%                                                                                                %#
+#% The supervisor reaps the child as usual. A PtyChild stands in for the 'subprocess.Popen'       %#
+#% object, and tells 'ptyprocess' about the returncode, so it never waits for the child itself.   %#
+#%                                                                                                %#
+def __spawn_pty(program:str, argv:List[str], **kwargs) -> SpawnHandle:
+    '''
+    Launch the program in a pseudo-terminal owned by this process, instead of in a terminal
+    emulator. Not available on Windows.
+    '''
+    #& RUN
+    if os.name == 'nt':
+        raise RuntimeError(f'The {q}pty{q} backend is not available on Windows')
+    import ptyprocess
+    handshake:bool = kwargs.pop('handshake', False)
+    output:OutputStream = kwargs.pop('output')
+    trace:SpawnTrace = kwargs.pop('trace')
+    env = kwargs.pop('env', None)
+    cwd = kwargs.pop('cwd', None)
+    if kwargs:
+        raise TypeError(
+            f'Unsupported arguments for the {q}pty{q} backend: {", ".join(sorted(kwargs))}'
+        )
+    ready_listener = ReadinessListener() if handshake else None
+    if ready_listener is not None:
+        env = ready_listener.get_env(env)
+    arguments = [program, *argv]
+    # Give the child the size of the parent's terminal, if there is one
+    size = shutil.get_terminal_size()
+    trace.event('command', level='debug', arguments=arguments, options=['cwd', 'env'])
+    with trace.span('popen'):
+        spawn_time = time.monotonic()
+        p = ptyprocess.PtyProcess.spawn(
             arguments,
-            env=os.environ,
-            **kwargs,
+            cwd        = cwd,
+            env        = env,
+            dimensions = (size.lines, size.columns),
         )
     #& RETURN WAIT FUNCTION
-    def wait_function() -> int:
-        return p.wait()
-    return wait_function
+    return SpawnHandle(PtyChild(p, arguments, output), spawn_time, ready_listener, output, trace)
+
+class PtyChild:
+    '''
+    Child process running in a pseudo-terminal owned by the parent, see 'spawn_new_terminal(...,
+    backend='pty')'. It takes the place of the 'subprocess.Popen' object in 'handle.process', and
+    offers the same 'pid', 'args', 'returncode', 'poll()', 'send_signal()', 'terminate()' and
+    'kill()'.
+    '''
+    def __init__(self, process:Any, arguments:List[str], output:OutputStream) -> None:
+        '''
+        :param process:   The 'ptyprocess.PtyProcess' running the child.
+
+        :param arguments: The program and its arguments.
+
+        :param output:    The stream to read the pseudo-terminal into.
+        '''
+        self.pid:int = process.pid
+        self.args = arguments
+        self.__process = process
+        self.__output = output
+        self.__returncode:Optional[int] = None
+        self.__eof:bool = False
+        self.__lock = threading.Lock()
+        # The pty only gets closed once the child is reaped. No need to give it time to exit.
+        process.delayafterclose = 0
+        output._start_reading(process.fd, self.__on_eof)
+        return
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self.__returncode
+
+    @returncode.setter
+    def returncode(self, returncode:int) -> None:
+        '''
+        Set by the supervisor once it reaped the child.
+        '''
+        with self.__lock:
+            self.__returncode = returncode
+            # Let 'ptyprocess' know, such that it never tries to reap the child again
+            self.__process.terminated = True
+            self.__process.exitstatus = returncode if returncode >= 0 else None
+            self.__process.signalstatus = -returncode if returncode < 0 else None
+            must_close = self.__eof
+        if must_close:
+            self.__process.close()
+        return
+
+    def poll(self) -> Optional[int]:
+        return self.__returncode
+
+    def send_signal(self, signum:int) -> None:
+        if self.__returncode is None:
+            try:
+                os.kill(self.pid, signum)
+            except ProcessLookupError:
+                pass
+        return
+
+    def terminate(self) -> None:
+        self.send_signal(signal.SIGTERM)
+        return
+
+    def kill(self) -> None:
+        self.send_signal(signal.SIGKILL)
+        return
+
+    def write(self, data:bytes) -> int:
+        '''
+        Send input to the child, as if it was typed in its terminal. Return the number of bytes
+        written.
+        '''
+        return self.__process.write(data)
+
+    def setwinsize(self, rows:int, columns:int) -> None:
+        '''
+        Resize the child's terminal. The child gets SIGWINCH.
+        '''
+        self.__process.setwinsize(rows, columns)
+        return
+
+    def attach(self, detach_key:bytes = b'\x1d') -> Optional[int]:
+        '''
+        Connect the parent's own terminal to the child: show the output that is still buffered,
+        then the output as it arrives, and forward the keystrokes to the child. Return the
+        'returncode' once the child exited, or None if the user detached by typing 'detach_key'
+        (Ctrl-] by default). The child keeps running then, and can be attached again.
+        '''
+        import tty, termios
+        stdin_fd = sys.stdin.fileno()
+        stdout = sys.stdout.buffer
+        def show(data:bytes) -> None:
+            stdout.write(data)
+            stdout.flush()
+            return
+        saved_mode = termios.tcgetattr(stdin_fd) if os.isatty(stdin_fd) else None
+        self.__output.add_callback(show, replay=True)
+        try:
+            if saved_mode is not None:
+                tty.setraw(stdin_fd)
+                size = os.get_terminal_size(stdin_fd)
+                self.setwinsize(size.lines, size.columns)
+            detached = False
+            while not detached and self.__returncode is None:
+                readable, _, _ = select.select([stdin_fd], [], [], 0.1)
+                if not readable:
+                    continue
+                data = os.read(stdin_fd, 1024)
+                if data == b'':
+                    # Stdin got closed
+                    break
+                data, key, _ = data.partition(detach_key)
+                detached = key != b''
+                try:
+                    if data:
+                        self.write(data)
+                except (OSError, ValueError):
+                    # The child is gone
+                    break
+                continue
+            # Show the child's last words
+            if self.__returncode is not None:
+                self.__output.wait(1.0)
+        finally:
+            if saved_mode is not None:
+                termios.tcsetattr(stdin_fd, termios.TCSADRAIN, saved_mode)
+            self.__output.remove_callback(show)
+        return self.__returncode
+
+    def __on_eof(self) -> None:
+        '''
+        Invoked from the reader thread once the child side of the pty got closed.
+        '''
+        with self.__lock:
+            self.__eof = True
+            must_close = self.__returncode is not None
+        if must_close:
+            self.__process.close()
+        return
+
+
+#^                                            PAYLOAD                                             ^#
+#% ============================================================================================== %#
+#% Arguments are limited in size (ARG_MAX) and must be text. A payload passes any amount of bytes %#
+#% to a child without copying it around: the parent puts the data in shared memory once, and the  %#
+#% child maps it read-only. The child finds it through the 'TERMINAL_SPAWNER_PAYLOAD' environment %#
+#% variable, which works through any terminal emulator. The variable has the format:              %#
+#%     <size>@<path>     or     <size>@tag:<name>                                                 %#
+#% On Linux, the data lives in a sealed memfd, which the child opens as '/proc/<pid>/fd/<n>' of   %#
+#% the parent. On Windows, it's a named shared memory block ('tag:'). Elsewhere, it's a read-only %#
+#% temporary file that the child maps from the page cache.                                        %#
+#%                                                                                                %#
+# The child's side is in 'child_helpers.py', which children can import cheaply
+from child_helpers import payload_env_var, open_payload
+
+def __create_payload(payload:Union[None, bytes, bytearray, memoryview, Payload],
+                     ) -> Tuple[Optional[Payload], bool]:
+    '''
+    Turn the 'payload' keyword argument of the spawn functions into a Payload, or None. Also return
+    whether the Payload was created here, and must be closed once the child exited.
+    '''
+    if payload is None:
+        return None, False
+    if isinstance(payload, Payload):
+        return payload, False
+    return Payload(payload), True
+
+class Payload:
+    '''
+    Read-only data for children, in shared memory. The data is copied in once, when the Payload is
+    created. Each child that gets it maps the same memory, see 'open_payload()'. Keep the Payload
+    open until the children mapped it - or simply until they exited.
+    '''
+    def __init__(self, data:Union[bytes, bytearray, memoryview]) -> None:
+        '''
+        :param data: The bytes to be passed on. Any object supporting the buffer protocol.
+        '''
+        self.location:Optional[str] = None
+        self.__fd:Optional[int] = None
+        self.__mmap:Optional[mmap.mmap] = None
+        self.__filepath:Optional[str] = None
+        view = memoryview(data).cast('B')
+        self.size:int = view.nbytes
+        if platform.system().lower() == 'windows':
+            #$ Named shared memory
+            name = f'terminal_spawner_payload_{os.getpid()}_{secrets.token_hex(8)}'
+            self.__mmap = mmap.mmap(-1, max(self.size, 1), tagname=name)
+            self.__mmap[:self.size] = view
+            self.location = f'tag:{name}'
+        elif hasattr(os, 'memfd_create'):
+            #$ Sealed memfd
+            import fcntl
+            self.__fd = os.memfd_create(
+                'terminal_spawner_payload', os.MFD_CLOEXEC | os.MFD_ALLOW_SEALING
+            )
+            self.__write(view)
+            # Nobody - including this process - can change the data anymore
+            fcntl.fcntl(
+                self.__fd,
+                fcntl.F_ADD_SEALS,
+                fcntl.F_SEAL_SHRINK | fcntl.F_SEAL_GROW | fcntl.F_SEAL_WRITE | fcntl.F_SEAL_SEAL,
+            )
+            self.location = f'/proc/{os.getpid()}/fd/{self.__fd}'
+        else:
+            #$ Read-only temporary file
+            fd, self.__filepath = tempfile.mkstemp(prefix='terminal_spawner_payload_')
+            self.__fd = fd
+            self.__write(view)
+            os.chmod(self.__filepath, 0o400)
+            self.location = self.__filepath
+        return
+
+    def __enter__(self) -> Payload:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+        return
+
+    def get_env(self, env:Optional[Mapping[str, str]] = None) -> Dict[str, str]:
+        '''
+        Return a copy of the given environment (default: 'os.environ') with the payload variable
+        added to it.
+        '''
+        if self.location is None:
+            raise RuntimeError('Payload is closed')
+        result = dict(os.environ if env is None else env)
+        result[payload_env_var] = f'{self.size}@{self.location}'
+        return result
+
+    def close(self) -> None:
+        '''
+        Release the shared memory. Children that mapped it already keep their mapping.
+        '''
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+        if self.__mmap is not None:
+            self.__mmap.close()
+            self.__mmap = None
+        if self.__filepath is not None:
+            try:
+                os.remove(self.__filepath)
+            except OSError:
+                pass
+            self.__filepath = None
+        self.location = None
+        return
+
+    def __del__(self) -> None:
+        self.close()
+        return
+
+    def __write(self, view:memoryview) -> None:
+        assert self.__fd is not None
+        offset = 0
+        while offset < len(view):
+            offset += os.write(self.__fd, view[offset:])
+            continue
+        return
+
+
+#^                                      PROCESS SUPERVISOR                                        ^#
+#% ============================================================================================== %#
+#% Every child from 'spawn_new_terminal()' is registered with one process-wide supervisor. A      %#
+#% single thread reaps all of them and dispatches their exit callbacks. On Linux, the thread      %#
+#% sleeps in epoll on a pidfd per child. Without pidfds (older kernels, other platforms, or no    %#
+#% file descriptors left), it's woken up by SIGCHLD and falls back to polling.                    %#
+#%                                                                                                %#
+#% The supervisor can also watch processes that aren't children of this one, like the panes of    %#
+#% the tmux server. A pidfd tells when they exit as well. They can't be reaped though, so their   %#
+#% ForeignProcess stand-in tells the returncode - whenever it knows it, from any thread. The      %#
+#% supervisor thread never waits for that.                                                        %#
+#%                                                                                                %#
+__supervisor:Optional[ProcessSupervisor] = None
+__supervisor_lock = threading.Lock()
+# The 'returncode' of a child whose exit status got lost, eg. because someone else reaped it. Real
+# returncodes are in 0..255, or minus a signal number.
+unknown_returncode:int = 256
+
+class ExitResult(NamedTuple):
+    '''
+    How a child process ended, and the resources it used. The resource usage comes from 'wait4()'
+    and covers the child plus all of its descendants that it waited for. On Linux, the child is the
+    terminal emulator, so that includes the program running in it. Fields that are unknown (eg. on
+    Windows) are None.
+
+    :returncode:           The 'returncode', as in 'subprocess.Popen.returncode'. If it got
+                           lost, 'unknown_returncode'.
+    :wall_time:            Seconds from the spawn until the child was reaped.
+    :user_time:            Seconds of CPU time in user mode.
+    :system_time:          Seconds of CPU time in kernel mode.
+    :max_rss:              Peak resident set size in bytes, of the largest process.
+    :voluntary_switches:   Context switches because a process waited, eg. for I/O.
+    :involuntary_switches: Context switches because a process got preempted.
+    '''
+    returncode:int
+    wall_time:Optional[float] = None
+    user_time:Optional[float] = None
+    system_time:Optional[float] = None
+    max_rss:Optional[int] = None
+    voluntary_switches:Optional[int] = None
+    involuntary_switches:Optional[int] = None
+
+    @staticmethod
+    def from_rusage(returncode:int, rusage:Any) -> ExitResult:
+        '''
+        Create an ExitResult from a 'resource.struct_rusage', as returned by 'os.wait4()'.
+        '''
+        # Linux reports 'ru_maxrss' in KiB, macOS in bytes
+        rss_unit = 1 if sys.platform == 'darwin' else 1024
+        return ExitResult(
+            returncode           = returncode,
+            user_time            = rusage.ru_utime,
+            system_time          = rusage.ru_stime,
+            max_rss              = rusage.ru_maxrss * rss_unit,
+            voluntary_switches   = rusage.ru_nvcsw,
+            involuntary_switches = rusage.ru_nivcsw,
+        )
+
+def get_supervisor() -> ProcessSupervisor:
+    '''
+    Return the process-wide supervisor. Create it on first use.
+    '''
+    global __supervisor
+    with __supervisor_lock:
+        if __supervisor is None:
+            __supervisor = ProcessSupervisor()
+        return __supervisor
+
+class ResourceAccounting:
+    '''
+    Aggregate the ExitResults of many children, eg. for capacity planning:
+
+        accounting = ResourceAccounting()
+        for ...:
+            accounting.track(spawn_new_terminal(...))
+        ...
+        print(accounting.get_summary())
+    '''
+    fields = ('wall_time', 'user_time', 'system_time', 'max_rss', 'voluntary_switches',
+              'involuntary_switches', )
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__results:List[ExitResult] = []
+        return
+
+    def track(self, handle:SpawnHandle) -> None:
+        '''
+        Add the ExitResult of the given child once it completed.
+        '''
+        handle.add_done_callback(lambda h: self.add(h.result()))
+        return
+
+    def add(self, result:ExitResult) -> None:
+        with self.__lock:
+            self.__results.append(result)
+        return
+
+    @property
+    def results(self) -> List[ExitResult]:
+        with self.__lock:
+            return list(self.__results)
+
+    def get_summary(self) -> Dict[str, Any]:
+        '''
+        Return the number of children, the number that failed (non-zero returncode), and for each
+        resource field the 'total', 'mean' and 'max' over the children that reported it. CPU time
+        per wall time second is in 'cpu_utilization'.
+        '''
+        results = self.results
+        summary:Dict[str, Any] = {
+            'count'  : len(results),
+            'failed' : sum(1 for r in results if r.returncode != 0),
+        }
+        for field in self.fields:
+            values = [getattr(r, field) for r in results if getattr(r, field) is not None]
+            summary[field] = {
+                'total' : sum(values) if values else None,
+                'mean'  : sum(values) / len(values) if values else None,
+                'max'   : max(values) if values else None,
+            }
+            continue
+        cpu_time = sum(
+            r.user_time + r.system_time for r in results
+            if r.user_time is not None and r.system_time is not None
+        )
+        wall_time = summary['wall_time']['total']
+        summary['cpu_utilization'] = cpu_time / wall_time if wall_time else None
+        return summary
+
+class SpawnedProcess:
+    '''
+    Stand-in for the 'subprocess.Popen' object of a child that was launched some other way, eg.
+    with 'os.posix_spawn()'. The supervisor reaps it, and sets its 'returncode'.
+    '''
+    def __init__(self, pid:int, args:List[str]) -> None:
+        self.pid = pid
+        self.args = args
+        self.returncode:Optional[int] = None
+        return
+
+    def poll(self) -> Optional[int]:
+        return self.returncode
+
+    def send_signal(self, signum:int) -> None:
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, signum)
+            except ProcessLookupError:
+                pass
+        return
+
+    def terminate(self) -> None:
+        self.send_signal(signal.SIGTERM)
+        return
+
+    def kill(self) -> None:
+        self.send_signal(signal.SIGKILL)
+        return
+
+class ForeignProcess(SpawnedProcess, abc.ABC):
+    '''
+    Stand-in for the 'subprocess.Popen' object of a process that isn't a child of this one. The
+    supervisor notices when it's gone, but can't reap it for its returncode. Subclasses implement
+    '_collect_result()' to find it out some other way.
+    '''
+    def is_alive(self) -> bool:
+        try:
+            os.kill(self.pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    @abc.abstractmethod
+    def _collect_result(self, deliver:Callable[[ExitResult], None]) -> None:
+        '''
+        Find out how the process, which is gone, ended. Pass its ExitResult to 'deliver()' - right
+        away, or later from another thread. Invoked by the supervisor thread: must never block.
+        '''
+        return
+
+class ProcessSupervisor:
+    '''
+    Reap any number of child processes from one thread. Use 'get_supervisor()' rather than creating
+    your own instance.
+    '''
+    poll_interval:float = 0.1
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__thread:Optional[threading.Thread] = None
+        # Children watched through a pidfd: {pidfd: (pid, callback, process)}
+        self.__pidfd_watches:Dict[int, Tuple[int, Callable[[ExitResult], None], Optional[subprocess.Popen]]] = {}
+        # Children that need polling: {pid: (callback, process)}
+        self.__polled_watches:Dict[int, Tuple[Callable[[ExitResult], None], Optional[subprocess.Popen]]] = {}
+        self.__epoll:Optional[Any] = None
+        if hasattr(select, 'epoll') and hasattr(os, 'pidfd_open'):
+            self.__epoll = select.epoll()
+        # Pipe to wake up the supervisor thread
+        self.__wakeup_read, self.__wakeup_write = os.pipe()
+        os.set_blocking(self.__wakeup_read, False)
+        os.set_blocking(self.__wakeup_write, False)
+        if self.__epoll is not None:
+            self.__epoll.register(self.__wakeup_read, select.EPOLLIN)
+        self.__install_sigchld_handler()
+        return
+
+    def __len__(self) -> int:
+        '''
+        Number of children being watched.
+        '''
+        with self.__lock:
+            return len(self.__pidfd_watches) + len(self.__polled_watches)
+
+    def watch(self,
+              pid:int,
+              callback:Callable[[ExitResult], None],
+              process:Optional[subprocess.Popen] = None,
+              ) -> None:
+        '''
+        Start watching a child process. Once it exits, the supervisor reaps it and invokes
+        'callback(result)' from the supervisor thread. For a ForeignProcess, the callback comes
+        from the thread that finds out its result (see 'ForeignProcess._collect_result()').
+
+        :param pid:      The process id of the child. Must be a child of this process, unless
+                         'process' is a ForeignProcess.
+
+        :param callback: Invoked with an ExitResult once the child exited. Its 'wall_time' is not
+                         filled in: the supervisor doesn't know when the child was spawned.
+
+        :param process:  The Popen object for the child, if any. Its 'returncode' attribute gets set
+                         after reaping, such that it doesn't try to reap the child again. On Windows,
+                         it's required: the child gets polled through it.
+        '''
+        pidfd:Optional[int] = None
+        if self.__epoll is not None:
+            try:
+                pidfd = os.pidfd_open(pid)
+            except OSError:
+                # Old kernel, already reaped or out of file descriptors. Poll this one.
+                pidfd = None
+        with self.__lock:
+            if pidfd is not None:
+                self.__pidfd_watches[pidfd] = (pid, callback, process)
+                assert self.__epoll is not None
+                self.__epoll.register(pidfd, select.EPOLLIN)
+            else:
+                self.__polled_watches[pid] = (callback, process)
+            if self.__thread is None:
+                self.__thread = threading.Thread(
+                    target = self.__run,
+                    name   = 'terminal_spawner-supervisor',
+                    daemon = True,
+                )
+                self.__thread.start()
+        if pidfd is None:
+            self.__wake_up()
+        return
+
+    def __run(self) -> None:
+        '''
+        Supervisor thread.
+        '''
+        while True:
+            with self.__lock:
+                must_poll = len(self.__polled_watches) > 0
+            timeout = self.poll_interval if must_poll else None
+            #$ Wait for something to happen
+            ready_pidfds:List[int] = []
+            if self.__epoll is not None:
+                try:
+                    events = self.__epoll.poll(-1 if timeout is None else timeout)
+                except InterruptedError:
+                    events = []
+                ready_pidfds = [fd for fd, _ in events if fd != self.__wakeup_read]
+            else:
+                select.select([self.__wakeup_read], [], [], timeout)
+            self.__drain_wakeup_pipe()
+
+            #$ Reap children watched through a pidfd
+            for pidfd in ready_pidfds:
+                with self.__lock:
+                    pid, callback, process = self.__pidfd_watches.pop(pidfd)
+                    assert self.__epoll is not None
+                    self.__epoll.unregister(pidfd)
+                os.close(pidfd)
+                if isinstance(process, ForeignProcess):
+                    # Not our child, and gone
+                    self.__collect(process, callback)
+                    continue
+                # The pidfd is readable, so the child is a zombie. This doesn't block.
+                result = self.__reap(pid, process, block=True)
+                assert result is not None
+                self.__dispatch(callback, result)
+                continue
+
+            #$ Poll the others
+            if must_poll:
+                with self.__lock:
+                    polled = list(self.__polled_watches.items())
+                for pid, (callback, process) in polled:
+                    if isinstance(process, ForeignProcess):
+                        if process.is_alive():
+                            continue
+                        with self.__lock:
+                            del self.__polled_watches[pid]
+                        self.__collect(process, callback)
+                        continue
+                    result = self.__reap(pid, process, block=False)
+                    if result is None:
+                        continue
+                    with self.__lock:
+                        del self.__polled_watches[pid]
+                    self.__dispatch(callback, result)
+                    continue
+            continue
+
+    @staticmethod
+    def __reap(pid:int, process:Optional[subprocess.Popen], block:bool) -> Optional[ExitResult]:
+        '''
+        Reap the child. Return its ExitResult, or None if it's still running.
+        '''
+        if os.name == 'nt':
+            assert process is not None
+            returncode = process.poll()
+            return None if returncode is None else ExitResult(returncode)
+        try:
+            reaped_pid, status, rusage = os.wait4(pid, 0 if block else os.WNOHANG)
+        except ChildProcessError:
+            # Someone else reaped it already. If that was the Popen object, it knows the returncode.
+            # Otherwise, it's lost, and so is the resource usage.
+            returncode = process.returncode if process is not None else None
+            if returncode is None:
+                returncode = unknown_returncode
+                if process is not None:
+                    process.returncode = returncode
+            return ExitResult(returncode)
+        if reaped_pid == 0:
+            return None
+        returncode = os.waitstatus_to_exitcode(status)
+        if process is not None:
+            process.returncode = returncode
+        return ExitResult.from_rusage(returncode, rusage)
+
+    @staticmethod
+    def __collect(process:ForeignProcess, callback:Callable[[ExitResult], None]) -> None:
+        '''
+        Let a ForeignProcess that is gone find out how it ended. Set its returncode, and invoke the
+        callback once the ExitResult is delivered. Doesn't wait for it.
+        '''
+        def deliver(result:ExitResult) -> None:
+            process.returncode = result.returncode
+            ProcessSupervisor.__dispatch(callback, result)
+            return
+        try:
+            process._collect_result(deliver)
+        except Exception:
+            traceback.print_exc()
+        return
+
+    @staticmethod
+    def __dispatch(callback:Callable[[ExitResult], None], result:ExitResult) -> None:
+        '''
+        Invoke an exit callback. An exception in a callback must never kill the supervisor thread.
+        '''
+        try:
+            callback(result)
+        except Exception:
+            traceback.print_exc()
+        return
+
+    def __wake_up(self) -> None:
+        try:
+            os.write(self.__wakeup_write, b'\0')
+        except (BlockingIOError, OSError):
+            # Pipe full: the thread wakes up anyway
+            pass
+        return
+
+    def __drain_wakeup_pipe(self) -> None:
+        try:
+            while os.read(self.__wakeup_read, 4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        return
+
+    def __install_sigchld_handler(self) -> None:
+        '''
+        Without pidfds, let SIGCHLD wake up the supervisor thread. This is only possible from the
+        main thread. Any previously installed handler is still invoked.
+        '''
+        if self.__epoll is not None or not hasattr(signal, 'SIGCHLD'):
+            return
+        if threading.current_thread() is not threading.main_thread():
+            return
+        previous_handler = signal.getsignal(signal.SIGCHLD)
+        def handler(signum:int, frame:Any) -> None:
+            self.__wake_up()
+            if callable(previous_handler):
+                previous_handler(signum, frame)
+            return
+        signal.signal(signal.SIGCHLD, handler)
+        return
+
+
+#^                                          TMUX BACKEND                                          ^#
+#% ============================================================================================== %#
+#% With backend='tmux', each child gets a new window in one long-lived tmux session, instead of   %#
+#% a terminal emulator of its own. The session is driven through a single control mode client     %#
+#% ('tmux -C'), so a spawn costs one command over a pipe. The windows only show up on screen once %#
+#% someone attaches to the session.                                                               %#
+#%                                                                                                %#
+#% The children are children of the tmux server, not of the parent. A small shell wrapper writes  %#
+#% the returncode to a status file, and the supervisor watches the pid of the pane (see           %#
+#% ForeignProcess).                                                                               %#
+#%                                                                                                %#
+__tmux_session:Optional[TmuxSession] = None
+__tmux_session_lock = threading.Lock()
+
+def get_tmux_session() -> TmuxSession:
+    '''
+    Return the process-wide tmux session for the 'tmux' backend. Start it on first use.
+    '''
+    global __tmux_session
+    with __tmux_session_lock:
+        if __tmux_session is None:
+            session = TmuxSession()
+            session.start()
+            __tmux_session = session
+        return __tmux_session
+
+def __spawn_tmux(program:str, argv:List[str], **kwargs) -> SpawnHandle:
+    '''
+    Launch the program in a new window of the tmux session, instead of in a terminal emulator. Not
+    available on Windows.
+    '''
+    #& RUN
+    if os.name == 'nt':
+        raise RuntimeError(f'The {q}tmux{q} backend is not available on Windows')
+    handshake:bool = kwargs.pop('handshake', False)
+    output:Optional[OutputStream] = kwargs.pop('output', None)
+    trace:SpawnTrace = kwargs.pop('trace')
+    env = kwargs.pop('env', None)
+    cwd = kwargs.pop('cwd', None)
+    if kwargs:
+        raise TypeError(
+            f'Unsupported arguments for the {q}tmux{q} backend: {", ".join(sorted(kwargs))}'
+        )
+    session = get_tmux_session()
+    ready_listener = ReadinessListener() if handshake else None
+    if ready_listener is not None:
+        env = ready_listener.get_env(env)
+    trace.event(
+        'command', level='debug', arguments=[program, *argv], options=['cwd', 'env'],
+        session=session.session_name,
+    )
+    # The 'popen' span covers the launch, just like for the other backends
+    with trace.span('popen'):
+        spawn_time = time.monotonic()
+        child = session.spawn(program, argv, env, cwd)
+    #& RETURN WAIT FUNCTION
+    return SpawnHandle(child, spawn_time, ready_listener, output, trace)
+
+class TmuxSession:
+    '''
+    A session on a private tmux server, driven through one control mode client ('tmux -C'). Use
+    'get_tmux_session()' rather than creating your own instance. To look at the children:
+
+        $ tmux -L terminal_spawner attach -t spawner-<pid of the parent>
+    '''
+    # Runs the child, and writes its returncode to the file given as '$0' once it exited. The traps
+    # keep the wrapper alive until then, if the pane's process group gets a signal. A closed window
+    # hangs up on the wrapper, and the kernel passes that on to the child only once the wrapper is
+    # gone. So SIGHUP is left alone.
+    status_wrapper_source = 'trap : INT QUIT TERM; "$@"; echo $? > "$0"'
+    command_timeout:float = 10.0
+
+    def __init__(self,
+                 socket_name:str = 'terminal_spawner',
+                 session_name:Optional[str] = None,
+                 ) -> None:
+        '''
+        :param socket_name:  Name of the tmux server socket, see 'tmux -L'.
+
+        :param session_name: Name of the session. Default: 'spawner-<pid>'.
+        '''
+        self.socket_name = socket_name
+        self.session_name = session_name or f'spawner-{os.getpid()}'
+        self.__process:Optional[subprocess.Popen] = None
+        self.__lock = threading.Lock()
+        # Commands waiting for their reply, in the order they were sent
+        self.__pending:Deque[Dict[str, Any]] = collections.deque()
+        # The global environment of the server. None for variables removed from it.
+        self.__server_env:Dict[str, Optional[str]] = {}
+        self.__keepalive_window:Optional[str] = None
+        self.__folderpath:Optional[str] = None
+        self.__status_ids = itertools.count(1)
+        return
+
+    def start(self) -> None:
+        '''
+        Start the control client, and with it the session (and the server, if it isn't running).
+        '''
+        assert self.__process is None
+        tmux_path = shutil.which('tmux')
+        if tmux_path is None:
+            raise RuntimeError(f'The {q}tmux{q} backend needs tmux to be installed')
+        self.__folderpath = tempfile.mkdtemp(prefix='terminal_spawner_tmux_').replace('\\', '/')
+        # The session's first window keeps it alive in between children, for as long as the parent
+        # lives
+        keepalive = f'while kill -0 {os.getpid()} 2>/dev/null; do sleep 5; done'
+        # The control client answers the 'new-session' command first
+        first_reply = self.__expect_reply()
+        self.__process = subprocess.Popen(
+            [
+                tmux_path, '-L', self.socket_name, '-C',
+                'new-session', '-s', self.session_name, '-n', 'spawner', 'sh', '-c', keepalive,
+            ],
+            stdin             = subprocess.PIPE,
+            stdout            = subprocess.PIPE,
+            stderr            = subprocess.DEVNULL,
+            start_new_session = True,
+        )
+        threading.Thread(
+            target = self.__read_replies,
+            args   = (self.__process.stdout,),
+            name   = 'terminal_spawner.tmux',
+            daemon = True,
+        ).start()
+        try:
+            self.__get_reply(first_reply, 'new-session')
+            # Don't let the server stream the output of every pane to the control client. Older
+            # versions don't know this flag, and just send it anyway.
+            try:
+                self.command('refresh-client', '-f', 'no-output')
+            except RuntimeError:
+                pass
+            self.__keepalive_window = self.command(
+                'display-message', '-p', '-t', self.session_name, '#{window_id}'
+            )[0]
+            for line in self.command('show-environment', '-g'):
+                if line.startswith('-'):
+                    self.__server_env[line[1:]] = None
+                else:
+                    name, _, value = line.partition('=')
+                    self.__server_env[name] = value
+                continue
+        except BaseException:
+            self.stop()
+            raise
+        return
+
+    def stop(self) -> None:
+        '''
+        Stop the control client. The children keep running, and the session ends once they did.
+        '''
+        if self.__process is None:
+            return
+        if self.__keepalive_window is not None:
+            try:
+                self.command('kill-window', '-t', self.__keepalive_window)
+            except (RuntimeError, TimeoutError, OSError):
+                pass
+            self.__keepalive_window = None
+        with self.__lock:
+            process, self.__process = self.__process, None
+        assert process.stdin is not None
+        process.stdin.close()
+        try:
+            process.wait(5.0)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        return
+
+    def command(self, *args:str) -> List[str]:
+        '''
+        Run a tmux command through the control client. Return the lines it printed. Raise
+        RuntimeError if it failed.
+        '''
+        line = ' '.join(self.__quote(arg) for arg in args) + '\n'
+        with self.__lock:
+            if self.__process is None:
+                raise RuntimeError('tmux session not started')
+            assert self.__process.stdin is not None
+            reply = self.__expect_reply()
+            self.__process.stdin.write(line.encode('utf-8'))
+            self.__process.stdin.flush()
+        return self.__get_reply(reply, args[0])
+
+    def spawn(self,
+              program:str,
+              argv:List[str],
+              env:Optional[Mapping[str, str]] = None,
+              cwd:Optional[str] = None,
+              ) -> TmuxChild:
+        '''
+        Launch the program in a new window of the session. Return its TmuxChild.
+
+        :param env: The environment for the program, like for 'subprocess.Popen()'. Only what
+                    differs from the server's environment gets sent along.
+
+        :param cwd: The working directory for the program. Default: the current one.
+        '''
+        assert self.__folderpath is not None
+        status_filepath = f'{self.__folderpath}/{next(self.__status_ids)}.status'
+        if env is None:
+            env = os.environ
+        env_arguments:List[str] = []
+        for name, value in env.items():
+            if self.__server_env.get(name) != value:
+                env_arguments += ['-e', f'{name}={value}']
+            continue
+        # Variables can't be removed with '-e'. Let 'env' do that.
+        removed = [
+            name for name, value in self.__server_env.items()
+            if value is not None and name not in env
+        ]
+        command = ['sh', '-c', self.status_wrapper_source, status_filepath]
+        if removed:
+            command.append('env')
+            for name in removed:
+                command += ['-u', name]
+                continue
+        lines = self.command(
+            'new-window', '-d', '-P', '-F', '#{pane_pid}',
+            '-t', f'{self.session_name}:',
+            '-n', os.path.basename(program),
+            '-c', cwd or os.getcwd(),
+            *env_arguments,
+            '--', *command, program, *argv,
+        )
+        return TmuxChild(int(lines[0]), [program, *argv], status_filepath)
+
+    def __expect_reply(self) -> Dict[str, Any]:
+        reply:Dict[str, Any] = {'done': threading.Event(), 'lines': [], 'error': False}
+        self.__pending.append(reply)
+        return reply
+
+    def __get_reply(self, reply:Dict[str, Any], command_name:str) -> List[str]:
+        if not reply['done'].wait(self.command_timeout):
+            raise TimeoutError(f'No reply from tmux on {q}{command_name}{q}')
+        if reply['error']:
+            raise RuntimeError(f'tmux {command_name} failed: {" ".join(reply["lines"])}')
+        return reply['lines']
+
+    def __read_replies(self, stdout:IO[bytes]) -> None:
+        '''
+        Reader thread. Replies come in '%begin' ... '%end' (or '%error') blocks, in the order of the
+        commands. Lines starting with '%' outside of a block are notifications, and get ignored.
+        '''
+        reply:Optional[Dict[str, Any]] = None
+        for raw_line in stdout:
+            line = raw_line.decode('utf-8', errors='replace').rstrip('\n')
+            if reply is None:
+                if line.startswith('%begin') and self.__pending:
+                    reply = self.__pending.popleft()
+                continue
+            if line.startswith('%end') or line.startswith('%error'):
+                reply['error'] = line.startswith('%error')
+                reply['done'].set()
+                reply = None
+                continue
+            reply['lines'].append(line)
+            continue
+        # The control client is gone
+        if reply is not None:
+            self.__pending.appendleft(reply)
+        while self.__pending:
+            reply = self.__pending.popleft()
+            reply['error'] = True
+            reply['lines'].append('control client exited')
+            reply['done'].set()
+            continue
+        return
+
+    @staticmethod
+    def __quote(arg:str) -> str:
+        '''
+        Quote an argument for the tmux command parser.
+        '''
+        for char, escaped in (('\\', '\\\\'), ('"', '\\"'), ('$', '\\$'), ('\n', '\\n'),
+                              ('\r', '\\r'), ('\t', '\\t')):
+            arg = arg.replace(char, escaped)
+            continue
+        return f'"{arg}"'
+
+class TmuxChild(ForeignProcess):
+    '''
+    Child running in a window of the TmuxSession. It's a child of the tmux server, not of this
+    process: the supervisor sees it exit through its pidfd, and its returncode comes from the
+    status file the wrapper leaves behind.
+    '''
+    def __init__(self, pid:int, args:List[str], status_filepath:str) -> None:
+        super().__init__(pid, args)
+        self.status_filepath = status_filepath
+        self.__last_signal:Optional[int] = None
+        return
+
+    def send_signal(self, signum:int) -> None:
+        # The pane is a process group of its own, with the wrapper and the program
+        if self.returncode is None:
+            self.__last_signal = signum
+            try:
+                os.killpg(self.pid, signum)
+            except ProcessLookupError:
+                pass
+        return
+
+    def _collect_result(self, deliver:Callable[[ExitResult], None]) -> None:
+        # The wrapper wrote the status file before it exited: no need to ask the tmux server
+        try:
+            with open(self.status_filepath, 'r', encoding='ascii') as f:
+                returncode = int(f.read().strip())
+        except (OSError, ValueError):
+            # The wrapper didn't get to write it: it got killed along with the program. By our
+            # last signal, or else by the hangup of a window that got closed.
+            deliver(ExitResult(-(self.__last_signal or signal.SIGHUP)))
+            return
+        try:
+            os.remove(self.status_filepath)
+        except OSError:
+            pass
+        deliver(ExitResult(returncode))
+        return
+
+
+#^                                         SPAWN ENGINES                                          ^#
+#% ============================================================================================== %#
+#% With the 'terminal' backend on Linux, the emulator gets launched by one of 'spawn_engines':    %#
+#%     - 'popen':       'subprocess.Popen()'.                                                     %#
+#%     - 'posix_spawn': 'os.posix_spawn()', without the work Popen does in Python around it.      %#
+#%     - 'forkserver':  A small helper process launches it with 'os.posix_spawn()'.               %#
+#% A GUI parent with a big RSS pays for its size on every launch, and passes its whole            %#
+#% environment along each time. The forkserver is forked early, before the parent grew big (see   %#
+#% 'start_forkserver()'), so its launches cost the same whatever the size of the parent. Each     %#
+#% request only carries the environment variables that differ from the ones it was forked with.   %#
+#%                                                                                                %#
+__forkserver:Optional[Forkserver] = None
+__forkserver_lock = threading.Lock()
+# The Popen arguments (besides 'env') that each engine can handle. With any other one, the spawn
+# falls back to 'popen'. The 'posix_spawn' engine can't change the working directory: that would
+# change it for all threads of this process.
+engine_popen_kwargs:Dict[str, Optional[Tuple[str, ...]]] = {
+    'popen'       : None,
+    'posix_spawn' : ('start_new_session', ),
+    'forkserver'  : ('cwd', 'start_new_session', ),
+}
+# Python ignores these signals. Children get them back to default, just like 'subprocess.Popen()'
+# does with 'restore_signals'.
+__restored_signals = tuple(
+    getattr(signal, name) for name in ('SIGPIPE', 'SIGXFZ', 'SIGXFSZ') if hasattr(signal, name)
+)
+
+def __get_engine(engine:Optional[str], popen_kwargs:Mapping[str, Any]) -> str:
+    '''
+    Return the engine to spawn with: the given one, else the one from $TERMINAL_SPAWNER_ENGINE, else
+    'popen'. Fall back to 'popen' if the engine can't handle all the Popen arguments.
+    '''
+    if engine is None:
+        engine = os.environ.get(engine_env_var) or 'popen'
+    if engine not in spawn_engines:
+        raise ValueError(
+            f'Unknown engine {q}{engine}{q}, choose one of: {", ".join(spawn_engines)}'
+        )
+    supported = engine_popen_kwargs[engine]
+    if supported is not None and any(name not in supported for name in popen_kwargs):
+        return 'popen'
+    return engine
+
+def __launch(engine:str,
+             arguments:List[str],
+             env:Optional[Mapping[str, str]],
+             popen_kwargs:Dict[str, Any],
+             ) -> Union[subprocess.Popen, SpawnedProcess]:
+    '''
+    Launch the program with the given engine. Return its Popen object, or its stand-in.
+    '''
+    #$ popen
+    if engine == 'popen':
+        return subprocess.Popen(arguments, env=env, **popen_kwargs)
+    #$ forkserver
+    if engine == 'forkserver':
+        return start_forkserver().spawn(
+            arguments,
+            env               = env,
+            cwd               = popen_kwargs.get('cwd'),
+            start_new_session = popen_kwargs.get('start_new_session', False),
+        )
+    #$ posix_spawn
+    program = arguments[0]
+    if os.sep not in program:
+        program = shutil.which(program, path=(env or os.environ).get('PATH')) or program
+    pid = os.posix_spawn(
+        program,
+        arguments,
+        os.environ if env is None else env,
+        setsid    = popen_kwargs.get('start_new_session', False),
+        setsigdef = __restored_signals,
+    )
+    return SpawnedProcess(pid, list(arguments))
+
+def get_forkserver() -> Optional[Forkserver]:
+    '''
+    Return the forkserver if it's running, None otherwise.
+    '''
+    forkserver = __forkserver
+    if forkserver is None or not forkserver.is_running():
+        return None
+    return forkserver
+
+def start_forkserver() -> Forkserver:
+    '''
+    Start the forkserver, unless it's running already, and return it. Call this as early as
+    possible: the forkserver is a fork of this process as it is at that moment. So before the
+    process grows big (eg. before PyQt6 gets imported), and before it starts any threads. Not
+    available on Windows.
+    '''
+    global __forkserver
+    with __forkserver_lock:
+        if __forkserver is not None and __forkserver.is_running():
+            return __forkserver
+        if os.name == 'nt':
+            raise RuntimeError('The forkserver is not available on Windows')
+        parent_end, child_end = socket.socketpair()
+        base_env = dict(os.environ)
+        pid = os.fork()
+        if pid == 0:
+            # In the forkserver
+            returncode = 1
+            try:
+                parent_end.close()
+                returncode = __run_forkserver(child_end, base_env)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(returncode)
+        child_end.close()
+        __forkserver = Forkserver(pid, parent_end, base_env)
+        return __forkserver
+
+def __run_forkserver(connection:socket.socket, base_env:Dict[str, str]) -> int:
+    '''
+    Serve the launch requests from the parent until it closes the connection, and report the exit
+    of each child. Runs in the forkserver. The requests and replies are lines of JSON:
+        -> {'id': 1, 'args': [...], 'set_env': {...}, 'unset_env': [...], 'cwd': ..., 'setsid': ...}
+        <- {'id': 1, 'pid': 1234}  or  {'id': 1, 'errno': 2, 'strerror': ..., 'filename': ...}
+        <- {'exit': 1234, 'returncode': 0, 'rusage': [...]}
+    '''
+    #& Set up
+    # Ctrl-C is for the parent. The forkserver stops once the parent is gone.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    wakeup_read, wakeup_write = os.pipe()
+    os.set_blocking(wakeup_read, False)
+    os.set_blocking(wakeup_write, False)
+    signal.set_wakeup_fd(wakeup_write)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    default_signals = (signal.SIGINT, *__restored_signals)
+    folderpath = os.getcwd()
+    buffer = b''
+
+    #& Serve
+    while True:
+        readable, _, _ = select.select([connection, wakeup_read], [], [])
+        replies:List[Dict[str, Any]] = []
+        #$ Launch
+        if connection in readable:
+            data = connection.recv(1 << 16)
+            if data == b'':
+                # The parent is gone
+                break
+            *lines, buffer = (buffer + data).split(b'\n')
+            for line in lines:
+                request = json.loads(line)
+                env = dict(base_env)
+                env.update(request['set_env'])
+                for name in request['unset_env']:
+                    env.pop(name, None)
+                    continue
+                try:
+                    # Nothing else runs in here, so changing the working directory is safe
+                    if request['cwd'] is not None:
+                        os.chdir(request['cwd'])
+                    program = request['args'][0]
+                    if os.sep not in program:
+                        program = shutil.which(program, path=env.get('PATH')) or program
+                    pid = os.posix_spawn(
+                        program,
+                        request['args'],
+                        env,
+                        setsid    = request['setsid'],
+                        setsigdef = default_signals,
+                    )
+                    replies.append({'id': request['id'], 'pid': pid})
+                except OSError as e:
+                    replies.append({
+                        'id'       : request['id'],
+                        'errno'    : e.errno,
+                        'strerror' : e.strerror,
+                        'filename' : e.filename,
+                    })
+                finally:
+                    if request['cwd'] is not None:
+                        os.chdir(folderpath)
+                continue
+        #$ Reap
+        if wakeup_read in readable:
+            try:
+                while os.read(wakeup_read, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+        while True:
+            try:
+                pid, status, rusage = os.wait4(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            replies.append({
+                'exit'       : pid,
+                'returncode' : os.waitstatus_to_exitcode(status),
+                'rusage'     : list(rusage),
+            })
+            continue
+        # A child's exit always comes after the reply on its launch
+        if replies:
+            connection.sendall(b''.join(json.dumps(r).encode('utf-8') + b'\n' for r in replies))
+        continue
+    return 0
+
+class Forkserver:
+    '''
+    The parent's end of the forkserver. Use 'start_forkserver()' rather than creating your own
+    instance. Children launched by the forkserver are its children, not this process's: the
+    supervisor sees them exit through their pidfd, and the forkserver reports their returncode and
+    resource usage. The reader thread passes them on as soon as they arrive.
+    '''
+    command_timeout:float = 10.0
+
+    def __init__(self, pid:int, connection:socket.socket, base_env:Dict[str, str]) -> None:
+        '''
+        :param pid:        The process id of the forkserver.
+
+        :param connection: The parent's end of the socket pair.
+
+        :param base_env:   The environment the forkserver was forked with. Launch requests only
+                           carry what differs from it.
+        '''
+        self.pid = pid
+        self.__connection = connection
+        self.__base_env = base_env
+        self.__write_lock = threading.Lock()
+        self.__lock = threading.Lock()
+        self.__request_ids = itertools.count(1)
+        # Requests waiting for their reply: {id: reply}
+        self.__pending:Dict[int, Dict[str, Any]] = {}
+        # Results of the children that exited, until they're asked for: {pid: result}
+        self.__results:Dict[int, ExitResult] = {}
+        # Callbacks waiting for the result of a child: {pid: callback}
+        self.__exit_callbacks:Dict[int, Callable[[ExitResult], None]] = {}
+        self.__running:bool = True
+        threading.Thread(
+            target = self.__read_replies,
+            name   = 'terminal_spawner.forkserver',
+            daemon = True,
+        ).start()
+        return
+
+    def is_running(self) -> bool:
+        return self.__running
+
+    def spawn(self,
+              arguments:List[str],
+              env:Optional[Mapping[str, str]] = None,
+              cwd:Optional[str] = None,
+              start_new_session:bool = False,
+              ) -> ForkserverChild:
+        '''
+        Let the forkserver launch the program. Return its ForkserverChild. Raise OSError if the
+        launch failed, like 'subprocess.Popen()' does.
+
+        :param arguments:         The program and its arguments.
+
+        :param env:               The environment for the program, like for 'subprocess.Popen()'.
+                                  Only what differs from the forkserver's environment gets sent.
+
+        :param cwd:               The working directory for the program. Default: the current one.
+
+        :param start_new_session: Run the program in a new session, see 'os.setsid()'.
+        '''
+        if env is None:
+            env = os.environ
+        request_id = next(self.__request_ids)
+        request = {
+            'id'        : request_id,
+            'args'      : list(arguments),
+            'set_env'   : {
+                name: value for name, value in env.items() if self.__base_env.get(name) != value
+            },
+            'unset_env' : [name for name in self.__base_env if name not in env],
+            'cwd'       : os.getcwd() if cwd is None else os.fspath(cwd),
+            'setsid'    : start_new_session,
+        }
+        reply:Dict[str, Any] = {'done': threading.Event(), 'message': None}
+        with self.__lock:
+            if not self.__running:
+                raise RuntimeError('Forkserver is gone')
+            self.__pending[request_id] = reply
+        with self.__write_lock:
+            self.__connection.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        if not reply['done'].wait(self.command_timeout):
+            raise TimeoutError('No reply from the forkserver')
+        message = reply['message']
+        if message is None:
+            raise RuntimeError('Forkserver is gone')
+        if 'errno' in message:
+            raise OSError(message['errno'], message['strerror'], message['filename'])
+        return ForkserverChild(message['pid'], list(arguments), self)
+
+    def stop(self) -> None:
+        '''
+        Stop the forkserver. The children it launched keep running, but their returncodes get lost
+        (see 'unknown_returncode').
+        '''
+        try:
+            self.__connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.__connection.close()
+        try:
+            os.waitpid(self.pid, 0)
+        except ChildProcessError:
+            pass
+        return
+
+    def _add_exit_callback(self, pid:int, callback:Callable[[ExitResult], None]) -> None:
+        '''
+        Invoke 'callback(result)' once the forkserver reported the exit of the given child: right
+        away if it did already, or else later from the reader thread. If the forkserver is gone,
+        the result is lost: its returncode is 'unknown_returncode'.
+        '''
+        with self.__lock:
+            if pid in self.__results:
+                result = self.__results.pop(pid)
+            elif not self.__running:
+                result = ExitResult(unknown_returncode)
+            else:
+                self.__exit_callbacks[pid] = callback
+                return
+        callback(result)
+        return
+
+    def __read_replies(self) -> None:
+        '''
+        Reader thread. Hands out the replies to the waiting requests, and the results to the exit
+        callbacks.
+        '''
+        import resource
+        for line in self.__connection.makefile('rb'):
+            message = json.loads(line)
+            #$ Exit of a child
+            if 'exit' in message:
+                result = ExitResult.from_rusage(
+                    message['returncode'], resource.struct_rusage(message['rusage'])
+                )
+                with self.__lock:
+                    callback = self.__exit_callbacks.pop(message['exit'], None)
+                    if callback is None:
+                        self.__results[message['exit']] = result
+                if callback is not None:
+                    callback(result)
+                continue
+            #$ Reply on a launch
+            with self.__lock:
+                reply = self.__pending.pop(message['id'])
+            reply['message'] = message
+            reply['done'].set()
+            continue
+        # The forkserver is gone
+        with self.__lock:
+            self.__running = False
+            pending, self.__pending = list(self.__pending.values()), {}
+            callbacks, self.__exit_callbacks = list(self.__exit_callbacks.values()), {}
+        for reply in pending:
+            reply['done'].set()
+            continue
+        for callback in callbacks:
+            callback(ExitResult(unknown_returncode))
+            continue
+        return
+
+class ForkserverChild(ForeignProcess):
+    '''
+    Child launched by the Forkserver.
+    '''
+    def __init__(self, pid:int, args:List[str], forkserver:Forkserver) -> None:
+        super().__init__(pid, args)
+        self.forkserver = forkserver
+        return
+
+    def _collect_result(self, deliver:Callable[[ExitResult], None]) -> None:
+        self.forkserver._add_exit_callback(self.pid, deliver)
+        return
+
+
+#^                                          BULK SPAWN                                            ^#
+#% ============================================================================================== %#
+#% Launch many terminals at once. The spawns run in parallel on a thread pool, and the result is  %#
+#% a SpawnGroup to wait on all of them, or on any of them.                                        %#
+#%                                                                                                %#
+def spawn_many(jobs:Iterable[Union[Tuple[str, List[str]], Tuple[str, List[str], Dict[str, Any]]]],
+               max_workers:Optional[int] = None,
+               **kwargs,
+               ) -> SpawnGroup:
+    '''
+    Spawn a new terminal for each job, in parallel. Return a SpawnGroup to keep track of them.
+
+    :param jobs:        The jobs to launch. Each job is a tuple '(script_or_exe_path, argv)' or
+                        '(script_or_exe_path, argv, kwargs)', with the same meaning as the arguments
+                        of 'spawn_new_terminal()'.
+
+    :param max_workers: The maximal number of spawns running at the same time. Default: the number
+                        of jobs, capped at 32.
+
+    :param kwargs:      Keyword arguments passed to 'spawn_new_terminal()' for every job. The kwargs
+                        given in a job itself take precedence.
+    '''
+    import concurrent.futures
+    job_list = list(jobs)
+    group = SpawnGroup(len(job_list))
+    if len(job_list) == 0:
+        return group
+    if max_workers is None:
+        max_workers = min(32, len(job_list))
+
+    def spawn_job(index:int) -> None:
+        job = job_list[index]
+        job_kwargs = {**kwargs, **(job[2] if len(job) > 2 else {})}
+        try:
+            handle = spawn_new_terminal(job[0], job[1], **job_kwargs)
+        except Exception as e:
+            group._set_spawn_error(index, e)
+            return
+        group._set_handle(index, handle)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for index in range(len(job_list)):
+            executor.submit(spawn_job, index)
+    return group
+
+class SpawnGroup:
+    '''
+    Group of children launched by 'spawn_many()'. The jobs are identified by their index in the
+    list of jobs that was passed to 'spawn_many()'. A job that failed to spawn counts as completed,
+    with returncode None. The exception is stored in 'errors'.
+    '''
+    def __init__(self, count:int) -> None:
+        self.handles:List[Optional[SpawnHandle]] = [None] * count
+        self.errors:List[Optional[BaseException]] = [None] * count
+        self.__returncodes:List[Optional[int]] = [None] * count
+        self.__completed:List[int] = []
+        self.__condition = threading.Condition()
+        return
+
+    def __len__(self) -> int:
+        return len(self.handles)
+
+    @property
+    def returncodes(self) -> List[Optional[int]]:
+        '''
+        The 'returncode' of each job, or None for the jobs that are still running (or failed to
+        spawn).
+        '''
+        with self.__condition:
+            return list(self.__returncodes)
+
+    def wait_all(self, timeout:Optional[float] = None) -> List[Optional[int]]:
+        '''
+        Wait for all jobs to complete and return their returncodes. Raise TimeoutError if the
+        timeout expires first.
+        '''
+        with self.__condition:
+            if not self.__condition.wait_for(lambda: len(self.__completed) == len(self.handles), timeout):
+                raise TimeoutError(f'{len(self.handles) - len(self.__completed)} jobs still running')
+            return list(self.__returncodes)
+
+    def wait_any(self, timeout:Optional[float] = None) -> Tuple[int, Optional[int]]:
+        '''
+        Wait for the first job to complete and return '(index, returncode)'. Raise TimeoutError if
+        the timeout expires first.
+        '''
+        with self.__condition:
+            if not self.__condition.wait_for(lambda: len(self.__completed) > 0 or len(self.handles) == 0, timeout):
+                raise TimeoutError('No job completed')
+            if len(self.__completed) == 0:
+                raise ValueError('Empty group')
+            index = self.__completed[0]
+            return index, self.__returncodes[index]
+
+    def as_completed(self, timeout:Optional[float] = None) -> Iterator[Tuple[int, Optional[int]]]:
+        '''
+        Yield '(index, returncode)' for each job, in the order in which they complete. Raise
+        TimeoutError if not all jobs completed within the timeout.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for n in range(len(self.handles)):
+            with self.__condition:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                if not self.__condition.wait_for(lambda: len(self.__completed) > n, remaining):
+                    raise TimeoutError(f'{len(self.handles) - n} jobs still running')
+                index = self.__completed[n]
+                returncode = self.__returncodes[index]
+            yield index, returncode
+            continue
+        return
+
+    def _set_handle(self, index:int, handle:SpawnHandle) -> None:
+        with self.__condition:
+            self.handles[index] = handle
+        handle.add_done_callback(lambda h: self.__set_done(index, h.poll()))
+        return
+
+    def _set_spawn_error(self, index:int, error:BaseException) -> None:
+        with self.__condition:
+            self.errors[index] = error
+        self.__set_done(index, None)
+        return
+
+    def __set_done(self, index:int, returncode:Optional[int]) -> None:
+        with self.__condition:
+            self.__returncodes[index] = returncode
+            self.__completed.append(index)
+            self.__condition.notify_all()
+        return
+
+
+#^                                        SPAWN SCHEDULER                                         ^#
+#% ============================================================================================== %#
+#% A SpawnScheduler sits in front of 'spawn_new_terminal()' and limits how many children run at   %#
+#% the same time. A child holds its slot from the spawn until it exits. Requests beyond the limit %#
+#% wait in a priority queue: a lower 'priority' value goes first, and requests of equal priority  %#
+#% go first-in first-out. The queue itself is bounded too: once it's full, 'submit()' blocks (and %#
+#% 'submit_async()' suspends) until there's room again. That pushes back on whoever floods it.    %#
+#%                                                                                                %#
+class SpawnScheduler:
+    '''
+    Concurrency-limited spawning with priorities and backpressure:
+
+        scheduler = SpawnScheduler(max_concurrent=4, max_queue=100)
+        request = scheduler.submit(path, argv, priority=0)
+        handle = request.wait_started()
+        returncode = handle.wait()
+    '''
+    def __init__(self, max_concurrent:int = 4, max_queue:int = 1000) -> None:
+        '''
+        :param max_concurrent: Maximal number of children running at the same time.
+        :param max_queue:      Maximal number of requests waiting for a slot.
+        '''
+        assert max_concurrent > 0 and max_queue > 0
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.__condition = threading.Condition()
+        self.__heap:List[Tuple[int, int, SpawnRequest]] = []
+        self.__sequence = itertools.count()
+        self.__queued:int = 0
+        self.__running:int = 0
+        self.__shutdown:bool = False
+        self.__async_waiters:List[Tuple[Any, Any]] = []
+        self.__wait_times:Deque[float] = collections.deque(maxlen=1000)
+        self.__counters:Dict[str, int] = {
+            'submitted' : 0,
+            'started'   : 0,
+            'completed' : 0,
+            'failed'    : 0,
+            'cancelled' : 0,
+        }
+        self.__max_queue_depth:int = 0
+        self.__thread = threading.Thread(
+            target = self.__dispatch,
+            name   = 'terminal_spawner.scheduler',
+            daemon = True,
+        )
+        self.__thread.start()
+        return
+
+    def __enter__(self) -> SpawnScheduler:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
+        return
+
+    def submit(self,
+               script_or_exe_path:str,
+               argv:List[str],
+               priority:int = 0,
+               timeout:Optional[float] = None,
+               **kwargs,
+               ) -> SpawnRequest:
+        '''
+        Queue a spawn. Block while the queue is full. Return a SpawnRequest to follow it up. Raise
+        TimeoutError if the queue stays full for longer than 'timeout' seconds.
+
+        :param script_or_exe_path: See 'spawn_new_terminal()'.
+        :param argv:               See 'spawn_new_terminal()'.
+        :param priority:           Lower values are spawned first.
+        :param timeout:            Seconds to wait for room in the queue. None: wait forever.
+        :param kwargs:             Keyword arguments for 'spawn_new_terminal()'.
+        '''
+        request = SpawnRequest(self, script_or_exe_path, argv, priority, kwargs)
+        with self.__condition:
+            if not self.__condition.wait_for(self.__has_room, timeout):
+                raise TimeoutError(f'Spawn queue still full after {timeout} s')
+            self.__enqueue(request)
+        return request
+
+    async def submit_async(self,
+                           script_or_exe_path:str,
+                           argv:List[str],
+                           priority:int = 0,
+                           **kwargs,
+                           ) -> SpawnRequest:
+        '''
+        Same as 'submit()', for asyncio: suspend (instead of block) while the queue is full. Use
+        'asyncio.wait_for()' for a timeout.
+        '''
+        import asyncio
+        request = SpawnRequest(self, script_or_exe_path, argv, priority, kwargs)
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.__condition:
+                if self.__has_room():
+                    self.__enqueue(request)
+                    return request
+                waiter = loop.create_future()
+                self.__async_waiters.append((loop, waiter))
+            try:
+                await waiter
+            finally:
+                with self.__condition:
+                    if (loop, waiter) in self.__async_waiters:
+                        self.__async_waiters.remove((loop, waiter))
+            continue
+
+    def get_metrics(self) -> Dict[str, Any]:
+        '''
+        Return a snapshot of the scheduler's state:
+            - 'queue_depth':     requests waiting for a slot now
+            - 'max_queue_depth': highest queue depth so far
+            - 'running':         children holding a slot now
+            - 'submitted', 'started', 'completed', 'failed', 'cancelled': counters
+            - 'wait_time':       statistics (in seconds) on the time from submit to spawn, for the
+                                 last 1000 spawns: 'count', 'mean', 'p50', 'p95', 'max'
+        '''
+        with self.__condition:
+            wait_times = sorted(self.__wait_times)
+            metrics:Dict[str, Any] = {
+                'queue_depth'     : self.__queued,
+                'max_queue_depth' : self.__max_queue_depth,
+                'running'         : self.__running,
+                **self.__counters,
+            }
+        def percentile(p:float) -> Optional[float]:
+            if len(wait_times) == 0:
+                return None
+            return wait_times[min(len(wait_times) - 1, int(len(wait_times) * p / 100))]
+        metrics['wait_time'] = {
+            'count' : len(wait_times),
+            'mean'  : sum(wait_times) / len(wait_times) if wait_times else None,
+            'p50'   : percentile(50),
+            'p95'   : percentile(95),
+            'max'   : wait_times[-1] if wait_times else None,
+        }
+        return metrics
+
+    def shutdown(self, cancel_pending:bool = False) -> None:
+        '''
+        Stop accepting requests. Spawn the queued ones first, unless 'cancel_pending' is set. The
+        children that were spawned keep running.
+        '''
+        with self.__condition:
+            self.__shutdown = True
+            if cancel_pending:
+                for _, _, request in self.__heap:
+                    if request._cancel_queued():
+                        self.__queued -= 1
+                        self.__counters['cancelled'] += 1
+                    continue
+            self.__condition.notify_all()
+        self.__thread.join()
+        return
+
+    def _cancel(self, request:SpawnRequest) -> bool:
+        '''
+        Remove the given request from the queue. Return False if it isn't queued anymore.
+        '''
+        with self.__condition:
+            if not request._cancel_queued():
+                return False
+            self.__queued -= 1
+            self.__counters['cancelled'] += 1
+            self.__notify_room()
+        return True
+
+    def __has_room(self) -> bool:
+        if self.__shutdown:
+            raise RuntimeError('Scheduler is shut down')
+        return self.__queued < self.max_queue
+
+    def __enqueue(self, request:SpawnRequest) -> None:
+        heapq.heappush(self.__heap, (request.priority, next(self.__sequence), request))
+        self.__queued += 1
+        self.__max_queue_depth = max(self.__max_queue_depth, self.__queued)
+        self.__counters['submitted'] += 1
+        self.__condition.notify_all()
+        return
+
+    def __notify_room(self) -> None:
+        '''
+        Wake up everyone waiting for room in the queue. Call with the lock held.
+        '''
+        self.__condition.notify_all()
+        for loop, waiter in self.__async_waiters:
+            loop.call_soon_threadsafe(self.__resolve_waiter, waiter)
+            continue
+        self.__async_waiters.clear()
+        return
+
+    @staticmethod
+    def __resolve_waiter(waiter:Any) -> None:
+        if not waiter.done():
+            waiter.set_result(None)
+        return
+
+    def __dispatch(self) -> None:
+        '''
+        Body of the dispatcher thread: spawn the next request whenever a slot is free.
+        '''
+        while True:
+            #$ Take the next request
+            with self.__condition:
+                while True:
+                    # Skip cancelled requests
+                    while self.__heap and self.__heap[0][2].cancelled():
+                        heapq.heappop(self.__heap)
+                        continue
+                    if self.__heap and self.__running < self.max_concurrent:
+                        break
+                    if self.__shutdown and not self.__heap:
+                        return
+                    self.__condition.wait()
+                    continue
+                _, _, request = heapq.heappop(self.__heap)
+                if not request._set_running():
+                    continue
+                self.__queued -= 1
+                self.__running += 1
+                self.__wait_times.append(time.monotonic() - request.submit_time)
+                self.__notify_room()
+
+            #$ Spawn it
+            try:
+                handle = spawn_new_terminal(
+                    request.script_or_exe_path, request.argv, **request.kwargs
+                )
+            except Exception as e:
+                with self.__condition:
+                    self.__running -= 1
+                    self.__counters['failed'] += 1
+                    self.__condition.notify_all()
+                request._set_error(e)
+                continue
+            with self.__condition:
+                self.__counters['started'] += 1
+            request._set_handle(handle)
+            handle.add_done_callback(self.__on_child_exit)
+            continue
+
+    def __on_child_exit(self, handle:SpawnHandle) -> None:
+        with self.__condition:
+            self.__running -= 1
+            self.__counters['completed'] += 1
+            self.__condition.notify_all()
+        return
+
+class SpawnRequest:
+    '''
+    A spawn submitted to a SpawnScheduler. Wait for it with 'wait_started()' (which returns the
+    SpawnHandle) or 'wait()' (which returns the 'returncode'). In asyncio code, await
+    'asyncio.wrap_future(request.future)' to get the SpawnHandle.
+    '''
+    def __init__(self,
+                 scheduler:SpawnScheduler,
+                 script_or_exe_path:str,
+                 argv:List[str],
+                 priority:int,
+                 kwargs:Dict[str, Any],
+                 ) -> None:
+        import concurrent.futures
+        self.script_or_exe_path = script_or_exe_path
+        self.argv = argv
+        self.priority = priority
+        self.kwargs = kwargs
+        self.submit_time:float = time.monotonic()
+        self.start_time:Optional[float] = None
+        # Resolves to the SpawnHandle, or to the exception raised by the spawn
+        self.future:concurrent.futures.Future = concurrent.futures.Future()
+        self.__scheduler = scheduler
+        return
+
+    @property
+    def handle(self) -> Optional[SpawnHandle]:
+        '''
+        The SpawnHandle, or None if the child wasn't spawned (yet).
+        '''
+        if self.future.done() and not self.future.cancelled() and self.future.exception() is None:
+            return self.future.result()
+        return None
+
+    @property
+    def wait_time(self) -> Optional[float]:
+        '''
+        Seconds the request spent in the queue, or None if it's still there.
+        '''
+        if self.start_time is None:
+            return None
+        return self.start_time - self.submit_time
+
+    def cancelled(self) -> bool:
+        return self.future.cancelled()
+
+    def cancel(self) -> bool:
+        '''
+        Take the request out of the queue. Return False if it's too late: the child was spawned
+        already.
+        '''
+        return self.__scheduler._cancel(self)
+
+    def wait_started(self, timeout:Optional[float] = None) -> SpawnHandle:
+        '''
+        Wait until the child was spawned and return its SpawnHandle. Raise the spawn's exception if
+        it failed, 'concurrent.futures.CancelledError' if the request was cancelled and TimeoutError
+        if the timeout expires first.
+        '''
+        import concurrent.futures
+        try:
+            return self.future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            raise TimeoutError(f'Request still queued after {timeout} s') from None
+
+    def wait(self, timeout:Optional[float] = None) -> int:
+        '''
+        Wait until the child was spawned and completed. Return its 'returncode'.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        handle = self.wait_started(timeout)
+        return handle.wait(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def _set_running(self) -> bool:
+        if not self.future.set_running_or_notify_cancel():
+            return False
+        self.start_time = time.monotonic()
+        return True
+
+    def _set_handle(self, handle:SpawnHandle) -> None:
+        self.future.set_result(handle)
+        return
+
+    def _set_error(self, error:BaseException) -> None:
+        self.future.set_exception(error)
+        return
+
+    def _cancel_queued(self) -> bool:
+        return self.future.cancel()
+
+
+#^                                         ASYNCIO SPAWN                                          ^#
+#% ============================================================================================== %#
+#% Same as 'spawn_new_terminal()', but for asyncio based parents. The child is launched like      %#
+#% 'spawn_new_terminal()' does, and the process supervisor reaps it. Its exit resolves a future   %#
+#% in the event loop. So waiting on any number of children doesn't tie up a thread each, unlike   %#
+#% the child watcher of 'asyncio.create_subprocess_exec()' before Python 3.12.                    %#
+#%                                                                                                %#
+async def async_spawn_new_terminal(script_or_exe_path:Union[str, LaunchPlan],
+                                   argv:List[str],
+                                   **kwargs,
+                                   ) -> AsyncSpawnHandle:
+    '''
+    Spawn a new terminal and launch the given script or executable in it, like
+    'spawn_new_terminal()' does. Return an AsyncSpawnHandle, which can be awaited to get the
+    'returncode'.
+
+    :param script_or_exe_path:  See 'spawn_new_terminal()'.
+
+    :param argv:                See 'spawn_new_terminal()'.
+
+    :param handshake:           See 'spawn_new_terminal()'.
+
+    :param terminal:            See 'spawn_new_terminal()'.
+
+    :param zygote:              See 'spawn_new_terminal()'.
+
+    :param capture:             See 'spawn_new_terminal()'.
+
+    :param payload:             See 'spawn_new_terminal()'.
+
+    :param verbose:             See 'spawn_new_terminal()'.
+
+    :param tab:                 See 'spawn_new_terminal()'.
+
+    :param fast_start:          See 'spawn_new_terminal()'.
+
+    :param engine:              See 'spawn_new_terminal()'.
+
+    :param backend:             Only 'terminal' is supported here. $TERMINAL_SPAWNER_BACKEND is
+                                ignored.
+    '''
+    trace = get_spawn_trace(kwargs.pop('verbose', False))
+    if isinstance(script_or_exe_path, LaunchPlan):
+        plan = script_or_exe_path
+        plan_kwargs = [name for name in launch_plan_kwargs if name in kwargs]
+        if plan_kwargs:
+            raise TypeError(f'Pass {", ".join(plan_kwargs)} to create_launch_plan() instead')
+    else:
+        kwargs.setdefault('backend', 'terminal')
+        plan = create_launch_plan(
+            script_or_exe_path,
+            trace = trace,
+            **{name: kwargs.pop(name) for name in launch_plan_kwargs if name in kwargs},
+        )
+    if plan.backend != 'terminal':
+        raise ValueError(
+            f'Backend {q}{plan.backend}{q} is not supported by async_spawn_new_terminal()'
+        )
+    handshake:bool = kwargs.pop('handshake', False)
+    program, program_argv = plan.program, [*plan.arguments, *argv]
+    output = __create_output_stream(kwargs.pop('capture', None))
+    if output is not None:
+        program, program_argv = __get_capture_command(output, program, program_argv)
+    payload, owned = __create_payload(kwargs.pop('payload', None))
+    if payload is not None:
+        kwargs['env'] = payload.get_env(kwargs.get('env'))
+    ready_listener = ReadinessListener() if handshake else None
+    if ready_listener is not None:
+        kwargs['env'] = ready_listener.get_env(kwargs.get('env'))
+    engine = kwargs.pop('engine', None)
+    env = kwargs.pop('env', None)
+    if platform.system().lower() == 'windows':
+        engine = 'popen'
+        arguments = [program, *program_argv]
+        kwargs['creationflags'] = kwargs.get('creationflags', 0) | subprocess.CREATE_NEW_CONSOLE
+    else:
+        engine = __get_engine(engine, kwargs)
+        assert plan.profile is not None and plan.terminal_path is not None
+        arguments = plan.profile.get_arguments(plan.terminal_path, program, program_argv, plan.tab)
+    trace.event(
+        'command', level='debug', arguments=arguments, options=sorted(kwargs), engine=engine,
+    )
+    spawn_time = time.monotonic()
+    try:
+        with trace.span('popen', engine=engine):
+            process = __launch(engine, arguments, env, kwargs)
+    except BaseException:
+        if ready_listener is not None:
+            ready_listener.close()
+        if output is not None:
+            output.close()
+        if owned:
+            payload.close()
+        raise
+    return AsyncSpawnHandle(
+        process, spawn_time, ready_listener, output, payload if owned else None, trace
+    )
+
+class AsyncSpawnHandle:
+    '''
+    Awaitable handle to a child process spawned by 'async_spawn_new_terminal()'. Awaiting the handle
+    is the same as awaiting 'handle.wait()'. If the task waiting on the child gets cancelled, the
+    child is terminated too (unless 'terminate_on_cancel' is set to False). On Linux, the process
+    that gets terminated is the terminal emulator, which takes the child down with it. Create it
+    from within the event loop: the supervisor resolves the exit in there.
+    '''
+    def __init__(self,
+                 process:Union[subprocess.Popen, SpawnedProcess],
+                 spawn_time:float,
+                 ready_listener:Optional[ReadinessListener] = None,
+                 output:Optional[OutputStream] = None,
+                 owned_payload:Optional[Payload] = None,
+                 trace:Optional[SpawnTrace] = None,
+                 ) -> None:
+        self.process = process
+        self.output = output
+        self.trace = trace if trace is not None else get_spawn_trace()
+        self.spawn_id:int = self.trace.spawn_id
+        self.__exit_traced:bool = False
+        self.__owned_payload = owned_payload
+        self.pid:int = process.pid
+        self.spawn_time = spawn_time
+        self.ready_time:Optional[float] = None
+        self.terminate_on_cancel:bool = True
+        self.__handshake:bool = ready_listener is not None
+        self.__ready_listener = ready_listener
+        self.__result:Optional[ExitResult] = None
+        if output is not None:
+            output._start(lambda: process.returncode is None)
+        # The supervisor reaps the child, and hands the result over to the event loop
+        import asyncio
+        self.__loop = asyncio.get_running_loop()
+        self.__exit_future:asyncio.Future = self.__loop.create_future()
+        get_supervisor().watch(self.pid, self.__on_exit, process)
+        return
+
+    def __await__(self) -> Generator[Any, None, int]:
+        return self.wait().__await__()
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self.process.returncode
+
+    async def wait(self, timeout:Optional[float] = None) -> int:
+        '''
+        Wait for the child process to complete and return its 'returncode'. Raise TimeoutError if
+        the timeout expires first. A timeout leaves the child running.
+        '''
+        import asyncio
+        try:
+            # Shielded: a timeout or cancellation must not cancel the exit future itself
+            result = await asyncio.wait_for(asyncio.shield(self.__exit_future), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f'Child {self.pid} still running after {timeout} s') from None
+        except asyncio.CancelledError:
+            if self.terminate_on_cancel:
+                self.terminate()
+            raise
+        self.__finish(result)
+        return result.returncode
+
+    def result(self) -> Optional[ExitResult]:
+        '''
+        Return the ExitResult of the child process: the 'returncode' along with the resources it
+        used. None if it's still running.
+        '''
+        return self.__result
+
+    async def wait_ready(self, timeout:Optional[float] = None) -> bool:
+        '''
+        Wait for the child to call 'notify_ready()'. Return True if it did, False if the timeout
+        expired or the child exited first.
+        '''
+        if self.ready_time is not None:
+            return True
+        if not self.__handshake:
+            raise RuntimeError('Child was not spawned with handshake=True')
+        if self.__ready_listener is None:
+            return False
+        if not await self.__ready_listener.wait_async(timeout, lambda: self.process.returncode is None):
+            return False
+        self.ready_time = time.monotonic()
+        self.trace.event('first_ready', duration=self.ready_latency)
+        self.__close_ready_listener()
+        return True
+
+    @property
+    def ready_latency(self) -> Optional[float]:
+        '''
+        Seconds between the spawn and the moment the child was seen to be ready.
+        '''
+        if self.ready_time is None:
+            return None
+        return self.ready_time - self.spawn_time
+
+    def terminate(self) -> None:
+        '''
+        Ask the child process to terminate, without waiting for it.
+        '''
+        try:
+            self.process.terminate()
+        except ProcessLookupError:
+            pass
+        return
+
+    async def cancel(self, grace_period:float = 5.0) -> int:
+        '''
+        Terminate the child process and return its 'returncode'. If it didn't stop after the grace
+        period, kill it.
+        '''
+        import asyncio
+        self.terminate()
+        try:
+            result = await asyncio.wait_for(asyncio.shield(self.__exit_future), grace_period)
+        except asyncio.TimeoutError:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+            result = await asyncio.shield(self.__exit_future)
+        self.__finish(result)
+        return result.returncode
+
+    def __on_exit(self, result:ExitResult) -> None:
+        '''
+        Invoked by the supervisor once the child is reaped. Resolves the exit future in the event
+        loop.
+        '''
+        result = result._replace(wall_time=time.monotonic() - self.spawn_time)
+        try:
+            self.__loop.call_soon_threadsafe(self.__set_result, result)
+        except RuntimeError:
+            # The event loop is closed already: nobody is waiting anymore
+            pass
+        return
+
+    def __set_result(self, result:ExitResult) -> None:
+        if not self.__exit_future.done():
+            self.__result = result
+            self.__exit_future.set_result(result)
+        return
+
+    def __finish(self, result:ExitResult) -> None:
+        '''
+        Trace the exit, and release what the handle owns. Only the first call does anything.
+        '''
+        if not self.__exit_traced:
+            self.__exit_traced = True
+            self.trace.event('exit', duration=result.wall_time, **result._asdict())
+        self.__close_ready_listener()
+        if self.__owned_payload is not None:
+            self.__owned_payload.close()
+            self.__owned_payload = None
+        return
+
+    def __close_ready_listener(self) -> None:
+        if self.__ready_listener is not None:
+            self.__ready_listener.close()
+            self.__ready_listener = None
+        return
+
+
+#^                                          PAGE CACHE                                            ^#
+#% ============================================================================================== %#
+#% Benchmarks need to measure cold starts, with the files of the child not in the page cache.     %#
+#%                                                                                                %#
+def evict_page_cache(paths:Iterable[str], drop_all:bool = False) -> str:
+    '''
+    Get the given files (and all files in the given folders) out of the page cache. Return the
+    method that was used:
+      - 'drop_caches': The whole page cache was dropped (requires root, Linux only).
+      - 'fadvise':     The kernel was advised to drop the pages of each file (POSIX).
+      - 'none':        Not possible on this system.
+
+    The whole page cache is only dropped with 'drop_all'. That slows down everything else running
+    on the system for a while, so it's never done by default.
+    '''
+    #& Drop the whole page cache
+    if drop_all and platform.system().lower() == 'linux':
+        try:
+            os.sync()
+            with open('/proc/sys/vm/drop_caches', 'w') as f:
+                f.write('1\n')
+            return 'drop_caches'
+        except OSError:
+            pass
+
+    #& Drop file by file
+    if not hasattr(os, 'posix_fadvise'):
+        return 'none'
+    def evict_file(filepath:str) -> None:
+        try:
+            fd = os.open(filepath, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fdatasync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+        return
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                for filename in filenames:
+                    evict_file(os.path.join(dirpath, filename))
+                continue
+        else:
+            evict_file(path)
+        continue
+    return 'fadvise'
+
+
+#^                                       STARTUP MEASUREMENT                                      ^#
+#% ============================================================================================== %#
+#%                                                                                                %#
+#%                                                                                                %#
+def measure_startup(arguments:List[str],
+                    timeout:float = 60.0,
+                    env:Optional[Mapping[str, str]] = None,
+                    ) -> Optional[float]:
+    '''
+    Launch the given command directly (without a terminal) and return the seconds until it calls
+    'notify_ready()'. Return None if it didn't within the timeout, or exited first. The process is
+    terminated afterwards if it's still running.
+
+    :param arguments: The program and its arguments.
+    :param timeout:   Seconds to wait for the program to signal it's ready.
+    :param env:       Environment for the program. Default: 'os.environ'.
+    '''
+    ready_listener = ReadinessListener()
+    try:
+        start_time = time.monotonic()
+        p = subprocess.Popen(
+            arguments,
+            env    = ready_listener.get_env(env),
+            stdout = subprocess.DEVNULL,
+            stderr = subprocess.DEVNULL,
+        )
+        ok = ready_listener.wait(timeout, lambda: p.poll() is None)
+        latency = time.monotonic() - start_time if ok else None
+    finally:
+        ready_listener.close()
+    if p.poll() is None:
+        p.terminate()
+        try:
+            p.wait(5.0)
+        except subprocess.TimeoutExpired:
+            p.kill()
+            p.wait()
+    return latency
+
+
+#^                                           FAST START                                           ^#
+#% ============================================================================================== %#
+#% With 'fast_start=True', a python script child skips most of what a plain interpreter does at   %#
+#% startup. The script is precompiled into the cache folder (the interpreter never caches the     %#
+#% bytecode of the main script itself), and so is the 'functions.py' next to it. A tiny loader    %#
+#% runs the bytecode, with interpreter flags that are safe for this machine (see                  %#
+#% '__get_fast_start_flags()'). When frozen, the real interpreter behind the one on the PATH is   %#
+#% looked up once and cached.                                                                     %#
+#%                                                                                                %#
+#% 'get_fast_start_report()' measures what it gains.                                              %#
+#%                                                                                                %#
+# The loader only needs modules that are loaded at startup anyway. Arguments: the bytecode file,
+# the script, then the arguments for the script. The bytecode is only used if it matches the
+# script's modification time and size, else the loader falls back to compiling the script.
+__fast_start_loader_source = '''
+import sys, os, marshal, _frozen_importlib_external
+cfile, source = sys.argv[1], sys.argv[2]
+code = None
+try:
+    stat = os.stat(source)
+    with open(cfile, 'rb') as f:
+        header = f.read(16)
+        if (header[:4] == _frozen_importlib_external.MAGIC_NUMBER
+                and int.from_bytes(header[4:8], 'little') == 0
+                and int.from_bytes(header[8:12], 'little') == int(stat.st_mtime) & 0xFFFFFFFF
+                and int.from_bytes(header[12:16], 'little') == stat.st_size & 0xFFFFFFFF):
+            code = marshal.load(f)
+except (OSError, EOFError, ValueError):
+    pass
+if code is None:
+    with open(source, 'rb') as f:
+        code = compile(f.read(), source, 'exec')
+sys.argv = [source, *sys.argv[3:]]
+if sys.path and sys.path[0] == '':
+    sys.path[0] = os.path.dirname(source)
+else:
+    sys.path.insert(0, os.path.dirname(source))
+main = type(sys)('__main__')
+main.__file__ = source
+main.__cached__ = None
+main.__builtins__ = __builtins__
+sys.modules['__main__'] = main
+exec(code, main.__dict__)
+'''
+
+def get_fast_start_bytecode_filepath(script_path:str) -> str:
+    '''
+    Return the path to the precompiled bytecode of the given script, in the cache folder.
+    '''
+    import hashlib
+    script_path = os.path.abspath(script_path).replace('\\', '/')
+    digest = hashlib.sha256(script_path.encode('utf-8')).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(script_path))[0]
+    return f'{get_cache_folderpath()}/bytecode/{name}-{digest}.pyc'
+
+def __get_fast_start_command(script_path:str) -> Tuple[str, List[str]]:
+    '''
+    Return the program and arguments that run the given python script with the fast-start profile.
+    '''
+    script_path = os.path.abspath(script_path).replace('\\', '/')
+    cfile = get_fast_start_bytecode_filepath(script_path)
+    interpreter = __get_interpreter_info()
+    # Bytecode from this interpreter is useless to one of another version
+    if interpreter['version'] == list(sys.version_info[:2]):
+        import importlib.util
+        __compile_if_stale(script_path, cfile)
+        functions_path = os.path.join(os.path.dirname(script_path), 'functions.py')
+        if os.path.isfile(functions_path):
+            __compile_if_stale(functions_path, importlib.util.cache_from_source(functions_path))
+    return interpreter['executable'], [
+        *__get_fast_start_flags(interpreter),
+        '-c',
+        __fast_start_loader_source,
+        cfile,
+        script_path,
+    ]
+
+def __get_fast_start_flags(interpreter:Dict[str, Any]) -> List[str]:
+    '''
+    Return the interpreter flags for a fast start. Each flag is only used if it can't change the
+    behavior of the child:
+        - '-E' (ignore $PYTHON* variables) if none of them is set anyway.
+        - '-s' (no user site-packages) if there is no user site-packages folder anyway.
+        - Both together become '-I' (isolated mode).
+        - '-X frozen_modules=on' on python 3.11 and newer, to load the core of the standard
+          library from the interpreter itself.
+    '''
+    flags:List[str] = []
+    ignore_env = not any(name.startswith('PYTHON') for name in os.environ)
+    user_site = interpreter['user_site']
+    no_user_site = interpreter['version'] is not None and (
+        user_site is None or not os.path.isdir(user_site)
+    )
+    if ignore_env and no_user_site:
+        flags.append('-I')
+    elif ignore_env:
+        flags.append('-E')
+    elif no_user_site:
+        flags.append('-s')
+    if interpreter['version'] is not None and interpreter['version'] >= [3, 11]:
+        flags += ['-X', 'frozen_modules=on']
+    return flags
+
+def __get_interpreter_info() -> Dict[str, Any]:
+    '''
+    Return the real path of the python interpreter, its version and its user site-packages folder
+    (None if disabled). When frozen, the interpreter found on the PATH is asked once, and the
+    answer goes through the discovery cache. That also resolves wrappers like pyenv shims.
+    '''
+    if not getattr(sys, 'frozen', False):
+        import site
+        return {
+            'executable' : get_python_executable(),
+            'version'    : list(sys.version_info[:2]),
+            'user_site'  : site.getusersitepackages() if site.ENABLE_USER_SITE else None,
+        }
+    return __discover('python_interpreter_info', __query_interpreter_info)
+
+def __query_interpreter_info() -> Dict[str, Any]:
+    '''
+    Ask the python interpreter on the PATH about itself. If that fails, only its path is known.
+    '''
+    interpreter_path = get_python_executable()
+    query = str(
+        'import sys, site, json; print(json.dumps({'
+        '"executable": sys.executable, '
+        '"version": list(sys.version_info[:2]), '
+        '"user_site": site.getusersitepackages() if site.ENABLE_USER_SITE else None}))'
+    )
+    try:
+        text = subprocess.run(
+            [interpreter_path, '-c', query],
+            stdout  = subprocess.PIPE,
+            stderr  = subprocess.DEVNULL,
+            timeout = 30.0,
+            check   = True,
+        ).stdout
+        info = json.loads(text)
+        info['executable'] = info['executable'].replace('\\', '/')
+        return info
+    except (OSError, subprocess.SubprocessError, ValueError, KeyError):
+        return {'executable': interpreter_path, 'version': None, 'user_site': None}
+
+def __compile_if_stale(source:str, cfile:str) -> None:
+    '''
+    Compile the python source into the given bytecode file, unless that one is up to date already.
+    The header is the standard one, based on the modification time and size of the source.
+    '''
+    import py_compile, importlib.util
+    try:
+        stat = os.stat(source)
+        with open(cfile, 'rb') as f:
+            header = f.read(16)
+        if header == b''.join((
+            importlib.util.MAGIC_NUMBER,
+            (0).to_bytes(4, 'little'),
+            (int(stat.st_mtime) & 0xFFFFFFFF).to_bytes(4, 'little'),
+            (stat.st_size & 0xFFFFFFFF).to_bytes(4, 'little'),
+        )):
+            return
+    except OSError:
+        pass
+    try:
+        py_compile.compile(
+            source,
+            cfile,
+            doraise           = True,
+            invalidation_mode = py_compile.PycInvalidationMode.TIMESTAMP,
+        )
+    except (OSError, py_compile.PyCompileError):
+        # Read-only folder or a syntax error. The child compiles the source itself, and reports
+        # the syntax error if there is one.
+        pass
+    return
+
+def get_fast_start_report(script_path:str,
+                          argv:Optional[List[str]] = None,
+                          runs:int = 5,
+                          timeout:float = 60.0,
+                          env:Optional[Mapping[str, str]] = None,
+                          ) -> Dict[str, Any]:
+    '''
+    Measure the startup of the given python script (until it calls 'notify_ready()') with the
+    default command and with the fast-start profile, alternating between both. Print the gain, and
+    return it as a json-serializable dictionary with all samples.
+    '''
+    import statistics
+    argv = argv or []
+    fast_program, fast_arguments = __get_fast_start_command(script_path)
+    commands = {
+        'default'    : [get_python_executable(), script_path, *argv],
+        'fast_start' : [fast_program, *fast_arguments, *argv],
+    }
+    samples:Dict[str, List[float]] = {'default': [], 'fast_start': []}
+    failures = 0
+    for _ in range(runs):
+        for name, command in commands.items():
+            latency = measure_startup(command, timeout, env)
+            if latency is None:
+                failures += 1
+            else:
+                samples[name].append(latency)
+            continue
+        continue
+    default_median = statistics.median(samples['default']) if samples['default'] else None
+    fast_median = statistics.median(samples['fast_start']) if samples['fast_start'] else None
+    gain:Optional[float] = None
+    if default_median is not None and fast_median is not None:
+        gain = default_median - fast_median
+    report = {
+        'target'            : script_path,
+        'fast_start_flags'  : fast_arguments[:fast_arguments.index('-c')],
+        'runs'              : runs,
+        'failures'          : failures,
+        'default'           : samples['default'],
+        'fast_start'        : samples['fast_start'],
+        'default_median'    : default_median,
+        'fast_start_median' : fast_median,
+        'gain'              : gain,
+    }
+    def show(value:Optional[float]) -> str:
+        return 'failed' if value is None else f'{value * 1000:.1f} ms'
+    print(
+        f'\n'
+        f'FAST START REPORT: {script_path}\n'
+        f'    flags:           {" ".join(report["fast_start_flags"]) or "(none)"}\n'
+        f'    default:         {show(default_median)} (median of {len(samples["default"])})\n'
+        f'    fast start:      {show(fast_median)} (median of {len(samples["fast_start"])})\n'
+        f'    gain:            {show(gain)}'
+        f'{"" if gain is None or not default_median else f" ({gain / default_median:.0%})"}\n'
+    )
+    return report
+
+
+#^                                        DISCOVERY CACHE                                         ^#
+#% ============================================================================================== %#
+#% Looking up the terminal emulator (and the python interpreter when frozen) requires a scan of   %#
+#% the PATH. The results are cached in memory and on disk. The cache is keyed on the PATH itself  %#
+#% and on the modification times of the PATH directories, so it invalidates itself whenever a     %#
+#% program gets installed or removed, or the PATH changes.                                        %#
+#%                                                                                                %#
+__discovery_lock = threading.Lock()
+__discovery_cache:Dict[str, Any] = {
+    'key'     : None,
+    'entries' : {},
+}
+__discovery_cache_loaded:bool = False
+
+def get_cache_folderpath() -> str:
+    '''
+    Return the folder where 'terminal_spawner' keeps its caches, for example:
+      - 'C:/Users/krist/AppData/Local/terminal_spawner'
+      - '/home/krist/.cache/terminal_spawner'
+    '''
+    if platform.system().lower() == 'windows':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~/AppData/Local')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return f'{base}/terminal_spawner'.replace('\\', '/')
+
+def get_discovery_cache_filepath() -> str:
+    '''
+    Return the path to the on-disk discovery cache.
+    '''
+    return f'{get_cache_folderpath()}/discovery.json'
+
+def refresh_discovery_cache() -> None:
+    '''
+    Throw away all cached lookups, both in memory and on disk. The next lookup scans the PATH again.
+    '''
+    global __discovery_cache_loaded
+    with __discovery_lock:
+        __discovery_cache['key'] = None
+        __discovery_cache['entries'] = {}
+        __discovery_cache_loaded = True
+        try:
+            os.remove(get_discovery_cache_filepath())
+        except OSError:
+            pass
+    return
+
+def __get_discovery_key() -> List[Any]:
+    '''
+    Compute the key for the discovery cache: the PATH, followed by the modification time of each
+    directory in it (None if the directory doesn't exist).
+    '''
+    path = os.environ.get('PATH', '')
+    key:List[Any] = [path]
+    for d in path.split(os.pathsep):
+        try:
+            key.append(os.stat(d).st_mtime_ns)
+        except OSError:
+            key.append(None)
+        continue
+    return key
+
+def __discover(name:str, finder:Callable[[], Any]) -> Any:
+    '''
+    Return the cached result for the lookup 'name'. If the cache is stale or has no entry for it,
+    invoke the 'finder()' and store its (json-serializable) result. The finder runs outside the
+    lock: it can take a while, and it can do lookups of its own.
+    '''
+    global __discovery_cache_loaded
+    key = __get_discovery_key()
+    with __discovery_lock:
+        #& Load from disk (only once per process)
+        if not __discovery_cache_loaded:
+            __discovery_cache_loaded = True
+            try:
+                with open(get_discovery_cache_filepath(), 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                __discovery_cache['key'] = data['key']
+                __discovery_cache['entries'] = dict(data['entries'])
+            except Exception:
+                # Missing or corrupt cache file. Start from scratch.
+                pass
+
+        #& Lookup
+        if __discovery_cache['key'] != key:
+            __discovery_cache['key'] = key
+            __discovery_cache['entries'] = {}
+        if name in __discovery_cache['entries']:
+            return __discovery_cache['entries'][name]
+
+    #& Miss
+    # Two threads can miss at the same time. Both find the same result, so the last one just wins.
+    result = finder()
+    with __discovery_lock:
+        if __discovery_cache['key'] == key:
+            __discovery_cache['entries'][name] = result
+            __store_discovery_cache()
+    return result
+
+def __store_discovery_cache() -> None:
+    '''
+    Write the discovery cache to disk. Write to a temporary file first and then move it in place,
+    such that other processes never read a half-written file.
+    '''
+    filepath = get_discovery_cache_filepath()
+    temp_filepath = f'{filepath}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(temp_filepath, 'w', encoding='utf-8') as f:
+            json.dump(__discovery_cache, f)
+        os.replace(temp_filepath, filepath)
+    except OSError:
+        # The cache is an optimization. Failing to store it is not an error.
+        try:
+            os.remove(temp_filepath)
+        except OSError:
+            pass
+    return
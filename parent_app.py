@@ -6,14 +6,26 @@ Copyright 2018-2023 Johan Cockx, Matic Kukovec and Kristof Mulier.
 # This is a simply PyQt6 application that creates a window with a button.
 from __future__ import annotations
 from typing import *
-import sys, os, inspect, platform, argparse, functions
+import sys, os, inspect, platform, argparse, json, functions
+# Spawn engine for the children, see 'functions.spawn_new_terminal()'. None leaves the choice to
+# $TERMINAL_SPAWNER_ENGINE. When run as the main app on Linux, start the forkserver while this
+# process is still small: before PyQt6 gets imported (see 'functions.start_forkserver()').
+spawn_engine: Optional[str] = None
+if __name__ == '__main__' and platform.system().lower() == 'linux':
+    if os.environ.get(functions.engine_env_var) in (None, '', 'forkserver'):
+        functions.start_forkserver()
+        spawn_engine = 'forkserver'
 from PyQt6.QtWidgets import *
 from PyQt6.QtCore import *
 from PyQt6.QtGui import *
 q = "'"
 foo_value: bool = False
 bar_value: Optional[str] = None
+exit_after_paint: bool = False
+verbose: bool = False
 args_valid: bool = True
+child_watchers: Set[ChildWatcher] = set()
+payload: Optional[functions.Payload] = None
 
 def get_script_filepath() -> str:
     '''
@@ -84,6 +96,16 @@ def print_info() -> None:
         print(f'{k} {v}')
     return
 
+def get_payload() -> functions.Payload:
+    '''
+    Return the payload handed to every child app: the info of this app, as JSON. It's created once
+    and shared by all children - each of them maps the same memory.
+    '''
+    global payload
+    if payload is None:
+        payload = functions.Payload(json.dumps(get_info()).encode('utf-8'))
+    return payload
+
 def spawn_child_app_python(pass_args:bool,
                            wait_after_spawn:bool,
                            quit_after_spawn:bool,
@@ -92,7 +114,8 @@ def spawn_child_app_python(pass_args:bool,
     Spawn the child application as a python script.
 
     :param pass_args:        Pass the own 'foo' and 'bar' args to the child app.
-    :param wait_after_spawn: Wait after spawning the child app (run the 'wait_func()').
+    :param wait_after_spawn: Wait after spawning the child app. The wait happens in the background:
+                             the returncode is printed once the child app exits.
     :param quit_after_spawn: Quit after spawning the child app.
     '''
     print(quit_after_spawn)
@@ -104,9 +127,14 @@ def spawn_child_app_python(pass_args:bool,
     wait_func = functions.spawn_new_terminal(
         script_or_exe_path = f'{get_terminal_spawner_folderpath()}/child_app.py',
         argv = sys.argv[1:] if pass_args else [],
+        payload = get_payload(),
+        engine = spawn_engine,
+        verbose = verbose,
     )
     if wait_after_spawn:
-        wait_func()
+        # Don't block the GUI thread. Quit (if requested) once the child has exited.
+        watch_child(wait_func, quit_after_spawn)
+        return
     if quit_after_spawn:
         sys.exit(0)
     return
@@ -119,7 +147,8 @@ def spawn_child_app_exe(pass_args:bool,
     Spawn the child application as an executable.
 
     :param pass_args:        Pass the own 'foo' and 'bar' args to the child app.
-    :param wait_after_spawn: Wait after spawning the child app (run the 'wait_func()').
+    :param wait_after_spawn: Wait after spawning the child app. The wait happens in the background:
+                             the returncode is printed once the child app exits.
     :param quit_after_spawn: Quit after spawning the child app.
     '''
     print(quit_after_spawn)
@@ -128,23 +157,107 @@ def spawn_child_app_exe(pass_args:bool,
     print(f'Pass args to child: {pass_args}')
     print(f'Wait after spawn:   {wait_after_spawn}')
     print(f'Quit after spawn:   {quit_after_spawn}')
-    executable_path = f'{get_terminal_spawner_folderpath()}/frozen_child_app/child_app'
-    if platform.system().lower() == 'windows':
-        executable_path += '.exe'
     wait_func = functions.spawn_new_terminal(
-        script_or_exe_path = executable_path,
+        script_or_exe_path = get_child_app_executable_path(),
         argv = sys.argv[1:] if pass_args else [],
+        payload = get_payload(),
+        engine = spawn_engine,
+        verbose = verbose,
     )
     if wait_after_spawn:
-        wait_func()
+        # Don't block the GUI thread. Quit (if requested) once the child has exited.
+        watch_child(wait_func, quit_after_spawn)
+        return
     if quit_after_spawn:
         sys.exit(0)
     return
 
+def get_child_app_executable_path() -> str:
+    '''
+    Return the path to the child app executable. Look for it in this order:
+        1. Next to the running executable, if the parent app is frozen into a shared tree (see
+           'build.py --shared'). Then both apps share the Python runtime and the Qt libraries.
+        2. In the shared tree 'frozen_apps/'.
+        3. In the separate tree 'frozen_child_app/'.
+    If none exists, return the last one.
+    '''
+    executable_name = 'child_app.exe' if platform.system().lower() == 'windows' else 'child_app'
+    candidates = [
+        f'{get_terminal_spawner_folderpath()}/frozen_apps/{executable_name}',
+        f'{get_terminal_spawner_folderpath()}/frozen_child_app/{executable_name}',
+    ]
+    if is_frozen():
+        candidates.insert(0, f'{os.path.dirname(get_script_filepath())}/{executable_name}')
+    for executable_path in candidates:
+        if os.path.isfile(executable_path):
+            return executable_path
+        continue
+    return candidates[-1]
+
+def watch_child(handle:functions.SpawnHandle, quit_after_exit:bool) -> None:
+    '''
+    Wait for the child app without freezing the GUI. Print its returncode and resource usage when it
+    exits.
+
+    :param handle:          The handle returned by 'functions.spawn_new_terminal()'.
+    :param quit_after_exit: Quit the parent app once the child app exited.
+    '''
+    watcher = ChildWatcher(handle)
+    child_watchers.add(watcher)
+    def on_finished(returncode:int) -> None:
+        print(f'Child app (pid {handle.pid}) exited with returncode {returncode}')
+        result = handle.result()
+        if result.user_time is not None:
+            print(
+                f'    wall time: {result.wall_time:.3f} s, '
+                f'cpu time: {result.user_time:.3f} s user + {result.system_time:.3f} s system, '
+                f'max RSS: {result.max_rss / (1024 * 1024):.1f} MiB'
+            )
+        child_watchers.discard(watcher)
+        watcher.deleteLater()
+        if quit_after_exit:
+            QApplication.quit()
+        return
+    # Connect first: a child that exited already gets reported from 'start()' right away
+    watcher.finished.connect(on_finished)
+    watcher.start()
+    return
+
+class ChildWatcher(QObject):
+    '''
+    Watch a spawned child process from the Qt event loop. Connect to the 'finished' signal, then
+    call 'start()'. The signal is emitted with the 'returncode' once the child exits.
+
+    The handle's done-callback emits the signal, once the supervisor knows the 'returncode'. The GUI
+    thread never waits for it: the signal is delivered through a queued connection.
+    '''
+    finished = pyqtSignal(int)
+
+    def __init__(self, handle:functions.SpawnHandle, parent:Optional[QObject] = None) -> None:
+        super().__init__(parent)
+        self.handle = handle
+        return
+
+    def start(self) -> None:
+        '''
+        Start watching. If the child exited already, 'finished' is emitted right away.
+        '''
+        self.handle.add_done_callback(self.__on_exit)
+        return
+
+    def __on_exit(self, handle:functions.SpawnHandle) -> None:
+        '''
+        Invoked by the handle (usually from the supervisor thread) once the child exited.
+        '''
+        assert handle.returncode is not None
+        self.finished.emit(handle.returncode)
+        return
+
 # Main application class
 class MainWindow(QMainWindow):
     def __init__(self) -> None:
         super().__init__()
+        self.__painted: bool = False
 
         # Set the main window size
         self.setMinimumSize(QSize(1000, 300))
@@ -279,6 +392,23 @@ class MainWindow(QMainWindow):
         self.adjustSize()
         return
 
+    def paintEvent(self, event:QPaintEvent) -> None:
+        '''
+        On the first paint, tell whoever launched us that we're up. This does nothing if they
+        didn't ask for a readiness handshake.
+        '''
+        super().paintEvent(event)
+        if not self.__painted:
+            self.__painted = True
+            QTimer.singleShot(0, self.__on_first_paint)
+        return
+
+    def __on_first_paint(self) -> None:
+        functions.notify_ready()
+        if exit_after_paint:
+            QApplication.quit()
+        return
+
 def main() -> int:
     '''
     Main entry point.
@@ -304,10 +434,22 @@ if __name__ == '__main__':
         type = str,
         help = 'A string argument'
     )
+    parser.add_argument(
+        '--exit-after-paint',
+        action = 'store_true',
+        help   = 'Quit as soon as the window got painted. Used to measure the startup time.'
+    )
+    parser.add_argument(
+        '--verbose',
+        action = 'store_true',
+        help   = 'Print the trace of each spawn.'
+    )
     try:
         args = parser.parse_args()
         foo_value = args.foo
         bar_value = args.bar
+        exit_after_paint = args.exit_after_paint
+        verbose = args.verbose
     except:
         args_valid = False
 
@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018-2023 Johan Cockx, Matic Kukovec and Kristof Mulier.
+"""
+# SUMMARY:
+# Micro-benchmark for the spawn layer in 'functions.py' itself, without any real terminal emulator
+# or GUI involved. A stub is put on the PATH for every emulator in 'functions.terminal_profiles'.
+# The stub drops the emulator's own arguments (eg. '--wait' and '--' for 'gnome-terminal') and
+# execs the command it was given, so the child replaces the stub right away.
+#
+# It measures every combination of stub emulator and target kind:
+#   - 'python':  a python script (by its extension)
+#   - 'shell':   a shell script (by its extension)
+#   - 'shebang': a script without extension (classified by its shebang)
+#   - 'binary':  an ELF executable (classified by its magic)
+# For each combination, it reports:
+#   - the latency of the 'spawn_new_terminal()' call itself, and the spawns per second that gives
+#   - the latency per phase ('classify', 'emulator_lookup', 'popen', ...), from the trace
+#   - the memory that each spawn leaves behind, and the peak, with 'tracemalloc'
+#
+#     $ python spawn_benchmark.py [--runs N] [--terminal xterm ...] [--kind python shell ...]
+#                                 [--engine popen|posix_spawn|forkserver] [--ballast MiB]
+#                                 [--output results.json] [--save-baseline baseline.json]
+#                                 [--baseline baseline.json] [--threshold 0.25]
+#
+# With '--ballast', the benchmark makes itself bigger first, to see how the spawn engine copes
+# with a parent like the Parent App, which has PyQt6 loaded.
+# With '--baseline', the results are compared with the ones stored earlier with '--save-baseline'.
+# Every metric that got worse by more than the threshold is reported, and the exit code is 1.
+from __future__ import annotations
+from typing import *
+import sys, os, platform, argparse, json, time, gc, shutil, subprocess, tempfile, contextlib
+import tracemalloc
+import functions
+from benchmark import summarize
+q = "'"
+
+target_kinds = ('python', 'shell', 'shebang', 'binary', )
+
+# Regressions smaller than this are noise, whatever the threshold: seconds for the latencies,
+# bytes for the memory
+latency_slack:float = 50e-6
+memory_slack:int = 512
+
+def get_stub_terminal_source(profile:functions.TerminalProfile) -> str:
+    '''
+    Return the source of the stub for the given emulator. It skips all arguments up to and
+    including the 'command_flag', then execs the command.
+    '''
+    command = 'exec sh -c "$1"' if profile.join_command else 'exec "$@"'
+    return str(
+        f'#!/bin/sh\n'
+        f'# Stub for {q}{profile.name}{q}, see {q}spawn_benchmark.py{q}\n'
+        f'while [ $# -gt 0 ] && [ "$1" != {q}{profile.command_flag}{q} ]; do shift; done\n'
+        f'shift\n'
+        f'{command}\n'
+    )
+
+def create_stub_terminals(folderpath:str) -> List[str]:
+    '''
+    Write a stub for every emulator from 'functions.terminal_profiles' into the given folder.
+    Return their names.
+    '''
+    for name, profile in functions.terminal_profiles.items():
+        filepath = f'{folderpath}/{name}'
+        with open(filepath, 'w', encoding='utf-8') as f:
+            f.write(get_stub_terminal_source(profile))
+        os.chmod(filepath, 0o755)
+        continue
+    return list(functions.terminal_profiles)
+
+def create_targets(folderpath:str) -> Dict[str, str]:
+    '''
+    Write a child of every kind from 'target_kinds' that exits right away. Return their paths.
+    '''
+    sources = {
+        'python'  : ('child.py', 'import sys\nsys.exit(0)\n'),
+        'shell'   : ('child.sh', '#!/bin/sh\nexit 0\n'),
+        'shebang' : ('child', '#!/bin/sh\nexit 0\n'),
+    }
+    targets:Dict[str, str] = {}
+    for kind, (filename, source) in sources.items():
+        filepath = f'{folderpath}/{filename}'
+        with open(filepath, 'w', encoding='utf-8') as f:
+            f.write(source)
+        os.chmod(filepath, 0o755)
+        targets[kind] = filepath
+        continue
+    binary_path = shutil.which('true')
+    assert binary_path is not None
+    targets['binary'] = binary_path
+    return targets
+
+def spawn_and_wait(target:str, terminal:str, timeout:float) -> Tuple[float, functions.SpawnHandle]:
+    '''
+    Spawn the target once in the given (stub) emulator and wait for it. Return the seconds spent
+    in 'spawn_new_terminal()' and the handle.
+    '''
+    start = time.perf_counter()
+    handle = functions.spawn_new_terminal(target, [], terminal=terminal, backend='terminal')
+    latency = time.perf_counter() - start
+    try:
+        handle.wait(timeout)
+    except subprocess.TimeoutExpired:
+        handle.process.kill()
+        handle.wait()
+    return latency, handle
+
+def measure_latency(target:str,
+                    terminal:str,
+                    runs:int,
+                    timeout:float,
+                    sink:functions.MemorySink,
+                    ) -> Dict[str, Any]:
+    '''
+    Spawn the target 'runs' times, one after the other. Return the latency of the calls, the
+    spawns per second and the latency per phase.
+    '''
+    # Warm-up run, not measured. It fills the discovery and classification caches.
+    spawn_and_wait(target, terminal, timeout)
+    sink.clear()
+    calls:List[float] = []
+    failures = 0
+    start = time.perf_counter()
+    for _ in range(runs):
+        latency, handle = spawn_and_wait(target, terminal, timeout)
+        calls.append(latency)
+        if handle.returncode != 0:
+            failures += 1
+        continue
+    elapsed = time.perf_counter() - start
+    phases:Dict[str, List[float]] = {}
+    for spans in sink.get_breakdown().values():
+        for name, duration in spans.items():
+            phases.setdefault(name, []).append(duration)
+            continue
+        continue
+    return {
+        'failures'             : failures,
+        'spawns_per_second'    : runs / sum(calls) if calls else None,
+        'completed_per_second' : runs / elapsed if elapsed else None,
+        'call'                 : summarize(calls),
+        'phases'               : {name: summarize(phases[name]) for name in sorted(phases)},
+    }
+
+def measure_memory(target:str, terminal:str, runs:int, timeout:float) -> Dict[str, Any]:
+    '''
+    Spawn the target 'runs' times with 'tracemalloc' on. Return the bytes that each spawn leaves
+    behind once its handle is gone, and the peak of the traced memory.
+    '''
+    # Warm-up run, such that lazy imports and caches don't count as a leak
+    spawn_and_wait(target, terminal, timeout)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        # Another one with tracemalloc on, such that whatever the supervisor thread holds while it
+        # waits for the next child is already traced
+        spawn_and_wait(target, terminal, timeout)
+        gc.collect()
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for _ in range(runs):
+            spawn_and_wait(target, terminal, timeout)
+            continue
+        gc.collect()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'runs'               : runs,
+        'retained_per_spawn' : (after - before) / runs if runs else None,
+        'peak'               : peak - before,
+    }
+
+@contextlib.contextmanager
+def stub_environment() -> Iterator[Tuple[List[str], Dict[str, str]]]:
+    '''
+    Put the stub emulators in front of the PATH, and give the discovery cache a folder of its own
+    (such that the real one isn't overwritten). Yield the stub names and the targets.
+    '''
+    saved_env = {name: os.environ.get(name) for name in ('PATH', 'XDG_CACHE_HOME')}
+    with tempfile.TemporaryDirectory(prefix='terminal_spawner_bench_') as folderpath:
+        folderpath = folderpath.replace('\\', '/')
+        os.makedirs(f'{folderpath}/bin')
+        os.makedirs(f'{folderpath}/targets')
+        terminals = create_stub_terminals(f'{folderpath}/bin')
+        targets = create_targets(f'{folderpath}/targets')
+        os.environ['PATH'] = os.pathsep.join([f'{folderpath}/bin', saved_env['PATH'] or ''])
+        os.environ['XDG_CACHE_HOME'] = f'{folderpath}/cache'
+        try:
+            yield terminals, targets
+        finally:
+            for name, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+                continue
+    return
+
+def run_benchmark(terminals:Optional[List[str]],
+                  kinds:List[str],
+                  runs:int,
+                  memory_runs:int,
+                  timeout:float,
+                  ) -> Dict[str, Any]:
+    '''
+    Run all combinations and return the results as a json-serializable dictionary.
+    '''
+    results:List[Dict[str, Any]] = []
+    sink = functions.MemorySink()
+    with stub_environment() as (stub_terminals, targets):
+        for terminal in terminals or stub_terminals:
+            if terminal not in stub_terminals:
+                print(f'WARNING: No stub for {q}{terminal}{q}, skipping it', file=sys.stderr)
+                continue
+            for kind in kinds:
+                print(f'Benchmarking {kind} child in stub {terminal} ...', file=sys.stderr)
+                functions.add_trace_sink(sink)
+                try:
+                    result = measure_latency(targets[kind], terminal, runs, timeout, sink)
+                finally:
+                    functions.remove_trace_sink(sink)
+                # Without the sink, which would keep the events of every spawn
+                if memory_runs > 0:
+                    result['memory'] = measure_memory(targets[kind], terminal, memory_runs, timeout)
+                results.append({'terminal': terminal, 'kind': kind, **result})
+                continue
+            continue
+    return {
+        'meta' : {
+            'timestamp'   : time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'platform'    : platform.platform(),
+            'python'      : sys.version,
+            'runs'        : runs,
+            'memory_runs' : memory_runs,
+        },
+        'results' : results,
+    }
+
+def get_metrics(report:Dict[str, Any]) -> Dict[str, Tuple[float, float]]:
+    '''
+    Flatten the report into the metrics that get compared with a baseline:
+    '{name: (value, slack)}'. Latencies are medians.
+    '''
+    metrics:Dict[str, Tuple[float, float]] = {}
+    for result in report['results']:
+        prefix = f'{result["terminal"]}/{result["kind"]}'
+        if result['call']['p50'] is not None:
+            metrics[f'{prefix}/call'] = (result['call']['p50'], latency_slack)
+        for name, summary in result['phases'].items():
+            # The lifetime of the child isn't the spawn layer's doing
+            if name == 'exit' or summary['p50'] is None:
+                continue
+            metrics[f'{prefix}/{name}'] = (summary['p50'], latency_slack)
+            continue
+        memory = result.get('memory')
+        if memory is not None and memory['retained_per_spawn'] is not None:
+            metrics[f'{prefix}/retained_per_spawn'] = (memory['retained_per_spawn'], memory_slack)
+        continue
+    return metrics
+
+def compare_with_baseline(report:Dict[str, Any],
+                          baseline:Dict[str, Any],
+                          threshold:float,
+                          ) -> List[str]:
+    '''
+    Return a line of text for every metric that got worse than in the baseline by more than the
+    threshold (a fraction, eg. 0.25 for 25%) and its slack. Metrics missing on either side are
+    ignored.
+    '''
+    regressions:List[str] = []
+    old_metrics = get_metrics(baseline)
+    for name, (value, slack) in get_metrics(report).items():
+        if name not in old_metrics:
+            continue
+        old_value, _ = old_metrics[name]
+        if value <= old_value * (1 + threshold) + slack:
+            continue
+        change = f'+{(value - old_value) / old_value:.0%}' if old_value > 0 else 'new'
+        regressions.append(f'{name}: {old_value:.6g} -> {value:.6g} ({change})')
+        continue
+    return regressions
+
+if __name__ == '__main__':
+    #$ Parse arguments
+    parser = argparse.ArgumentParser(description='Spawn layer micro-benchmark.')
+    parser.add_argument('--runs', type=int, default=200, help='Measured spawns per combination')
+    parser.add_argument(
+        '--memory-runs',
+        type    = int,
+        default = 50,
+        help    = 'Spawns per combination with tracemalloc on. 0 to skip the memory measurement.',
+    )
+    parser.add_argument('--timeout', type=float, default=10.0, help='Seconds to wait for each child')
+    parser.add_argument(
+        '--terminal',
+        nargs   = '+',
+        default = None,
+        help    = 'Stub emulators to measure. Default: all of them.',
+    )
+    parser.add_argument(
+        '--kind',
+        nargs   = '+',
+        choices = target_kinds,
+        default = list(target_kinds),
+        help    = 'Kinds of target to spawn',
+    )
+    parser.add_argument(
+        '--engine',
+        choices = functions.spawn_engines,
+        default = None,
+        help    = f'Spawn engine. Default: {q}popen{q}, or $TERMINAL_SPAWNER_ENGINE.',
+    )
+    parser.add_argument(
+        '--ballast',
+        type    = int,
+        default = 0,
+        help    = 'MiB of memory to allocate (and keep resident) before spawning',
+    )
+    parser.add_argument('--output', type=str, default=None, help='Write the JSON here instead of to stdout')
+    parser.add_argument('--save-baseline', type=str, default=None, help='Store the results as baseline here')
+    parser.add_argument('--baseline', type=str, default=None, help='Compare the results with this baseline')
+    parser.add_argument(
+        '--threshold',
+        type    = float,
+        default = 0.25,
+        help    = 'Fraction by which a metric may get worse than in the baseline',
+    )
+    args = parser.parse_args()
+    if platform.system().lower() == 'windows':
+        print('ERROR: The stub emulators need Linux (or another POSIX system)', file=sys.stderr)
+        sys.exit(2)
+
+    #$ Engine and ballast
+    if args.engine is not None:
+        os.environ[functions.engine_env_var] = args.engine
+        if args.engine == 'forkserver':
+            # Before the ballast, just like the Parent App starts it before importing PyQt6
+            functions.start_forkserver()
+    ballast = bytearray(args.ballast << 20)
+    # Touch every page, such that it's resident
+    for offset in range(0, len(ballast), 4096):
+        ballast[offset] = 1
+        continue
+
+    #$ Run
+    # Keep stdout clean for the JSON output
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_benchmark(args.terminal, args.kind, args.runs, args.memory_runs, args.timeout)
+    report['meta']['engine'] = os.environ.get(functions.engine_env_var) or 'popen'
+    report['meta']['ballast_mib'] = args.ballast
+
+    #$ Output
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    #$ Compare
+    exit_code = 0
+    if args.baseline is not None:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(report, baseline, args.threshold)
+        for line in regressions:
+            print(f'REGRESSION: {line}', file=sys.stderr)
+            continue
+        if regressions:
+            exit_code = 1
+        else:
+            print(f'No regressions against {q}{args.baseline}{q}', file=sys.stderr)
+    sys.exit(exit_code)
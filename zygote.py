@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright 2018-2023 Johan Cockx, Matic Kukovec and Kristof Mulier.
+"""
+# SUMMARY:
+# Zygote for the Child App (Linux only). Most of a child launch goes to starting a fresh interpreter
+# and importing PyQt6. The zygote is a long-lived helper process that did all of that already. It
+# keeps a pool of pre-forked warm workers. Each worker waits for a request, then turns into a new
+# Child App instance in milliseconds.
+#
+# The terminal spawned for the child doesn't run the Child App itself, but the tiny 'attach' client
+# from this file. The client connects to the zygote and hands over its stdin, stdout and stderr (the
+# terminal), its arguments, environment and working directory. A warm worker picks them up and runs
+# the Child App. The client forwards signals to the worker, and exits with the worker's returncode.
+# If the zygote can't be reached, the client falls back to launching the Child App normally.
+#
+# Usage from the parent:
+#
+#     pool = zygote.ZygotePool(pool_size=2)
+#     pool.start()
+#     wait_func = functions.spawn_new_terminal(child_app_path, argv, zygote=pool)
+#     ...
+#     pool.stop()
+#
+# Command line (used internally):
+#
+#     $ python zygote.py serve <socket> [--pool-size N]
+#     $ python zygote.py attach <socket> [--fallback <script>] [-- <args>]
+from __future__ import annotations
+from typing import *
+import sys, os, socket, json, signal, select, struct, tempfile, shutil, subprocess, argparse
+import traceback
+q = "'"
+
+# Maximal size of a request (arguments and environment)
+max_request_size:int = 1 << 20
+
+
+#^                                            PARENT SIDE                                         ^#
+#% ============================================================================================== %#
+#%                                                                                                %#
+#%                                                                                                %#
+class ZygotePool:
+    '''
+    Pool of warm Child App instances, served by a zygote process. Pass it to
+    'functions.spawn_new_terminal()' with the 'zygote' keyword argument.
+    '''
+    def __init__(self, pool_size:int = 2) -> None:
+        '''
+        :param pool_size: Number of warm workers kept ready.
+        '''
+        self.pool_size = pool_size
+        self.socket_path:Optional[str] = None
+        self.__folderpath:Optional[str] = None
+        self.__process:Optional[subprocess.Popen] = None
+        return
+
+    def __enter__(self) -> ZygotePool:
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+        return
+
+    def start(self, timeout:float = 60.0) -> None:
+        '''
+        Launch the zygote and wait until its workers are warm.
+        '''
+        import functions
+        assert self.__process is None
+        self.__folderpath = tempfile.mkdtemp(prefix='terminal_spawner_zygote_').replace('\\', '/')
+        self.socket_path = f'{self.__folderpath}/zygote.sock'
+        ready_listener = functions.ReadinessListener()
+        try:
+            self.__process = subprocess.Popen(
+                [
+                    get_interpreter(),
+                    get_zygote_filepath(),
+                    'serve',
+                    self.socket_path,
+                    '--pool-size', str(self.pool_size),
+                ],
+                env = ready_listener.get_env(),
+            )
+            process = self.__process
+            ok = ready_listener.wait(timeout, lambda: process.poll() is None)
+        finally:
+            ready_listener.close()
+        if not ok:
+            self.stop()
+            raise RuntimeError('Zygote failed to start')
+        return
+
+    def stop(self) -> None:
+        '''
+        Stop the zygote. The Child App instances it launched keep running.
+        '''
+        if self.__process is not None:
+            self.__process.terminate()
+            try:
+                self.__process.wait(5.0)
+            except subprocess.TimeoutExpired:
+                self.__process.kill()
+                self.__process.wait()
+            self.__process = None
+        if self.__folderpath is not None:
+            shutil.rmtree(self.__folderpath, ignore_errors=True)
+            self.__folderpath = None
+        return
+
+    def serves(self, script_path:str) -> bool:
+        '''
+        Return True if the given script is the Child App, the only one the workers can run.
+        '''
+        return os.path.realpath(script_path) == os.path.realpath(get_child_app_filepath())
+
+    def get_command(self, script_path:str, argv:List[str]) -> Tuple[str, List[str]]:
+        '''
+        Return the program and its arguments to be launched in the terminal, instead of the Child
+        App itself. Raise ValueError for any other script.
+
+        :param script_path: The Child App script. Used as fallback if the zygote is unreachable.
+        :param argv:        The arguments for the Child App.
+        '''
+        if self.socket_path is None:
+            raise RuntimeError('Zygote not started')
+        if not self.serves(script_path):
+            raise ValueError(f'The zygote only runs the Child App, not {q}{script_path}{q}')
+        return get_interpreter(), [
+            get_zygote_filepath(),
+            'attach',
+            self.socket_path,
+            '--fallback', script_path,
+            '--',
+            *argv,
+        ]
+
+def get_zygote_filepath() -> str:
+    '''
+    Return the path to this file.
+    '''
+    return os.path.realpath(__file__).replace('\\', '/')
+
+def get_child_app_filepath() -> str:
+    '''
+    Return the path to the Child App script, next to this file.
+    '''
+    return f'{os.path.dirname(get_zygote_filepath())}/child_app.py'
+
+def get_interpreter() -> str:
+    '''
+    Return the python interpreter to run the zygote and the attach client with: the same one that
+    'functions.spawn_new_terminal()' runs python scripts with.
+    '''
+    import functions
+    return functions.get_python_executable()
+
+
+#^                                           ZYGOTE SIDE                                          ^#
+#% ============================================================================================== %#
+#%                                                                                                %#
+#%                                                                                                %#
+def serve(socket_path:str, pool_size:int) -> int:
+    '''
+    Run the zygote: warm up, fork the pool of workers and replace each worker that gets taken. Stop
+    when the parent is gone, or on SIGTERM.
+    '''
+    #& Warm up
+    import functions, child_app, child_window
+    from PyQt6 import QtWidgets, QtCore, QtGui
+
+    #& Listen
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    listener.listen(16)
+    taken_read, taken_write = os.pipe()
+    idle_workers:Set[int] = set()
+    parent_pid = os.getppid()
+
+    def on_sigterm(signum:int, frame:Any) -> None:
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+    #& Serve
+    try:
+        for _ in range(pool_size):
+            idle_workers.add(__fork_worker(listener, taken_read, taken_write))
+        functions.notify_ready()
+        while os.getppid() == parent_pid:
+            #$ Replace the workers that got taken
+            readable, _, _ = select.select([taken_read], [], [], 1.0)
+            if readable:
+                data = os.read(taken_read, 4096)
+                for (pid,) in struct.iter_unpack('i', data):
+                    idle_workers.discard(pid)
+                    idle_workers.add(__fork_worker(listener, taken_read, taken_write))
+                    continue
+            #$ Reap the Child App instances that exited
+            while True:
+                try:
+                    pid, _ = os.waitpid(-1, os.WNOHANG)
+                except ChildProcessError:
+                    break
+                if pid == 0:
+                    break
+                idle_workers.discard(pid)
+                continue
+            continue
+    finally:
+        #& Clean up
+        # Only the idle workers are stopped. The taken ones are running Child App instances.
+        for pid in idle_workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            continue
+        listener.close()
+        try:
+            os.remove(socket_path)
+        except OSError:
+            pass
+    return 0
+
+def __fork_worker(listener:socket.socket, taken_read:int, taken_write:int) -> int:
+    '''
+    Fork a warm worker. Return its pid.
+    '''
+    pid = os.fork()
+    if pid != 0:
+        return pid
+    # In the worker
+    returncode = 1
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        os.close(taken_read)
+        returncode = __run_worker(listener, taken_write)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        os._exit(returncode)
+
+def __run_worker(listener:socket.socket, taken_write:int) -> int:
+    '''
+    Wait for a request, then turn into a Child App instance. Return its returncode.
+    '''
+    import child_app
+
+    #& Take a request
+    connection, _ = listener.accept()
+    os.write(taken_write, struct.pack('i', os.getpid()))
+    os.close(taken_write)
+    listener.close()
+    message, fds, _, _ = socket.recv_fds(connection, max_request_size, 3)
+    request = json.loads(message)
+
+    #& Take over the terminal
+    sys.stdout.flush()
+    sys.stderr.flush()
+    for target_fd, fd in enumerate(fds):
+        os.dup2(fd, target_fd)
+        os.close(fd)
+        continue
+    connection.sendall(json.dumps({'pid': os.getpid()}).encode('utf-8') + b'\n')
+
+    #& Become the Child App
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+    sys.argv = [child_app.get_script_filepath(), *request['argv']]
+    returncode = 1
+    try:
+        child_app.parse_arguments(request['argv'])
+        returncode = child_app.main()
+    except SystemExit as e:
+        returncode = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            connection.sendall(json.dumps({'returncode': returncode}).encode('utf-8') + b'\n')
+        except OSError:
+            pass
+    return returncode
+
+
+#^                                           CLIENT SIDE                                          ^#
+#% ============================================================================================== %#
+#% The attach client runs in the terminal. It should start fast, so it only imports stdlib        %#
+#% modules that are loaded anyway.                                                                %#
+#%                                                                                                %#
+def attach(socket_path:str, fallback_script:Optional[str], argv:List[str]) -> int:
+    '''
+    Hand over this terminal to a warm worker of the zygote, and wait for it to finish. Return its
+    returncode.
+    '''
+    #& Connect
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(socket_path)
+    except OSError:
+        if fallback_script is None:
+            print(f'ERROR: Cannot reach zygote at {q}{socket_path}{q}')
+            return 1
+        # Launch the Child App the normal way
+        os.execv(sys.executable, [sys.executable, fallback_script, *argv])
+
+    #& Hand over the terminal
+    request = {
+        'argv' : argv,
+        'env'  : dict(os.environ),
+        'cwd'  : os.getcwd(),
+    }
+    socket.send_fds(s, [json.dumps(request).encode('utf-8')], [0, 1, 2])
+    f = s.makefile('rb')
+    reply = f.readline()
+    if not reply:
+        return 1
+    worker_pid:int = json.loads(reply)['pid']
+
+    #& Forward signals
+    def forward(signum:int, frame:Any) -> None:
+        try:
+            os.kill(worker_pid, signum)
+        except ProcessLookupError:
+            pass
+        return
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT):
+        signal.signal(signum, forward)
+
+    #& Wait for the returncode
+    # If the connection closes without a returncode, the worker crashed.
+    reply = f.readline()
+    if not reply:
+        return 1
+    return int(json.loads(reply)['returncode'])
+
+if __name__ == '__main__':
+    #$ Parse arguments
+    parser = argparse.ArgumentParser(description='Zygote for the Child App.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subparsers.add_parser('serve', help='Run the zygote')
+    serve_parser.add_argument('socket', type=str, help='Path to the socket to listen on')
+    serve_parser.add_argument('--pool-size', type=int, default=2, help='Number of warm workers')
+    attach_parser = subparsers.add_parser('attach', help='Run a Child App through the zygote')
+    attach_parser.add_argument('socket', type=str, help='Path to the socket of the zygote')
+    attach_parser.add_argument('--fallback', type=str, default=None, help='Child App script to run if the zygote is unreachable')
+    # Everything after '--' is for the Child App
+    own_argv, child_argv = sys.argv[1:], []
+    if '--' in own_argv:
+        i = own_argv.index('--')
+        own_argv, child_argv = own_argv[:i], own_argv[i + 1:]
+    args = parser.parse_args(own_argv)
+
+    #$ Run
+    if args.command == 'serve':
+        sys.exit(serve(args.socket, args.pool_size))
+    sys.exit(attach(args.socket, args.fallback, child_argv))